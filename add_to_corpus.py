@@ -0,0 +1,36 @@
+import os
+import sys
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from doc_index import build_document_index
+from corpus_index import get_corpus_index
+
+# Load .env file from current directory
+load_dotenv(".env")
+
+client = OpenAI(api_key=os.getenv("OPENAI_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+
+
+def add_filing(pdf_path, ticker, year):
+    # Reuses the per-document index (extraction, chunks, embeddings) if the filing was seen before
+    index = build_document_index(pdf_path, client)
+    if not index["chunks"]:
+        print(f"❌ No text indexed from {pdf_path}")
+        return
+    added = get_corpus_index().add_document(index["sha256"], ticker, year, index["chunks"], index["embeddings"])
+    if added:
+        print(f"✅ Added {added} chunks from {pdf_path} ({ticker.upper()} {year})")
+    else:
+        print(f"⏭️ {pdf_path} is already in the corpus")
+
+
+if __name__ == "__main__":
+    # python add_to_corpus.py TICKER YEAR report.pdf [report2.pdf ...]
+    if len(sys.argv) < 4:
+        print("Usage: python add_to_corpus.py TICKER YEAR file.pdf [file.pdf ...]")
+        sys.exit(1)
+    ticker, year = sys.argv[1], int(sys.argv[2])
+    for path in sys.argv[3:]:
+        add_filing(path, ticker, year)
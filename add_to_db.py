@@ -1,10 +1,17 @@
 import os
+import sys
 import json
+import time
+import hashlib
 from datetime import datetime
+from typing import List, Dict, Iterator
 import requests
 import pytz
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from peer_analytics import METRICS, parse_number, parse_quarter
+
 # Load .env file from current directory
 load_dotenv(".env")  # Adjust path if needed
 
@@ -21,40 +28,215 @@ headers = {
 
 ADDED_AT_TIME = datetime.now(pytz.timezone("Asia/Kolkata")).isoformat()
 
+# Upserts need a unique key and a column for the row hash, and readers watch a load stamp; run once:
+#   ALTER TABLE financials ADD COLUMN IF NOT EXISTS content_hash text;
+#   ALTER TABLE financials ADD CONSTRAINT financials_ticker_quarter_key UNIQUE (ticker, quarter_ended);
+#   CREATE TABLE IF NOT EXISTS load_versions (table_name text PRIMARY KEY, version text, loaded_at timestamptz);
+# Figures are stored as numbers with the quarter's end date alongside; "(1,234)" is negative,
+# as in peer_analytics.parse_number, and "-" or "--" become NULL:
+#   ALTER TABLE financials ADD COLUMN IF NOT EXISTS period_end date;
+#   ALTER TABLE financials ALTER COLUMN total_income TYPE numeric
+#     USING CASE WHEN total_income ~ '^\s*[(-]' THEN -1 ELSE 1 END
+#           * NULLIF(regexp_replace(total_income, '[^0-9.]', '', 'g'), '')::numeric;
+#   (the same for net_profit_loss and earnings_per_share)
+LOAD_VERSION_TABLE = "load_versions"
+KEY_COLUMNS = ("ticker", "quarter_ended")
+HASH_COLUMN = "content_hash"
+BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))
+MAX_ATTEMPTS = int(os.getenv("DB_MAX_ATTEMPTS", "4"))
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 30
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
 
-def delete_all_rows():
-    print("🧹 Deleting existing rows...")
-    url = f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}?id=not.is.null"
-    response = requests.delete(url, headers=headers)
-    if response.status_code == 204:
-        print("✅ All rows deleted.")
-    else:
-        print(f"❌ Failed to delete rows. Status: {response.status_code}")
-        print(response.text)
+_session = None
 
 
-def upload_json(file_path):
+def get_session() -> requests.Session:
+    # Keep-alive connections are reused across every batch
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def iter_rows(file_path: str, buffer_size: int = 1 << 16) -> Iterator[Dict]:
+    """Rows of a JSON array file (output.json) or a JSON-lines file, read a block at a time."""
+    decoder = json.JSONDecoder()
     with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        
+        buffer = f.read(buffer_size).lstrip()
+        in_array = buffer.startswith("[")
+        if in_array:
+            buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if in_array and buffer.startswith("]"):
+                return
+            try:
+                row, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                more = f.read(buffer_size)
+                if not more:
+                    if buffer:
+                        raise ValueError(f"Truncated JSON near: {buffer[:80]!r}")
+                    return
+                buffer += more
+                continue
+            yield row
+            buffer = buffer[end:]
+
+
+def quarter_rows(row: Dict) -> List[Dict]:
+    """One table row per quarter the scraper saw, figures parsed to numbers. Rows from older
+    scrapes, without a "quarters" list, are a single quarter."""
+    base = {k: v for k, v in row.items() if k != "quarters"}
+    rows = []
+    for quarter in row.get("quarters") or [row]:
+        expanded = {**base, "quarter_ended": quarter.get("quarter_ended")}
+        for metric in METRICS:
+            expanded[metric] = parse_number(quarter.get(metric))
+        period_end = parse_quarter(expanded["quarter_ended"])
+        expanded["period_end"] = period_end.isoformat() if period_end else None
+        rows.append(expanded)
+    return rows
+
+
+def row_hash(row: Dict) -> str:
+    content = {k: v for k, v in row.items() if k not in ("id", "added_at", HASH_COLUMN)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _in_filter(values) -> str:
+    # Quoted so symbols with commas, dots or '&' survive PostgREST parsing
+    return "in.(" + ",".join('"' + str(v).replace('"', '\\"') + '"' for v in sorted(set(values))) + ")"
 
-    # Optional: Add timestamp to each row
-    # for row in data:
-    #     row["added_at"] = ADDED_AT_TIME
 
-    response = requests.post(
-        f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}",
-        headers=headers,
-        json=data,
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    # Transient failures (timeouts, 5xx, 429) are retried with backoff; anything else is returned
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = get_session().request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            problem = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            response, problem = None, str(e)
+        if attempt < MAX_ATTEMPTS:
+            delay = BACKOFF_SECONDS * 2 ** (attempt - 1)
+            print(f"🔁 {method} failed ({problem}), retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.0f}s")
+            time.sleep(delay)
+    if response is None:
+        raise requests.ConnectionError(problem)
+    return response
+
+
+def fetch_hashes(tickers: List[str]) -> Dict:
+    response = _request("GET", f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}",
+                        params={"select": f"{','.join(KEY_COLUMNS)},{HASH_COLUMN}", "ticker": _in_filter(tickers)})
+    response.raise_for_status()
+    return {tuple(row[k] for k in KEY_COLUMNS): row.get(HASH_COLUMN) for row in response.json()}
+
+
+def upsert_rows(rows: List[Dict]) -> List[Dict]:
+    """Upsert rows; returns the rows the server rejected. A rejected batch is split in half
+    until the bad rows are isolated, so one bad row never sinks the rest."""
+    if not rows:
+        return []
+    response = _request(
+        "POST", f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}",
+        params={"on_conflict": ",".join(KEY_COLUMNS)},
+        headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+        json=rows,
     )
+    if response.status_code in (200, 201, 204):
+        return []
+    if len(rows) == 1 or response.status_code in RETRY_STATUSES:
+        print(f"❌ {len(rows)} row(s) rejected starting at {rows[0].get('ticker')}: "
+              f"{response.status_code} {response.text[:200]}")
+        return rows
+    middle = len(rows) // 2
+    return upsert_rows(rows[:middle]) + upsert_rows(rows[middle:])
+
+
+def load_batch(batch: List[Dict], stats: Dict, failed: List[Dict]):
+    # Later rows for the same key win, as they would in a replace
+    by_key = {}
+    for row in batch:
+        if not all(row.get(k) for k in KEY_COLUMNS):
+            stats["invalid"] += 1
+            failed.append(row)
+            continue
+        by_key[tuple(row[k] for k in KEY_COLUMNS)] = row
+    if not by_key:
+        return
+    try:
+        existing = fetch_hashes([key[0] for key in by_key])
+    except requests.RequestException as e:
+        print(f"❌ Batch of {len(by_key)} rows skipped, could not read current hashes: {e}")
+        stats["failed"] += len(by_key)
+        failed.extend(by_key.values())
+        return
+    changed = []
+    for key, row in by_key.items():
+        digest = row_hash(row)
+        if existing.get(key) == digest:
+            stats["unchanged"] += 1
+        else:
+            changed.append({**row, HASH_COLUMN: digest})
+    try:
+        rejected = upsert_rows(changed)
+    except requests.RequestException as e:
+        print(f"❌ Batch of {len(changed)} rows failed: {e}")
+        rejected = changed
+    stats["upserted"] += len(changed) - len(rejected)
+    stats["failed"] += len(rejected)
+    failed.extend(rejected)
 
-    if response.status_code == 201:
-        print(f"✅ Inserted {len(data)} rows from {file_path}")
+
+def stamp_load_version():
+    # main_supa drops its cached financials when this stamp changes
+    version = datetime.now(pytz.timezone("Asia/Kolkata")).isoformat()
+    response = _request(
+        "POST", f"{SUPABASE_URL}/rest/v1/{LOAD_VERSION_TABLE}",
+        params={"on_conflict": "table_name"},
+        headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+        json=[{"table_name": TABLE_NAME, "version": version, "loaded_at": version}],
+    )
+    if response.status_code in (200, 201, 204):
+        print(f"✅ Load version set to {version}")
     else:
-        print(f"❌ Failed to insert data. Status: {response.status_code}")
+        print(f"❌ Failed to set load version. Status: {response.status_code}")
         print(response.text)
 
 
+def upload_json(file_path, batch_size: int = BATCH_SIZE) -> Dict:
+    stats = {"rows": 0, "upserted": 0, "unchanged": 0, "invalid": 0, "failed": 0}
+    failed = []
+    batch = []
+    for scraped in iter_rows(file_path):
+        for row in quarter_rows(scraped):
+            stats["rows"] += 1
+            batch.append(row)
+            if len(batch) >= batch_size:
+                load_batch(batch, stats, failed)
+                batch = []
+    load_batch(batch, stats, failed)
+    if stats["upserted"]:
+        stamp_load_version()
+
+    print(f"✅ {file_path}: {stats['upserted']} rows upserted, {stats['unchanged']} unchanged, "
+          f"{stats['invalid']} invalid, {stats['failed']} failed")
+    if failed:
+        failed_path = file_path + ".failed.json"
+        with open(failed_path, "w", encoding="utf-8") as f:
+            json.dump(failed, f, indent=2)
+        print(f"⚠️ Rows that did not load were saved to {failed_path}")
+    return stats
+
+
 if __name__ == "__main__":
-    delete_all_rows()
-    upload_json("output.json")
+    stats = upload_json(sys.argv[1] if len(sys.argv) > 1 else "output.json")
+    sys.exit(1 if stats["failed"] or stats["invalid"] else 0)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+import numpy as np
+
+# --- Config ---
+# Shared by every worker like the workspace manifest; answers only depend on what is in the key
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", ".answer_cache")
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "20000"))
+
+_schema_ready = set()
+# Hit/miss counts are kept in memory per worker process, as metrics.py does, so a lookup costs
+# no extra write
+_counters_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+
+
+def _cache_path() -> str:
+    return os.path.join(ANSWER_CACHE_DIR, "cache.sqlite3")
+
+
+def _connect() -> sqlite3.Connection:
+    path = _cache_path()
+    os.makedirs(ANSWER_CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if path not in _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used_at);
+            CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings(last_used_at);
+        """)
+        _schema_ready.add(path)
+    return conn
+
+
+@contextmanager
+def _cache():
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _count(name: str):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + 1
+
+
+def answer_key(model: str, question: str, document_shas: List[str], chunk_ids: List[str], **params) -> str:
+    """Cache key for one completion: the documents (in workspace order, which fixes the Document_N
+    labels), the question, the model, the retrieved chunks and any generation parameters."""
+    payload = {
+        "model": model,
+        "question": question,
+        "documents": list(document_shas),
+        "chunks": list(chunk_ids),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _get(table: str, column: str, key: str, ttl: int, counter: str):
+    now = time.time()
+    with _cache() as conn:
+        row = conn.execute(f"SELECT {column}, created_at FROM {table} WHERE key = ?", (key,)).fetchone()
+        if row is not None and row["created_at"] >= now - ttl:
+            conn.execute(f"UPDATE {table} SET last_used_at = ? WHERE key = ?", (now, key))
+            _count(f"{counter}_hits")
+            return row[column]
+    _count(f"{counter}_misses")
+    return None
+
+
+def _put(table: str, column: str, key: str, value, max_entries: int):
+    now = time.time()
+    with _cache() as conn:
+        conn.execute(f"INSERT OR REPLACE INTO {table} (key, {column}, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                     (key, value, now, now))
+        # Least recently used entries beyond the cap go first
+        conn.execute(f"DELETE FROM {table} WHERE key IN "
+                     f"(SELECT key FROM {table} ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)", (max_entries,))
+
+
+def get_answer(key: str, ttl: int = ANSWER_CACHE_TTL_SECONDS) -> Optional[str]:
+    return _get("answers", "answer", key, ttl, "answer")
+
+
+def put_answer(key: str, answer: str, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+    _put("answers", "answer", key, answer, max_entries)
+
+
+def _embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(json.dumps([model, text]).encode()).hexdigest()
+
+
+def get_query_embedding(model: str, text: str, ttl: int = ANSWER_CACHE_TTL_SECONDS) -> Optional[np.ndarray]:
+    # The fixed report prompts are embedded over and over; their vectors never change for a model
+    blob = _get("query_embeddings", "embedding", _embedding_key(model, text), ttl, "embedding")
+    return None if blob is None else np.frombuffer(blob, dtype=np.float32)
+
+
+def put_query_embedding(model: str, text: str, embedding: np.ndarray, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+    blob = np.asarray(embedding, dtype=np.float32).tobytes()
+    _put("query_embeddings", "embedding", _embedding_key(model, text), blob, max_entries)
+
+
+def cleanup_expired(ttl: int = ANSWER_CACHE_TTL_SECONDS) -> int:
+    cutoff = time.time() - ttl
+    with _cache() as conn:
+        removed = conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,)).rowcount
+        removed += conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (cutoff,)).rowcount
+    return removed
+
+
+def cache_stats() -> Dict:
+    """Entry counts for the shared cache; hits and misses are for this worker process only."""
+    with _counters_lock:
+        counters = dict(_counters)
+    with _cache() as conn:
+        answers = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        embeddings = conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+    stats = {"answers": answers, "query_embeddings": embeddings}
+    for name in ("answer", "embedding"):
+        hits, misses = counters.get(f"{name}_hits", 0), counters.get(f"{name}_misses", 0)
+        stats[f"{name}_hits"] = hits
+        stats[f"{name}_misses"] = misses
+        stats[f"{name}_hit_rate"] = round(hits / (hits + misses), 4) if hits + misses else None
+    return stats
@@ -0,0 +1,94 @@
+"""Load a synthetic output.json into the fake PostgREST server with add_to_db.upload_json and
+compare it with the old delete-all-then-insert load.
+
+    python bench/bench_add_to_db.py --rows 50000 --changed 0.05 --fail-every 7
+
+Runs are: the old replace load, a first incremental load into an empty table, a reload of
+the same file (every row unchanged), and a reload with a fraction of rows changed plus a few
+rows missing their quarter. fail_every injects a 503 on every Nth request to exercise retry.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import start_fake_supabase  # noqa: E402
+
+
+def make_rows(count, seed):
+    rng = random.Random(seed)
+    return [{
+        "ticker": f"T{i // 4:05d}" if i % 7 else f"M&M{i // 4}",
+        "quarter_ended": ["31-Mar-2025", "31-Dec-2024", "30-Sep-2024", "30-Jun-2024"][i % 4],
+        "total_income": f"{rng.uniform(1e3, 1e7):,.2f}",
+        "net_profit_loss": f"{rng.uniform(-1e5, 1e6):,.2f}",
+        "earnings_per_share": f"{rng.uniform(-5, 90):.2f}",
+    } for i in range(count)]
+
+
+def write_json(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--changed", type=float, default=0.05)
+    parser.add_argument("--invalid", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--fail-every", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    server = start_fake_supabase(latency=args.latency, fail_every=args.fail_every)
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_SERVICE_KEY="fake")
+    import add_to_db
+    add_to_db.BACKOFF_SECONDS = 0.05
+
+    workdir = tempfile.mkdtemp(prefix="bench-db-")
+    rows = make_rows(args.rows, seed=1)
+    path = write_json(os.path.join(workdir, "output.json"), rows)
+
+    # Old loader: one DELETE, then the whole file in one POST (the table is empty meanwhile)
+    server.fail_every = 0
+    start = time.perf_counter()
+    add_to_db.get_session().delete(f"{server.url}/rest/v1/financials?id=not.is.null")
+    with open(path, encoding="utf-8") as f:
+        response = add_to_db.get_session().post(f"{server.url}/rest/v1/financials", json=json.load(f))
+    print(json.dumps({"run": "replace (old)", "status": response.status_code,
+                      "seconds": round(time.perf_counter() - start, 2)}), flush=True)
+    server.tables["financials"] = []
+    server.indexes = {}
+    server.fail_every = args.fail_every
+
+    changed = [dict(row) for row in rows]
+    rng = random.Random(2)
+    for row in rng.sample(changed, int(len(changed) * args.changed)):
+        row["earnings_per_share"] = f"{float(row['earnings_per_share']) + 1:.2f}"
+    for row in rng.sample(changed, args.invalid):
+        row["quarter_ended"] = None
+    runs = [("first load", path), ("reload unchanged", path),
+            (f"reload {args.changed:.0%} changed", write_json(os.path.join(workdir, "changed.json"), changed))]
+    for name, run_path in runs:
+        requests_before, written_before = server.stats["requests"], server.stats["rows_written"]
+        start = time.perf_counter()
+        stats = add_to_db.upload_json(run_path, batch_size=args.batch_size)
+        print(json.dumps({
+            "run": name, "seconds": round(time.perf_counter() - start, 2),
+            "requests": server.stats["requests"] - requests_before,
+            "rows_written": server.stats["rows_written"] - written_before, **stats,
+            "table_rows": len(server.tables["financials"]),
+        }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
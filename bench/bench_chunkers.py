@@ -0,0 +1,190 @@
+"""Compare chunkers on retrieval hit rate and token cost, offline.
+
+    python bench/bench_chunkers.py --pages 300 --facts 60
+
+Plants unique "needle" facts in a synthetic filing (prose plus tables), chunks it with the
+old 1000-character windows, the old 250-word windows and chunker.iter_token_chunks, then asks
+one question per fact. A hit means a top-k chunk contains the whole fact sentence; the
+report also counts tables kept whole in one chunk and chunks that start mid-sentence.
+
+Embeddings are hashed TF-IDF bag-of-words vectors standing in for the embedding model, so
+hit rates compare the chunkers with each other rather than predict production accuracy.
+Token counts use chunker.count_tokens for every chunker (tiktoken when it is available).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from synth_pdf import make_pdf  # noqa: E402
+from pdf_text import extract_pdf_text  # noqa: E402
+from chunker import iter_token_chunks, count_tokens_batch  # noqa: E402
+from retrieval import VectorIndex  # noqa: E402
+
+
+def clean_text(text: str) -> str:
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s\.,;:!?()-]', ' ', text)
+    return text.strip()
+
+
+def chunk_text(text: str, max_chunk_size: int = 1000, overlap: int = 100):
+    chunks = []
+    start = 0
+    while start < len(text):
+        chunks.append(text[start:start + max_chunk_size].strip())
+        start += max_chunk_size - overlap
+    return chunks
+
+
+def char_windows(pages):
+    # The old pdf_text chunking: 1000-character windows over the document's cleaned pages
+    return chunk_text(" ".join(text for text in (clean_text(page["text"]) for page in pages) if text))
+
+
+def word_windows(pages, chunk_size=250, overlap=50):
+    # The old main_scrape chunking: 250-word windows with 50 words of overlap
+    words = " ".join(page["text"] for page in pages).split()
+    return [" ".join(words[start:start + chunk_size]) for start in range(0, len(words), chunk_size - overlap)]
+
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "zen", "tor", "vel", "dun", "quar", "sil", "bex", "nor", "pim", "gal"]
+CHUNKERS = {
+    "chars_1000": char_windows,
+    "words_250": word_windows,
+    "tokens_256": lambda pages: [c["text"] for c in iter_token_chunks(pages)],
+}
+
+
+def _name(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(3)).capitalize()
+
+
+def make_needles(rng: random.Random, count: int, pages: int):
+    facts, questions = {}, []
+    for _ in range(count):
+        plant, town, product = _name(rng), _name(rng), _name(rng).lower()
+        tonnes = rng.randint(1000, 999999)
+        fact = f"The {plant} plant at {town} shipped {tonnes:,} tonnes of {product} during the year."
+        facts.setdefault(rng.randint(1, pages), []).append(fact)
+        questions.append((f"How many tonnes of {product} did the {plant} plant at {town} ship?", fact))
+    return facts, questions
+
+
+class HashedTfidf:
+    def __init__(self, dim: int = 8192):
+        self.dim = dim
+        self.columns = {}
+
+    def _column(self, word: str) -> int:
+        if word not in self.columns:
+            self.columns[word] = zlib.crc32(word.encode()) % self.dim
+        return self.columns[word]
+
+    def counts(self, texts):
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                rows.append(row)
+                cols.append(self._column(word))
+        flat = np.bincount(np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(cols, dtype=np.int64),
+                           minlength=len(texts) * self.dim)
+        return flat.reshape(len(texts), self.dim).astype(np.float32)
+
+    def fit(self, texts):
+        counts = self.counts(texts)
+        self.idf = np.log((1 + len(texts)) / (1 + (counts > 0).sum(axis=0))).astype(np.float32) + 1
+        return counts * self.idf
+
+    def transform(self, texts):
+        return self.counts(texts) * self.idf
+
+
+def normalize(text: str) -> str:
+    # Words only, so chunkers that strip symbols or keep line breaks compare alike
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def find_tables(pages):
+    # synth_pdf tables are a "Particulars" heading row followed by six line items
+    tables = []
+    for page in pages:
+        lines = page["text"].split("\n")
+        for i, line in enumerate(lines):
+            if line.startswith("Particulars"):
+                tables.append(normalize("\n".join(lines[i:i + 7])))
+    return tables
+
+
+def evaluate(name: str, pages, questions, tables, ks):
+    start = time.perf_counter()
+    chunks = [text for text in CHUNKERS[name](pages) if text]
+    chunk_ms = (time.perf_counter() - start) * 1000
+
+    tokens = np.asarray(count_tokens_batch(chunks))
+    normalized = [normalize(text) for text in chunks]
+    facts = [normalize(fact) for _, fact in questions]
+    intact = sum(1 for fact in facts if any(fact in text for text in normalized))
+    tables_intact = sum(1 for table in tables if any(table in text for text in normalized))
+    mid_sentence = sum(1 for text in chunks if not text.lstrip("\"'(")[:1].isupper() and not text[:1].isdigit())
+
+    vectorizer = HashedTfidf()
+    index = VectorIndex(vectorizer.fit(chunks))
+    indices, _ = index.search_batch(vectorizer.transform([q for q, _ in questions]), max(ks))
+
+    row = {
+        "chunker": name,
+        "chunks": len(chunks),
+        "chunk_ms": round(chunk_ms, 1),
+        "embedding_tokens": int(tokens.sum()),
+        "mean_chunk_tokens": round(float(tokens.mean()), 1),
+        "max_chunk_tokens": int(tokens.max()),
+        "facts_intact": round(intact / len(questions), 3),
+        "tables_intact": round(tables_intact / len(tables), 3) if tables else None,
+        "mid_sentence_starts": round(mid_sentence / len(chunks), 3),
+    }
+    for k in ks:
+        hits = sum(
+            1 for fact, top in zip(facts, indices)
+            if any(fact in normalized[i] for i in top[:k])
+        )
+        row[f"hit@{k}"] = round(hits / len(questions), 3)
+        row[f"context_tokens@{k}"] = round(float(tokens[indices[:, :k]].sum(axis=1).mean()), 1)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--facts", type=int, default=60)
+    parser.add_argument("--table-every", type=int, default=3)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "webnew-bench-pdfs"))
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    facts, questions = make_needles(rng, args.facts, args.pages)
+    os.makedirs(args.workdir, exist_ok=True)
+    path = make_pdf(os.path.join(args.workdir, f"needles_{args.pages}_{args.seed}.pdf"), pages=args.pages,
+                    seed=args.seed, facts=facts, table_every=args.table_every)
+    pages = extract_pdf_text(path)
+    tables = find_tables(pages)
+
+    for name in CHUNKERS:
+        print(json.dumps(evaluate(name, pages, questions, tables, args.k)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Prompt size, answer coverage and latency of context packing against the old top-10 join.
+
+    python bench/bench_context.py --pages 120 --facts 40 --budget 2000
+
+Two synthetic filings share --shared of their pages word for word, like consecutive annual
+reports that repeat their boilerplate, and each has its own planted facts. For every question the old
+context (top 10 chunks, each labelled, joined as is) is compared with pack_context over the
+top 20 candidates: context tokens, whether the planted fact made it into the context, and
+packing time. With --real the completions go to the OpenAI API and the answers are checked
+for the planted figure; offline the fake server only gives prompt-size numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402
+
+from synth_pdf import page_lines  # noqa: E402
+from bench_chunkers import make_needles, normalize  # noqa: E402
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2)
+
+
+def make_report(path, pages, doc_seed, shared_seed, facts, shared=0.6, table_every=4):
+    # Pages drawn from shared_seed come out identical in every report built with it
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        reuse = random.Random(shared_seed * 7919 + page_number).random() < shared
+        rng = random.Random((shared_seed if reuse else doc_seed) * 100003 + page_number)
+        lines = page_lines(rng, page_number, 60, facts.get(page_number), page_number % table_every == 0)
+        doc.new_page().insert_text((36, 40), "\n".join(lines), fontsize=6.5, fontname="cour")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def old_context(chunks):
+    # What build_prompt sent before packing: every retrieved chunk, labelled, in rank order
+    parts = []
+    for chunk in chunks:
+        pages = f"p.{chunk['page_start']}"
+        if chunk["page_end"] != chunk["page_start"]:
+            pages += f"-{chunk['page_end']}"
+        parts.append(f"[{chunk['source']}, {pages}, chunk {chunk['chunk_number']}]\n{chunk['text']}")
+    return "\n\n".join(parts)
+
+
+async def run(args, workdir):
+    import main_supa
+    from chunker import count_tokens
+    from context_packer import pack_context
+
+    rng = random.Random(args.seed)
+    facts_a, questions_a = make_needles(rng, args.facts // 2, args.pages)
+    facts_b, questions_b = make_needles(rng, args.facts - args.facts // 2, args.pages)
+    paths = [make_report(os.path.join(workdir, "fy25.pdf"), args.pages, args.seed + 1, args.seed, facts_a, args.shared),
+             make_report(os.path.join(workdir, "fy24.pdf"), args.pages, args.seed + 2, args.seed, facts_b, args.shared)]
+    context = await main_supa.load_retrieval_context(paths)
+    questions = questions_a + questions_b
+
+    results = {"old": {"tokens": [], "covered": 0, "latency": [], "correct": 0},
+               "packed": {"tokens": [], "covered": 0, "latency": [], "correct": 0}}
+    pack_ms, duplicates = [], []
+    for question, fact in questions:
+        candidates = (await main_supa.retrieve_chunks(context, [question], 20))[0]
+        start = time.perf_counter()
+        packed = pack_context(candidates, args.budget)
+        pack_ms.append((time.perf_counter() - start) * 1000)
+        duplicates.append(packed["duplicates_removed"])
+        figure = fact.split(" shipped ")[1].split(" ")[0]
+        for name, text in (("old", old_context(candidates[:10])), ("packed", packed["text"])):
+            results[name]["tokens"].append(count_tokens(text))
+            results[name]["covered"] += normalize(fact) in normalize(text)
+            if args.completions:
+                start = time.perf_counter()
+                response = await main_supa.client.chat.completions.create(
+                    model=main_supa.COMPLETION_MODEL,
+                    messages=[{"role": "user", "content": main_supa.build_prompt(question, text)}],
+                    temperature=main_supa.ANSWER_TEMPERATURE, max_tokens=main_supa.ANSWER_MAX_TOKENS)
+                results[name]["latency"].append((time.perf_counter() - start) * 1000)
+                results[name]["correct"] += figure in (response.choices[0].message.content or "")
+
+    for name, stats in results.items():
+        row = {
+            "context": name,
+            "tokens_mean": round(float(np.mean(stats["tokens"])), 1),
+            "tokens_max": int(np.max(stats["tokens"])),
+            "fact_in_context": round(stats["covered"] / len(questions), 3),
+        }
+        if args.completions:
+            row.update(completion_p50_ms=percentile(stats["latency"], 50), completion_p95_ms=percentile(stats["latency"], 95),
+                       answer_has_figure=round(stats["correct"] / len(questions), 3))
+        print(json.dumps(row), flush=True)
+    saved = 1 - np.mean(results["packed"]["tokens"]) / np.mean(results["old"]["tokens"])
+    print(json.dumps({"token_reduction": round(float(saved), 3), "pack_p50_ms": percentile(pack_ms, 50),
+                      "pack_p95_ms": percentile(pack_ms, 95), "near_duplicates_per_question": round(float(np.mean(duplicates)), 2)}),
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--facts", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--shared", type=float, default=0.6, help="fraction of pages the two reports share")
+    parser.add_argument("--completions", action="store_true", help="also time completions for both contexts")
+    parser.add_argument("--real", action="store_true", help="use the real OpenAI API (needs OPENAI_KEY)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-context-")
+    os.environ.update(DOC_INDEX_DIR=os.path.join(workdir, "index"), WORKSPACE_DIR=os.path.join(workdir, "ws"),
+                      ANSWER_CACHE_DIR=os.path.join(workdir, "cache"))
+    if not args.real:
+        from fakes import start_fake_openai
+        server = start_fake_openai(embedding_latency=0.01)
+        os.environ.update(OPENAI_KEY="fake", OPENAI_BASE_URL=server.url + "/v1")
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
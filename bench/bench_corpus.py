@@ -0,0 +1,144 @@
+"""Build a corpus_index.CorpusIndex from synthetic filings and measure query latency and recall.
+
+    python bench/bench_corpus.py --rows 1000000 --dim 256 --nprobe 8 16 32
+
+Vectors are drawn around random topic centres (real chunk embeddings cluster the same way;
+uniform noise would be the worst case for IVF), inserted one filing at a time so the
+incremental insert and merge path is what builds the index. Recall@k is measured against
+exact search over the same vectors. At --dim 1536 the index needs rows * 6 KB of disk and
+page cache (half that with CORPUS_VECTOR_DTYPE=float16).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--filing-rows", type=int, default=2000)
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--topics", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--workdir", default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-corpus-")
+    from corpus_index import CorpusIndex
+    from retrieval import normalize_rows
+    index = CorpusIndex(os.path.join(workdir, "corpus"))
+
+    rng = np.random.default_rng(0)
+    topics = normalize_rows(rng.standard_normal((args.topics, args.dim), dtype=np.float32))
+    # Exact search needs every vector; they are kept on disk in insert order
+    truth = np.lib.format.open_memmap(os.path.join(workdir, "truth.npy"), mode="w+", dtype=np.float32,
+                                      shape=(args.rows, args.dim))
+    truth_tickers = np.empty(args.rows, dtype=np.int32)
+
+    start = time.perf_counter()
+    insert_ms = []
+    filings = 0
+    for offset in range(0, args.rows, args.filing_rows):
+        n = min(args.filing_rows, args.rows - offset)
+        # A filing covers a handful of topics, like an annual report's sections
+        filing_topics = topics[rng.integers(0, args.topics, size=20)]
+        vectors = filing_topics[rng.integers(0, 20, size=n)] + rng.standard_normal((n, args.dim), dtype=np.float32) / np.sqrt(args.dim)
+        vectors = normalize_rows(vectors)
+        ticker = int(rng.integers(0, args.tickers))
+        truth[offset:offset + n] = vectors
+        truth_tickers[offset:offset + n] = ticker
+        chunks = [{"chunk_number": i + 1, "text": f"filing {filings} chunk {i + 1}"} for i in range(n)]
+        t = time.perf_counter()
+        index.add_document(f"sha{filings}", f"T{ticker}", 2015 + filings % 10, chunks, vectors)
+        insert_ms.append((time.perf_counter() - t) * 1000)
+        filings += 1
+    build_s = time.perf_counter() - start
+    print(json.dumps({
+        "rows": args.rows, "dim": args.dim, "filings": filings, "build_s": round(build_s, 1),
+        "insert_p50_ms": percentile(insert_ms, 50), "insert_max_ms": percentile(insert_ms, 100),
+        "segments": len(index._current()[0]), "lists": len(index._current()[1]) if index._current()[1] is not None else 1,
+    }), flush=True)
+
+    # Queries are noisy copies of stored chunks, so each has real near neighbours
+    picks = rng.integers(0, args.rows, size=args.queries)
+    picks = np.sort(picks)
+    queries = normalize_rows(np.asarray(truth[picks]) + 0.5 * rng.standard_normal((args.queries, args.dim), dtype=np.float32) / np.sqrt(args.dim))
+    exact = []
+    for block_start in range(0, args.queries, 50):
+        block = queries[block_start:block_start + 50]
+        scores = np.full((len(block), args.rows), -np.inf, dtype=np.float32)
+        for row_start in range(0, args.rows, 200_000):
+            scores[:, row_start:row_start + 200_000] = block @ np.asarray(truth[row_start:row_start + 200_000]).T
+        exact.extend(np.argsort(-scores, axis=1)[:, :args.k])
+    # Chunk ids are assigned 1..rows in insert order
+    exact_ids = [set((row + 1).tolist()) for row in exact]
+
+    for nprobe in args.nprobe:
+        latencies, recalls = [], []
+        for query, truth_ids in zip(queries, exact_ids):
+            t = time.perf_counter()
+            results = index.search(query, args.k, nprobe=nprobe)
+            latencies.append((time.perf_counter() - t) * 1000)
+            recalls.append(len(truth_ids & {r["id"] for r in results}) / args.k)
+        print(json.dumps({
+            "nprobe": nprobe, f"recall@{args.k}": round(float(np.mean(recalls)), 3),
+            "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95), "p99_ms": percentile(latencies, 99),
+        }), flush=True)
+
+    latencies = []
+    for query, pick in zip(queries, picks):
+        t = time.perf_counter()
+        results = index.search(query, args.k, tickers=[f"T{truth_tickers[pick]}"], years=list(range(2015, 2020)))
+        latencies.append((time.perf_counter() - t) * 1000)
+    print(json.dumps({
+        "filter": "one ticker, five years",
+        "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95), "p99_ms": percentile(latencies, 99),
+    }), flush=True)
+
+    # Ticker sets matching just under and just over EXACT_FILTER_BYTES of vectors: the largest
+    # filters scored exactly, and the smallest that go through the probed lists instead
+    from corpus_index import EXACT_FILTER_BYTES
+    row_bytes = args.dim * np.dtype(os.getenv("CORPUS_VECTOR_DTYPE", "float32")).itemsize
+    limit = EXACT_FILTER_BYTES // row_bytes
+    counts = np.bincount(truth_tickers, minlength=args.tickers)
+    order = np.argsort(-counts)
+    cumulative = np.cumsum(counts[order])
+    for label, take in (("under", np.searchsorted(cumulative, limit, side="right")),
+                        ("over", np.searchsorted(cumulative, limit, side="right") + 1)):
+        chosen = order[:max(1, take)]
+        matched = int(counts[chosen].sum())
+        # Exact filtered truth for recall
+        member = np.isin(truth_tickers, chosen)
+        rows = np.flatnonzero(member)
+        latencies, recalls = [], []
+        for query in queries[:50]:
+            scores = np.concatenate([np.asarray(truth[rows[s:s + 100_000]]) @ query for s in range(0, len(rows), 100_000)])
+            truth_ids = set((rows[np.argsort(-scores)[:args.k]] + 1).tolist())
+            t = time.perf_counter()
+            results = index.search(query, args.k, tickers=[f"T{c}" for c in chosen])
+            latencies.append((time.perf_counter() - t) * 1000)
+            recalls.append(len(truth_ids & {r["id"] for r in results}) / args.k)
+        print(json.dumps({
+            "filter": f"{len(chosen)} tickers, {label} the exact-search limit",
+            "rows": matched, "limit_rows": int(limit), "vector_mb": round(matched * row_bytes / 1024 ** 2, 1),
+            f"recall@{args.k}": round(float(np.mean(recalls)), 3),
+            "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95), "p99_ms": percentile(latencies, 99),
+        }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
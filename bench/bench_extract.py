@@ -0,0 +1,97 @@
+"""Benchmark for pdf_text: serial vs process-pool extraction on 50, 300 and 1000-page filings.
+
+    python bench/bench_extract.py --pages 50 300 1000 --workers 4
+
+Reports total time, time to the first page out of iter_pdf_pages (when chunking can
+start), and extract_many over all sizes at once against extracting them one by one.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from synth_pdf import make_pdf  # noqa: E402
+
+
+def extract_many(pdf_text, pdf_paths):
+    # Several documents at once: the page ranges of every document share the one pool
+    if pdf_text.get_extract_pool() is None:
+        return [pdf_text.extract_pdf_text(path) for path in pdf_paths]
+    with ThreadPoolExecutor(max_workers=len(pdf_paths) or 1) as threads:
+        return list(threads.map(pdf_text.extract_pdf_text, pdf_paths))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 300, 1000])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-task", type=int, default=32)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "webnew-bench-pdfs"))
+    args = parser.parse_args()
+
+    os.environ["PDF_EXTRACT_WORKERS"] = str(args.workers)
+    import pdf_text  # noqa: E402  (reads PDF_EXTRACT_WORKERS at import)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    paths = []
+    for pages in args.pages:
+        path = os.path.join(args.workdir, f"filing_{pages}.pdf")
+        if not os.path.exists(path):
+            make_pdf(path, pages=pages, seed=pages)
+        paths.append(path)
+
+    # Warm the pool so worker start-up is not billed to the first document
+    pool = pdf_text.get_extract_pool()
+    if pool is not None:
+        list(pool.map(abs, range(args.workers)))
+
+    for pages, path in zip(args.pages, paths):
+        start = time.perf_counter()
+        serial = pdf_text._extract_page_range(path, 0, pages)
+        serial_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        first_page_ms = None
+        count = 0
+        for _ in pdf_text.iter_pdf_pages(path, pages_per_task=args.pages_per_task):
+            if first_page_ms is None:
+                first_page_ms = (time.perf_counter() - start) * 1000
+            count += 1
+        pool_ms = (time.perf_counter() - start) * 1000
+        assert count == len(serial) == pages
+
+        print(json.dumps({
+            "pages": pages,
+            "workers": args.workers,
+            "serial_ms": round(serial_ms, 1),
+            "pool_ms": round(pool_ms, 1),
+            "first_page_ms": round(first_page_ms, 1),
+            "speedup": round(serial_ms / pool_ms, 2),
+            "pages_per_s": round(pages / (pool_ms / 1000)),
+        }), flush=True)
+
+    start = time.perf_counter()
+    for pages, path in zip(args.pages, paths):
+        pdf_text._extract_page_range(path, 0, pages)
+    serial_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    extract_many(pdf_text, paths)
+    many_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({
+        "documents": len(paths),
+        "total_pages": sum(args.pages),
+        "serial_ms": round(serial_ms, 1),
+        "extract_many_ms": round(many_ms, 1),
+        "speedup": round(serial_ms / many_ms, 2),
+    }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Table extraction accuracy and cost, and what the fact store saves in prompts.
+
+    python bench/bench_facts.py --pages 120 --table-every 40 --budget 2000
+
+A synthetic filing gets a financial table every --table-every pages (synth_pdf records the
+printed values). Reports:
+
+    extraction     ms per page of the extraction workers with and without table detection
+    accuracy       precision and recall of the extracted (page, line item, period, value) facts
+    questions      "What was <line item> in FY2025?" for every printed line item: how many the
+                   fact store answers locally (and correctly), and for the rest the context
+                   tokens and whether the figure reached the prompt, with and without the
+                   figures table
+    report         the same comparison for the Financials report section
+
+Line items printed in several tables with different values are ambiguous, so they go to
+the LLM path with the figures table; the ones printed once are answered locally.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from synth_pdf import make_pdf  # noqa: E402
+
+
+def time_extraction(path, pages, detect_tables, repeat=3):
+    import pdf_text
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extracted = pdf_text._extract_page_range(path, 0, pages, detect_scans=False, detect_tables=detect_tables)
+        best = min(best, time.perf_counter() - start)
+    return extracted, round(best / pages * 1000, 3)
+
+
+def prompt_context(main_supa, candidates, figures):
+    # The context part of build_prompt: the figures table, if any, and the packed chunks
+    packed = main_supa.pack_for_prompt(candidates, figures)
+    return f"{figures}\n\n{packed['text']}" if figures else packed["text"]
+
+
+def question_for(label):
+    return f"What was {re.sub(r'[(].*?[)]', '', label).strip().lower()} in FY2025?"
+
+
+async def run(args, workdir):
+    import main_supa
+    from chunker import count_tokens
+    from fact_store import facts_from_tables, format_value
+    from prompts import prompts
+
+    truth_rows = []
+    path = make_pdf(os.path.join(workdir, "filing.pdf"), pages=args.pages, seed=args.seed,
+                    table_every=args.table_every, table_rows=truth_rows)
+
+    plain, plain_ms = time_extraction(path, args.pages, False)
+    pages, tables_ms = time_extraction(path, args.pages, True)
+    print(json.dumps({"extraction": {"ms_per_page": plain_ms, "ms_per_page_with_tables": tables_ms,
+                                     "pages_with_tables": sum(1 for page in pages if page.get("tables"))}}), flush=True)
+
+    truth = {(row["page"], row["label"], period, row[period]) for row in truth_rows for period in ("FY2025", "FY2024")}
+    extracted = {(fact["page"], fact["label"], fact["period"], round(fact["value"], 2))
+                 for page in pages if page.get("tables")
+                 for fact in facts_from_tables(page["tables"], page["page_number"], page["text"])}
+    found = len(truth & extracted)
+    print(json.dumps({"accuracy": {"facts": len(truth), "extracted": len(extracted),
+                                   "precision": round(found / max(len(extracted), 1), 3),
+                                   "recall": round(found / max(len(truth), 1), 3)}}), flush=True)
+
+    main_supa.CONTEXT_TOKEN_BUDGET = args.budget
+    context = await main_supa.load_retrieval_context([path])
+    printed = Counter(row["label"] for row in truth_rows)
+    stats = {"local": 0, "local_correct": 0, "llm": 0,
+             "chunks": {"tokens": [], "covered": 0}, "figures": {"tokens": [], "covered": 0}}
+    lookup_ms = []
+    for row in truth_rows:
+        question = question_for(row["label"])
+        expected = format_value(row["FY2025"])
+        start = time.perf_counter()
+        answer = main_supa.answer_from_figures(context, question)
+        lookup_ms.append((time.perf_counter() - start) * 1000)
+        if answer is not None:
+            stats["local"] += 1
+            stats["local_correct"] += printed[row["label"]] == 1 and expected in answer
+            continue
+        stats["llm"] += 1
+        candidates = (await main_supa.retrieve_chunks(context, [question], 20))[0]
+        figures = main_supa.figures_for_question(context, question)
+        for name, table in (("chunks", ""), ("figures", figures)):
+            text = prompt_context(main_supa, candidates, table)
+            stats[name]["tokens"].append(count_tokens(text))
+            stats[name]["covered"] += expected in text
+
+    def summary(name):
+        return {"tokens_mean": round(float(np.mean(stats[name]["tokens"])), 1) if stats[name]["tokens"] else None,
+                "figure_in_context": round(stats[name]["covered"] / max(stats["llm"], 1), 3)}
+    print(json.dumps({"questions": {
+        "total": len(truth_rows), "answered_locally": stats["local"], "local_correct": stats["local_correct"],
+        "local_p50_ms": round(float(np.percentile(lookup_ms, 50)), 3), "to_llm": stats["llm"],
+        "chunks_only": summary("chunks"), "with_figures": summary("figures")}}), flush=True)
+
+    question = prompts["Financials"]
+    candidates = (await main_supa.retrieve_chunks(context, [question], 20))[0]
+    figures = main_supa.figures_for_question(context, question)
+    values = {format_value(row[period]) for row in truth_rows for period in ("FY2025", "FY2024")}
+    report = {}
+    for name, table in (("chunks_only", ""), ("with_figures", figures)):
+        text = prompt_context(main_supa, candidates, table)
+        report[name] = {"tokens": count_tokens(text), "figure_rows": max(table.count("\n") - 1, 0),
+                        "table_figures": sum(value in text for value in values)}
+    print(json.dumps({"report": report}), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--table-every", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-facts-")
+    os.environ.update(DOC_INDEX_DIR=os.path.join(workdir, "index"), WORKSPACE_DIR=os.path.join(workdir, "ws"),
+                      ANSWER_CACHE_DIR=os.path.join(workdir, "cache"), PDF_EXTRACT_WORKERS="1", OCR_ENABLED="0")
+    from fakes import start_fake_openai
+    server = start_fake_openai(embedding_latency=0.01)
+    os.environ.update(OPENAI_KEY="fake", OPENAI_BASE_URL=server.url + "/v1")
+    random.seed(args.seed)
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Latency and recall of main_supa.retrieve_chunks in vector (the old TOP_K_CHUNKS path),
+lexical (BM25 only) and hybrid mode.
+
+    python bench/bench_hybrid.py --pages 300 --facts 60 --embedding-latency 0.08
+
+Runs against the fake OpenAI server from fakes.py unless --real is given (then OPENAI_KEY
+and the real API are used). The fake embeddings are bag-of-words, so offline recall mostly
+reflects term matching; latency is representative since the embedding round trip is what
+the lexical mode saves. Each mode starts with an empty query-embedding cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from synth_pdf import make_pdf  # noqa: E402
+from bench_chunkers import make_needles, normalize  # noqa: E402
+
+MODES = ["vector", "lexical", "hybrid"]
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2)
+
+
+async def run(args, workdir):
+    import main_supa
+    import answer_cache
+
+    rng = random.Random(args.seed)
+    facts, questions = make_needles(rng, args.facts, args.pages)
+    path = make_pdf(os.path.join(workdir, "needles.pdf"), pages=args.pages, seed=args.seed, facts=facts,
+                    table_every=3)
+    # Short keyword queries ("Kaloven plant zenmira") next to the full questions
+    query_sets = {
+        "question": [(question, normalize(fact)) for question, fact in questions],
+        "keywords": [(" ".join(question.split()[4:5] + question.split()[7:9]), normalize(fact))
+                     for question, fact in questions],
+    }
+
+    start = time.perf_counter()
+    context = await main_supa.load_retrieval_context([path])
+    print(json.dumps({"indexed_chunks": len(context["chunks"]),
+                      "index_build_s": round(time.perf_counter() - start, 2)}), flush=True)
+    texts = [normalize(chunk["text"]) for chunk in context["chunks"]]
+
+    for mode in MODES:
+        answer_cache.ANSWER_CACHE_DIR = tempfile.mkdtemp(dir=workdir)
+        for name, queries in query_sets.items():
+            latencies, hits, reciprocal_ranks = [], 0, []
+            for query, fact in queries:
+                start = time.perf_counter()
+                chunks = (await main_supa.retrieve_chunks(context, [query], args.k, mode))[0]
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranks = [i for i, chunk in enumerate(chunks) if fact in normalize(chunk["text"])]
+                hits += bool(ranks)
+                reciprocal_ranks.append(1 / (ranks[0] + 1) if ranks else 0.0)
+            print(json.dumps({
+                "mode": mode,
+                "queries": name,
+                f"recall@{args.k}": round(hits / len(queries), 3),
+                "mrr": round(float(np.mean(reciprocal_ranks)), 3),
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "max_ms": percentile(latencies, 100),
+                "facts_indexed": round(sum(any(f in t for t in texts) for _, f in queries) / len(queries), 3),
+            }), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--facts", type=int, default=60)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--embedding-latency", type=float, default=0.08)
+    parser.add_argument("--real", action="store_true", help="use the real OpenAI API (needs OPENAI_KEY)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-hybrid-")
+    os.environ.update(DOC_INDEX_DIR=os.path.join(workdir, "index"), WORKSPACE_DIR=os.path.join(workdir, "ws"),
+                      ANSWER_CACHE_DIR=os.path.join(workdir, "cache"))
+    if not args.real:
+        from fakes import start_fake_openai
+        server = start_fake_openai(embedding_latency=args.embedding_latency)
+        os.environ.update(OPENAI_KEY="fake", OPENAI_BASE_URL=server.url + "/v1")
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""OCR fallback throughput on a partly scanned filing, cold and from the page cache.
+
+    python bench/bench_ocr.py --pages 60 --scanned 0.5 --workers 1,2,4
+
+Builds a synthetic filing where --scanned of the pages are images only (rendered from the
+text pages at --scan-dpi, the way an old annual report is scanned), then runs
+pdf_text.extract_pdf_text with each OCR pool size on an empty cache and once more warm.
+Offline the OCR engine is fakes.fake_ocr, which burns CPU per pixel like a real engine;
+--engine easyocr uses the real one if it is installed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402
+
+from synth_pdf import make_pdf  # noqa: E402
+
+
+def make_scanned_pdf(path, pages, scanned, scan_dpi, seed):
+    text_pdf = make_pdf(path + ".text.pdf", pages=pages, seed=seed, table_every=5)
+    rng = random.Random(seed)
+    scanned_pages = set(rng.sample(range(pages), int(pages * scanned)))
+    with fitz.open(text_pdf) as source, fitz.open() as out:
+        for number in range(pages):
+            if number in scanned_pages:
+                pixmap = source.load_page(number).get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY)
+                page = out.new_page(width=source[number].rect.width, height=source[number].rect.height)
+                page.insert_image(page.rect, pixmap=pixmap)
+            else:
+                out.insert_pdf(source, from_page=number, to_page=number)
+        out.save(path)
+    os.unlink(text_pdf)
+    return path, len(scanned_pages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--scanned", type=float, default=0.5, help="fraction of pages that are images only")
+    parser.add_argument("--scan-dpi", type=int, default=150)
+    parser.add_argument("--workers", default="1,2,4", help="OCR pool sizes to compare")
+    parser.add_argument("--engine", default="fakes:fake_ocr")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-ocr-")
+    os.environ.update(OCR_ENGINE=args.engine, PDF_EXTRACT_WORKERS="1")
+    import ocr
+    import pdf_text
+
+    path, scanned = make_scanned_pdf(os.path.join(workdir, "scanned.pdf"), args.pages, args.scanned,
+                                     args.scan_dpi, args.seed)
+
+    def run(label, workers):
+        ocr.OCR_WORKERS = workers
+        start = time.perf_counter()
+        pages = pdf_text.extract_pdf_text(path)
+        elapsed = time.perf_counter() - start
+        ocred = sum(1 for page in pages if page.get("ocr"))
+        print(json.dumps({
+            "run": label, "workers": workers, "pages": len(pages), "scanned": scanned, "ocr_pages": ocred,
+            "empty_pages": sum(1 for page in pages if not page["text"]),
+            "seconds": round(elapsed, 2), "scanned_pages_per_s": round(ocred / elapsed, 2),
+            "pages_per_s": round(len(pages) / elapsed, 2),
+        }), flush=True)
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        ocr.OCR_CACHE_DIR = os.path.join(workdir, f"cache_{workers}")
+        ocr.reset_ocr_pool()
+        ocr.get_ocr_pool().submit(int).result()  # start the workers outside the timing
+        run("cold", workers)
+        ocr.reset_ocr_pool()
+        run("cached", workers)
+
+
+if __name__ == "__main__":
+    main()
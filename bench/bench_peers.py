@@ -0,0 +1,110 @@
+"""Peer analytics from the columnar snapshot against per-request Supabase lookups.
+
+    python bench/bench_peers.py --tickers 2000 --quarters 12 --sizes 10,100,500
+
+The fake Supabase holds --tickers x --quarters financials rows. Reports:
+
+    snapshot       rows, tickers and ms to fetch the table and build the snapshot
+    screens        for each peer group size: p50/p95 ms and Supabase requests per call of
+                   GET /scrape_nse with a cold cache (latest quarter only, one in.() query)
+                   and GET /peers/analytics (growth, margins and ranks, no query)
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from fakes import start_fake_supabase  # noqa: E402
+
+QUARTER_ENDS = ["31-Mar", "30-Jun", "30-Sep", "31-Dec"]
+
+
+def make_history(tickers, quarters, seed):
+    rng = random.Random(seed)
+    rows = []
+    for t in range(tickers):
+        income = rng.uniform(1e3, 1e7)
+        for q in range(quarters):
+            if rng.random() < 0.03:  # the odd quarter that was never reported
+                continue
+            income *= rng.uniform(0.9, 1.15)
+            rows.append({
+                "id": len(rows) + 1,
+                "ticker": f"TICK{t:05d}",
+                "quarter_ended": f"{QUARTER_ENDS[q % 4]}-{2022 + q // 4}",
+                "total_income": round(income, 2),
+                "net_profit_loss": round(income * rng.uniform(-0.1, 0.3), 2),
+                "earnings_per_share": round(rng.uniform(-5, 90), 2),
+            })
+    return rows
+
+
+def percentiles(latencies):
+    return {"p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2)}
+
+
+async def run(args, server, rows):
+    import main_supa
+
+    start = time.perf_counter()
+    fetched = await main_supa.fetch_all_financials()
+    fetch_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    snapshot = main_supa.FinancialsSnapshot.from_rows(fetched)
+    print(json.dumps({"snapshot": {"rows": len(rows), "tickers": len(snapshot), "fetch_ms": round(fetch_ms, 1),
+                                   "build_ms": round((time.perf_counter() - start) * 1000, 1)}}), flush=True)
+
+    tickers = sorted({row["ticker"] for row in rows})
+    transport = httpx.ASGITransport(app=main_supa.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=600) as http:
+        await http.get("/peers/analytics", params={"tickers": tickers[0]})  # builds the snapshot
+        for size in args.sizes:
+            report = {"tickers": size}
+            for name, path in (("scrape_nse", "/scrape_nse"), ("peer_analytics", "/peers/analytics")):
+                latencies = []
+                requests_before = server.stats["requests"]
+                for i in range(args.repeat):
+                    batch = ",".join(random.Random(i).sample(tickers, size))
+                    main_supa.financials_cache.clear()
+                    call_start = time.perf_counter()
+                    response = await http.get(path, params={"tickers": batch})
+                    latencies.append((time.perf_counter() - call_start) * 1000)
+                    response.raise_for_status()
+                report[name] = {**percentiles(latencies),
+                                "supabase_requests": round((server.stats["requests"] - requests_before) / args.repeat, 2)}
+            print(json.dumps({"screen": report}), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=2000)
+    parser.add_argument("--quarters", type=int, default=12)
+    parser.add_argument("--sizes", default="10,100,500", help="comma separated peer group sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    rows = make_history(args.tickers, args.quarters, args.seed)
+    server = start_fake_supabase(latency=args.supabase_latency, tables={"financials": rows})
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_SERVICE_KEY="fake", OPENAI_KEY="fake",
+                      WORKSPACE_DIR=tempfile.mkdtemp(prefix="bench-peers-"))
+    asyncio.run(run(args, server, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Microbenchmark for retrieval.VectorIndex against the old per-chunk cosine loop.
+
+    python bench/bench_retrieval.py --sizes 10000 100000 1000000 --dim 1536
+
+1M x 1536 float32 chunks need ~6 GB of RAM; use a smaller --dim on small machines
+(scores scale linearly with dim). The loop baseline is only run up to --baseline-max chunks.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from retrieval import VectorIndex  # noqa: E402
+
+
+def loop_top_k(embeddings: np.ndarray, query: np.ndarray, k: int):
+    # What main_supa.analyze_documents_enhanced used to do
+    scored = []
+    for idx, emb in enumerate(embeddings):
+        norm = np.linalg.norm(emb) * np.linalg.norm(query)
+        scored.append((idx, 0.0 if norm == 0 else float(np.dot(emb, query) / norm)))
+    return sorted(scored, key=lambda x: x[1], reverse=True)[:k]
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=4, help="batch size for search_batch (report prompts)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-max", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for n in args.sizes:
+        embeddings = rng.standard_normal((n, args.dim), dtype=np.float32)
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        index = VectorIndex(embeddings)
+        build_ms = (time.perf_counter() - start) * 1000
+        del embeddings
+
+        row = {
+            "chunks": n,
+            "dim": args.dim,
+            "k": args.k,
+            "build_ms": round(build_ms, 2),
+            "search_ms": round(timed(lambda: index.search(queries[0], args.k), args.repeat), 3),
+            "search_batch_ms": round(timed(lambda: index.search_batch(queries, args.k), args.repeat), 3),
+            "batch_queries": args.queries,
+        }
+        if n <= args.baseline_max:
+            raw = index.matrix * 3.0  # un-normalized copy so the baseline pays for its norms
+            row["loop_ms"] = round(timed(lambda: loop_top_k(raw, queries[0], args.k), 1), 3)
+            row["speedup"] = round(row["loop_ms"] / row["search_ms"], 1)
+            del raw
+        print(json.dumps(row), flush=True)
+        del index
+
+
+if __name__ == "__main__":
+    main()
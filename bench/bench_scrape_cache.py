@@ -0,0 +1,88 @@
+"""/scrape_nse latency and Supabase round trips with the per-ticker financials cache.
+
+    python bench/bench_scrape_cache.py --tickers 2000 --per-request 10 --supabase-latency 0.03
+
+Runs main_supa in process against the fake PostgREST server from fakes.py. Requests are
+cold (no ticker seen), warm (every ticker seen), half warm (misses go out as one in.()
+query), and warm again after add_to_db.py stamps a new load version.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from fakes import start_fake_supabase  # noqa: E402
+from bench_add_to_db import make_rows  # noqa: E402
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2)
+
+
+async def run(args, server, rows):
+    import main_supa
+    import add_to_db
+
+    tickers = sorted({row["ticker"] for row in rows})
+    rng = random.Random(3)
+    transport = httpx.ASGITransport(app=main_supa.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as http:
+        async def measure(name, batches):
+            requests_before = server.stats["requests"]
+            latencies = []
+            for batch in batches:
+                start = time.perf_counter()
+                response = await http.get("/scrape_nse", params={"tickers": ",".join(batch)})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(json.dumps({
+                "requests": name, "n": len(batches),
+                "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+                "supabase_requests_per_call": round((server.stats["requests"] - requests_before) / len(batches), 2),
+            }), flush=True)
+
+        seen = [rng.sample(tickers, args.per_request) for _ in range(args.requests)]
+        await measure("cold", seen)
+        await measure("warm", seen)
+        seen_tickers = sorted({t for batch in seen for t in batch})
+        unseen = sorted(set(tickers) - set(seen_tickers))
+        half = args.per_request // 2
+        await measure("half warm", [rng.sample(seen_tickers, half) + rng.sample(unseen, args.per_request - half)
+                                    for _ in range(args.requests)])
+        add_to_db.stamp_load_version()
+        main_supa.financials_version_checked = float("-inf")
+        await measure("after new load", seen)
+        await measure("warm", seen)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=2000)
+    parser.add_argument("--per-request", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--supabase-latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    rows = make_rows(args.tickers * 4, seed=1)
+    server = start_fake_supabase(latency=args.supabase_latency, tables={"financials": rows})
+    workdir = tempfile.mkdtemp(prefix="bench-scrape-cache-")
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_SERVICE_KEY="fake", OPENAI_KEY="fake",
+                      DOC_INDEX_DIR=os.path.join(workdir, "index"), WORKSPACE_DIR=os.path.join(workdir, "ws"),
+                      ANSWER_CACHE_DIR=os.path.join(workdir, "cache"))
+    asyncio.run(run(args, server, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Local stand-ins for the OpenAI and Supabase (PostgREST) APIs, for offline benchmarks.
+
+Both run on stdlib ThreadingHTTPServer in a background thread with a configurable
+per-request latency, so nothing here needs network access or API keys. fake_ocr stands in
+for the OCR engine (OCR_ENGINE=fakes:fake_ocr).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    # Deterministic per text, and texts sharing words land near each other so ranking is meaningful
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        seed = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vec += np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "fake/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        stats = self.server.stats
+        body = self._read_json()
+        if self.path.endswith("/embeddings"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            with self.server.lock:
+                stats["embedding_requests"] += 1
+                stats["embedding_inputs"] += len(inputs)
+            time.sleep(self.server.embedding_latency)
+            data = [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text).tolist()}
+                for i, text in enumerate(inputs)
+            ]
+            tokens = sum(len(text) // 4 + 1 for text in inputs)
+            self._send_json(200, {
+                "object": "list", "data": data, "model": body["model"],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+        elif self.path.endswith("/chat/completions"):
+            prompt = " ".join(m["content"] for m in body["messages"] if isinstance(m.get("content"), str))
+            with self.server.lock:
+                stats["chat_requests"] += 1
+                stats["chat_prompt_chars"] += len(prompt)
+            answer = f"Fake answer based on {len(prompt)} prompt characters."
+            if body.get("stream"):
+                self._stream_chat(body, answer)
+                return
+            time.sleep(self.server.chat_latency)
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 10, "total_tokens": len(prompt) // 4 + 10},
+            })
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _stream_chat(self, body, answer: str):
+        # Spread the completion latency over the tokens, like a real streamed answer
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.server.chat_latency / len(words))
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def _in_values(value: str):
+    # in.(a,b) or in.("M&M","J&KBANK")
+    return {v[1:-1].replace('\\"', '"') if v.startswith('"') and v.endswith('"') else v
+            for v in value[4:-1].split(",")}
+
+
+class _SupabaseHandler(_Handler):
+    # Just enough PostgREST for the financials table: select with in./eq. filters and
+    # column lists, plus bulk upsert on a unique key (on_conflict + merge-duplicates)
+    def _index(self, table, columns):
+        # Lookup tables stand in for the database's indexes so large tables stay fast;
+        # kept up to date by POST and dropped by DELETE
+        key = (table, tuple(columns))
+        if key not in self.server.indexes:
+            index = {}
+            for row in self.server.tables.get(table, []):
+                index.setdefault(tuple(str(row.get(c)) for c in columns), []).append(row)
+            self.server.indexes[key] = index
+        return self.server.indexes[key]
+
+    def _filtered(self, table, query):
+        rows = None
+        for column, values in query.items():
+            if column in ("select", "order", "limit", "offset", "on_conflict"):
+                continue
+            for value in values:
+                if value.startswith("in.(") and value.endswith(")"):
+                    wanted = _in_values(value)
+                elif value.startswith("eq."):
+                    wanted = {value[3:]}
+                else:
+                    continue
+                if rows is None:
+                    index = self._index(table, [column])
+                    rows = [row for v in wanted for row in index.get((v,), [])]
+                else:
+                    rows = [row for row in rows if str(row.get(column)) in wanted]
+        return list(self.server.tables.get(table, [])) if rows is None else rows
+
+    def _begin(self):
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+            count = self.server.stats["requests"]
+        time.sleep(self.server.latency)
+        if self.server.fail_every and count % self.server.fail_every == 0:
+            self._send_json(503, {"message": "injected failure"})
+            return None
+        parsed = urlparse(self.path)
+        return parsed.path.rsplit("/", 1)[-1], parse_qs(parsed.query)
+
+    def do_GET(self):
+        request = self._begin()
+        if request is None:
+            return
+        table, query = request
+        with self.server.lock:
+            rows = [dict(row) for row in self._filtered(table, query)]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query["limit"][0]) if "limit" in query else None
+        rows = rows[offset:offset + limit] if limit is not None else rows[offset:]
+        if "select" in query and query["select"][0] != "*":
+            columns = query["select"][0].split(",")
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        self._send_json(200, rows)
+
+    def do_POST(self):
+        request = self._begin()
+        if request is None:
+            return
+        table, query = request
+        rows = self._read_json()
+        rows = rows if isinstance(rows, list) else [rows]
+        key = query.get("on_conflict", [""])[0].split(",") if "on_conflict" in query else []
+        merge = "merge-duplicates" in self.headers.get("Prefer", "")
+        # Like Postgres, one bad row fails the whole statement
+        for row in rows:
+            if any(not row.get(column) for column in self.server.required.get(table, ())):
+                self._send_json(400, {"message": f"null value in a required column: {row}"})
+                return
+        with self.server.lock:
+            stored = self.server.tables.setdefault(table, [])
+            existing = self._index(table, key) if key else {}
+            if not merge and any(tuple(str(row.get(c)) for c in key) in existing for row in rows):
+                self._send_json(409, {"message": "duplicate key value violates unique constraint"})
+                return
+            for row in rows:
+                matches = existing.get(tuple(str(row.get(c)) for c in key)) if key else None
+                if matches:
+                    changed = [c for c, v in row.items() if matches[0].get(c) != v]
+                    matches[0].update(row)
+                    for index_key in [k for k in self.server.indexes if k[0] == table and set(k[1]) & set(changed)]:
+                        del self.server.indexes[index_key]
+                else:
+                    new_row = dict(row)
+                    stored.append(new_row)
+                    for (index_table, columns), index in self.server.indexes.items():
+                        if index_table == table:
+                            index.setdefault(tuple(str(new_row.get(c)) for c in columns), []).append(new_row)
+            self.server.stats["rows_written"] += len(rows)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_DELETE(self):
+        request = self._begin()
+        if request is None:
+            return
+        table, query = request
+        with self.server.lock:
+            doomed = {id(row) for row in self._filtered(table, query)}
+            self.server.tables[table] = [row for row in self.server.tables.get(table, []) if id(row) not in doomed]
+            self.server.indexes = {k: v for k, v in self.server.indexes.items() if k[0] != table}
+        self.send_response(204)
+        self.end_headers()
+
+
+def _start(handler, port: int, **attrs):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    for key, value in attrs.items():
+        setattr(server, key, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server
+
+
+def start_fake_openai(port: int = 0, embedding_latency: float = 0.05, chat_latency: float = 0.5):
+    """Start a fake OpenAI API; point the app at it with OPENAI_BASE_URL=<server.url>/v1."""
+    stats = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0, "chat_prompt_chars": 0}
+    return _start(_OpenAIHandler, port, stats=stats,
+                  embedding_latency=embedding_latency, chat_latency=chat_latency)
+
+
+def start_fake_supabase(port: int = 0, latency: float = 0.02, tables=None, fail_every: int = 0, required=None):
+    """Start a fake Supabase REST API; point the app at it with SUPABASE_URL=<server.url>.
+    fail_every=N answers every Nth request with a 503; rows missing a column listed in
+    required ({table: columns}) get a 400."""
+    required = required if required is not None else {"financials": ("ticker", "quarter_ended")}
+    return _start(_SupabaseHandler, port, stats={"requests": 0, "rows_written": 0}, latency=latency,
+                  tables=tables if tables is not None else {}, indexes={}, fail_every=fail_every, required=required)
+
+
+def fake_ocr(image: np.ndarray, languages) -> str:
+    # CPU-bound like a real engine (FAKE_OCR_PASSES passes over the pixels, about half a second
+    # for a 200 dpi page), so pool scaling is limited by cores just as it would be with easyocr
+    passes = int(os.getenv("FAKE_OCR_PASSES", "40"))
+    pixels = image.astype(np.float32)
+    total = 0.0
+    for _ in range(passes):
+        total += float(np.abs(np.diff(pixels, axis=1)).sum())
+    ink = int((image < 128).sum())
+    return f"Scanned page {image.shape[1]}x{image.shape[0]} with {ink} dark pixels ({total:.0f})."
@@ -0,0 +1,123 @@
+"""Load test: /scrape_nse latency while /analyze requests are in flight on the same worker.
+
+    python bench/load_test_async.py --analyze 4 --scrape 20
+
+Runs main_supa under uvicorn (one worker) against the local fakes in bench/fakes.py.
+With a blocking handler every /scrape_nse waits for the slow /analyze calls; on the
+async path its latency stays close to the Supabase round trip.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from fakes import start_fake_openai, start_fake_supabase  # noqa: E402
+from synth_pdf import make_pdf  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_app(port: int):
+    import uvicorn
+    import main_supa
+
+    server = uvicorn.Server(uvicorn.Config(main_supa.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _timed(coro):
+    start = time.perf_counter()
+    response = await coro
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "p50_ms": round(statistics.median(samples), 1),
+        "max_ms": round(samples[-1], 1),
+    }
+
+
+async def run(args):
+    base = f"http://127.0.0.1:{args.port}"
+    async with httpx.AsyncClient(base_url=base, timeout=120) as http:
+        with open(args.pdf, "rb") as f:
+            upload = await http.post("/upload", files=[("files", ("bench.pdf", f, "application/pdf"))])
+        upload.raise_for_status()
+        workspace_id = upload.json()["workspace_id"]
+
+        idle = [await _timed(http.get("/scrape_nse", params={"tickers": "RELIANCE,TCS"})) for _ in range(args.scrape)]
+
+        start = time.perf_counter()
+        analyze = [
+            asyncio.create_task(_timed(http.post("/analyze", data={"prompt_key": "Business", "workspace_id": workspace_id})))
+            for _ in range(args.analyze)
+        ]
+        await asyncio.sleep(0.05)
+        busy = []
+        for _ in range(args.scrape):
+            busy.append(await _timed(http.get("/scrape_nse", params={"tickers": "RELIANCE,TCS"})))
+        analyze_ms = await asyncio.gather(*analyze)
+        wall_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "scrape_nse_idle": _summary(idle),
+        "scrape_nse_during_analyze": _summary(busy),
+        "analyze": _summary(analyze_ms),
+        "wall_ms": round(wall_ms, 1),
+        "analyze_serial_estimate_ms": round(sum(analyze_ms), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyze", type=int, default=4, help="concurrent /analyze requests")
+    parser.add_argument("--scrape", type=int, default=20, help="/scrape_nse requests issued while they run")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="webnew-load-")
+    openai_server = start_fake_openai(chat_latency=args.chat_latency)
+    rows = [{"ticker": t, "quarter_ended": "31-Mar-2025"} for t in ("RELIANCE", "TCS")]
+    supabase_server = start_fake_supabase(latency=args.supabase_latency, tables={"financials": rows})
+    os.environ.update({
+        "OPENAI_KEY": "fake",
+        "OPENAI_BASE_URL": f"{openai_server.url}/v1",
+        "SUPABASE_URL": supabase_server.url,
+        "SUPABASE_SERVICE_KEY": "fake",
+        "DOC_INDEX_DIR": os.path.join(workdir, "index"),
+        "WORKSPACE_DIR": os.path.join(workdir, "workspaces"),
+    })
+
+    args.pdf = make_pdf(os.path.join(workdir, "bench.pdf"), pages=args.pages)
+    args.port = _free_port()
+    _start_app(args.port)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
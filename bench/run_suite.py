@@ -0,0 +1,295 @@
+"""Offline benchmark suite for the RAG pipeline; one JSON report to compare commits with.
+
+    python bench/run_suite.py --pages 300 --out bench-$(git rev-parse --short HEAD).json
+
+Generates synthetic filings (bench/synth_pdf.py) with planted facts, starts the fake OpenAI
+and Supabase servers from bench/fakes.py with the given latencies, and drives in process:
+
+    upload_cold          POST /upload of a filing never seen before, until /upload/status reports
+                         it ready (extract, chunk, embed, index in the background)
+    upload_cached        POST /upload of the same filings again (index cache hits)
+    analyze              analyze_documents_enhanced, a new question each call (no answer cache hits)
+    analyze_http         POST /analyze through the app, same questions again (answer cache hits)
+    rank_chunks          main_scrape.rank_chunks_by_question over one filing's chunks
+    generate_report      POST /generate_report with an empty answer cache
+    generate_report_cached  the same report again
+    scrape_nse           GET /scrape_nse for a few tickers against the fake Supabase
+    peer_analytics       GET /peers/analytics for the same ticker batches (served from the snapshot)
+
+Every scenario reports n, throughput per second, p50/p95/p99 latency and the peak RSS seen
+while it ran. The fakes run as threads of the same process, so RSS includes them (a few MB)
+and they share the CPU with the app. Nothing leaves the machine; OPENAI_KEY is a dummy.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from fakes import start_fake_openai, start_fake_supabase  # noqa: E402
+from synth_pdf import make_pdf  # noqa: E402
+from bench_chunkers import make_needles  # noqa: E402
+from bench_add_to_db import make_rows  # noqa: E402
+
+SCENARIOS = ["upload_cold", "upload_cached", "analyze", "analyze_http", "rank_chunks",
+             "generate_report", "generate_report_cached", "scrape_nse", "peer_analytics"]
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """Peak resident set size of this process, sampled from /proc every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def current() -> int:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def reset(self):
+        self.peak = self.current()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _mb(size: int) -> float:
+    return round(size / 1024 ** 2, 1)
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2)
+
+
+def summarize(latencies_ms, wall_s, rss_peak):
+    return {
+        "n": len(latencies_ms),
+        "throughput_per_s": round(len(latencies_ms) / wall_s, 3) if wall_s else None,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "max_ms": round(max(latencies_ms), 2),
+        "peak_rss_mb": _mb(rss_peak),
+    }
+
+
+async def measure(calls, concurrency: int, rss: RssSampler):
+    """Run zero-argument coroutine factories with at most `concurrency` in flight."""
+    rss.reset()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies = []
+
+    async def timed(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(call) for call in calls])
+    return summarize(latencies, time.perf_counter() - start, rss.peak)
+
+
+def measure_sync(calls, rss: RssSampler):
+    rss.reset()
+    latencies = []
+    start = time.perf_counter()
+    for call in calls:
+        call_start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    return summarize(latencies, time.perf_counter() - start, rss.peak)
+
+
+def _checked(response: httpx.Response) -> httpx.Response:
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        if isinstance(body, dict) and "error" in body:
+            raise RuntimeError(body["error"])
+    return response
+
+
+async def run(args, workdir, selected):
+    import main_supa
+    import main_scrape
+    import answer_cache
+    from workspaces import get_documents
+
+    rng = random.Random(args.seed)
+    pdfs, questions = [], []
+    for i in range(args.docs):
+        facts, doc_questions = make_needles(rng, args.questions, args.pages)
+        path = os.path.join(workdir, f"filing_{i}.pdf")
+        pdfs.append(make_pdf(path, pages=args.pages, seed=args.seed + i, facts=facts, table_every=5))
+        questions += [question for question, _ in doc_questions]
+    rng.shuffle(questions)
+    questions = questions[:args.questions]
+
+    rss = RssSampler()
+    results = {}
+    transport = httpx.ASGITransport(app=main_supa.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=600) as http:
+        async def upload(paths):
+            files = [("files", (os.path.basename(path), open(path, "rb"), "application/pdf")) for path in paths]
+            try:
+                result = _checked(await http.post("/upload", files=files)).json()
+            finally:
+                for _, (_, f, _) in files:
+                    f.close()
+            while not result["ready"]:
+                await asyncio.sleep(0.02)
+                result = _checked(await http.get("/upload/status", params={"workspace_id": result["workspace_id"]})).json()
+                failed = [doc for doc in result["documents"] if doc["status"] == "failed"]
+                if failed:
+                    raise RuntimeError(f"Indexing failed: {failed}")
+            return result["workspace_id"]
+
+        workspace = {}
+
+        async def upload_all():
+            workspace["id"] = await upload(pdfs)
+
+        # The first upload of each filing builds its index; the workspace holds all of them
+        if "upload_cold" in selected:
+            results["upload_cold"] = await measure([lambda path=path: upload([path]) for path in pdfs], 1, rss)
+        summary = await measure([upload_all for _ in range(args.repeat)], 1, rss)
+        if "upload_cached" in selected:
+            results["upload_cached"] = summary
+
+        if "analyze" in selected:
+            paths = [doc["path"] for doc in get_documents(workspace["id"])]
+            names = [f"Document_{i + 1}" for i in range(len(paths))]
+            results["analyze"] = await measure(
+                [lambda q=q: main_supa.analyze_documents_enhanced(paths, q, names) for q in questions],
+                args.concurrency, rss)
+        if "analyze_http" in selected:
+            async def analyze(question):
+                _checked(await http.post("/analyze", data={"prompt_key": "custom", "custom_query": question,
+                                                            "workspace_id": workspace["id"]}))
+            results["analyze_http"] = await measure([lambda q=q: analyze(q) for q in questions], args.concurrency, rss)
+
+        if "rank_chunks" in selected:
+            chunks = await asyncio.to_thread(main_scrape.chunk_pdf, pdfs[0])
+            results["rank_chunks"] = await asyncio.to_thread(
+                measure_sync, [lambda q=q: main_scrape.rank_chunks_by_question(chunks, q, top_n=4)
+                               for q in questions[:args.repeat]], rss)
+            results["rank_chunks"]["chunks"] = len(chunks)
+
+        async def report():
+            _checked(await http.post("/generate_report", data={"workspace_id": workspace["id"]}))
+
+        if "generate_report" in selected:
+            reports = []
+            for i in range(args.repeat):
+                async def cold_report(i=i):
+                    # A fresh answer cache per run so every section goes to the completion API
+                    answer_cache.ANSWER_CACHE_DIR = os.path.join(workdir, f"answers_{i}")
+                    await report()
+                reports.append(cold_report)
+            results["generate_report"] = await measure(reports, 1, rss)
+        if "generate_report_cached" in selected:
+            await report()
+            results["generate_report_cached"] = await measure([report for _ in range(args.repeat)], 1, rss)
+
+        tickers = [f"TICK{i:04d}" for i in range(args.tickers)]
+        batches = [",".join(random.Random(i).sample(tickers, 10)) for i in range(args.repeat * 10)]
+        if "scrape_nse" in selected:
+            async def scrape(batch):
+                _checked(await http.get("/scrape_nse", params={"tickers": batch}))
+            results["scrape_nse"] = await measure([lambda b=b: scrape(b) for b in batches], args.concurrency, rss)
+        if "peer_analytics" in selected:
+            async def peers(batch):
+                _checked(await http.get("/peers/analytics", params={"tickers": batch}))
+            await peers(batches[0])  # builds the snapshot
+            results["peer_analytics"] = await measure([lambda b=b: peers(b) for b in batches], args.concurrency, rss)
+    rss.stop()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300, help="pages per synthetic filing")
+    parser.add_argument("--docs", type=int, default=2, help="filings per workspace")
+    parser.add_argument("--questions", type=int, default=20, help="questions for the analyze scenarios")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the slower scenarios")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight for analyze, scrape_nse and peer_analytics")
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(selected) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix="bench-suite-")
+    openai_server = start_fake_openai(embedding_latency=args.embedding_latency, chat_latency=args.chat_latency)
+    rows = make_rows(args.tickers * 4, seed=args.seed)
+    for i, row in enumerate(rows):
+        row["ticker"] = f"TICK{i % args.tickers:04d}"
+    supabase_server = start_fake_supabase(latency=args.supabase_latency, tables={"financials": rows})
+    os.environ.update(
+        OPENAI_KEY="fake", OPENAI_BASE_URL=openai_server.url + "/v1",
+        SUPABASE_URL=supabase_server.url, SUPABASE_SERVICE_KEY="fake",
+        DOC_INDEX_DIR=os.path.join(workdir, "index"), WORKSPACE_DIR=os.path.join(workdir, "workspaces"),
+        ANSWER_CACHE_DIR=os.path.join(workdir, "answers"), CORPUS_INDEX_DIR=os.path.join(workdir, "corpus"),
+    )
+
+    start = time.perf_counter()
+    scenarios = asyncio.run(run(args, workdir, selected))
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "scenarios")},
+        "scenarios": scenarios,
+        "peak_rss_mb": _mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024),
+        "wall_s": round(time.perf_counter() - start, 1),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
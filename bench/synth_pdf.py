@@ -0,0 +1,86 @@
+"""Synthetic annual-report style PDFs for offline benchmarks."""
+import random
+import textwrap
+from typing import Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+SECTIONS = [
+    "Management Discussion and Analysis", "Business Overview", "Segment Performance",
+    "Risk Management", "Corporate Governance", "Financial Statements", "Notes to Accounts",
+]
+PHRASES = [
+    "Revenue from operations grew {pct}% year on year to Rs {amt} crore.",
+    "EBITDA margin expanded by {bps} basis points on the back of operating leverage.",
+    "The order book stood at Rs {amt} crore, providing revenue visibility for {yrs} years.",
+    "Net debt declined to Rs {amt} crore as free cash flow improved.",
+    "The company faces currency risk on imported raw materials and export receivables.",
+    "Competition in the domestic market remains intense with {n} organised players.",
+    "Capital expenditure of Rs {amt} crore was incurred towards capacity expansion.",
+    "The Board recommended a dividend of Rs {eps} per equity share.",
+    "Earnings per share for the year stood at Rs {eps}.",
+    "Regulatory changes may affect pricing in the {seg} segment.",
+]
+SEGMENTS = ["retail", "digital services", "chemicals", "telecom", "energy", "financial services"]
+LINE_ITEMS = [
+    "Revenue from operations", "Other income", "Total income", "Cost of materials consumed",
+    "Employee benefits expense", "Finance costs", "Depreciation and amortisation", "Profit before tax",
+    "Tax expense", "Net profit", "Earnings per share (Rs)",
+]
+LINE_WIDTH = 110
+
+
+def _sentence(rng: random.Random) -> str:
+    return rng.choice(PHRASES).format(
+        pct=rng.randint(2, 40), amt=f"{rng.randint(100, 99999):,}", bps=rng.randint(10, 400),
+        yrs=rng.randint(1, 5), n=rng.randint(3, 30), eps=f"{rng.uniform(1, 90):.2f}", seg=rng.choice(SEGMENTS),
+    )
+
+
+def _table_lines(rng: random.Random, rows: Optional[List[Dict]] = None) -> List[str]:
+    lines = [f"{'Particulars':<34}{'FY2025':>14}{'FY2024':>14}{'Change':>10}"]
+    for item in rng.sample(LINE_ITEMS, 6):
+        current, previous = rng.uniform(100, 99999), rng.uniform(100, 99999)
+        change = (current - previous) / previous * 100
+        lines.append(f"{item:<34}{current:>14,.2f}{previous:>14,.2f}{change:>9.1f}%")
+        if rows is not None:
+            rows.append({"label": item, "FY2025": round(current, 2), "FY2024": round(previous, 2)})
+    return lines
+
+
+def page_lines(rng: random.Random, page_number: int, lines_per_page: int,
+               facts: Optional[List[str]] = None, table: bool = False,
+               table_rows: Optional[List[Dict]] = None) -> List[str]:
+    lines = [f"{rng.choice(SECTIONS)} - page {page_number}", ""]
+    facts = list(facts or [])
+    while len(lines) < lines_per_page:
+        if table and len(lines) > lines_per_page // 3:
+            rows = [] if table_rows is not None else None
+            lines += _table_lines(rng, rows) + [""]
+            if rows is not None and len(lines) <= lines_per_page:  # tables cut off at the page end are not printed
+                table_rows.extend({"page": page_number, **row} for row in rows)
+            table = False
+            continue
+        sentences = [_sentence(rng) for _ in range(rng.randint(3, 6))]
+        if facts:
+            sentences.insert(rng.randint(0, len(sentences)), facts.pop())
+        lines += textwrap.wrap(" ".join(sentences), LINE_WIDTH) + [""]
+    return lines[:lines_per_page]
+
+
+def make_pdf(path: str, pages: int = 300, seed: int = 0, lines_per_page: int = 60,
+             facts: Optional[Dict[int, List[str]]] = None, table_every: int = 0,
+             table_rows: Optional[List[Dict]] = None) -> str:
+    """Write a synthetic filing: wrapped prose paragraphs, optional tables every `table_every`
+    pages and `facts` ({page_number: [sentence, ...]}) planted in the prose of the given pages.
+    A `table_rows` list is filled with the printed table rows ({"page", "label", "FY2025", "FY2024"})."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page()
+        table = bool(table_every) and page_number % table_every == 0
+        lines = page_lines(rng, page_number, lines_per_page, (facts or {}).get(page_number), table, table_rows)
+        page.insert_text((36, 40), "\n".join(lines), fontsize=6.5, fontname="cour")
+    doc.save(path)
+    doc.close()
+    return path
@@ -0,0 +1,236 @@
+import math
+import os
+import re
+from typing import List, Dict, Iterable, Iterator
+
+# --- Config ---
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+TOKEN_ENCODING = "cl100k_base"  # tokenizer of the text-embedding-3 models
+TABLE_MIN_ROWS = 3
+
+_encoding = None
+_encoding_loaded = False
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=["\'(]?[A-Z0-9])')
+_ABBREVIATION = re.compile(
+    r'(?:\b(?:Rs|No|Nos|Ltd|Pvt|Co|Inc|Corp|Mr|Mrs|Ms|Dr|St|Sr|Jr|vs|viz|approx|Fig|Vol|Ref|Cr|Mn|Bn)|\b[A-Z])\.$'
+)
+_NUMBER = re.compile(r'(?<!\S)[-(]?(?:Rs\.?|INR|\$)?\d[\d,]*(?:\.\d+)?%?\)?(?!\S)')
+_JUNK = re.compile(r'[^\w\s.,;:!?()%&/$\'"+=*-]')
+_DIGITS = b"0123456789"
+_PUNCTUATION = b".,;:!?()%&/$'\"+=*-[]"
+
+
+def _get_encoding():
+    # tiktoken is optional, and loading an encoding downloads it on first use; without either
+    # we fall back to an estimate rather than failing the upload
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f"tiktoken encoding {TOKEN_ENCODING} unavailable ({e}), estimating token counts")
+            _encoding = None
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly how cl100k splits: a token per word and per punctuation mark, plus one per three
+    # digits. Rounding up per text keeps a sum over sentences >= the estimate of their join,
+    # so packing by the sum never overshoots a budget.
+    data = text.encode()
+    digits = len(data) - len(data.translate(None, _DIGITS))
+    punctuation = len(data) - len(data.translate(None, _PUNCTUATION))
+    return len(data.split()) + punctuation + math.ceil(digits / 3)
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    encoding = _get_encoding()
+    if encoding is None:
+        return [estimate_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def count_tokens(text: str) -> int:
+    return count_tokens_batch([text])[0]
+
+
+def _clean(text: str) -> str:
+    # Like the old pdf_text.clean_text, but keeps %, currency and other symbols that carry meaning in filings
+    return " ".join(_JUNK.sub(" ", text).split())
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences = []
+    for piece in _SENTENCE_BREAK.split(text):
+        if sentences and _ABBREVIATION.search(sentences[-1][-10:]):
+            sentences[-1] += " " + piece
+        else:
+            sentences.append(piece)
+    return [sentence for sentence in sentences if sentence]
+
+
+def _is_table_row(line: str) -> bool:
+    numbers = len(_NUMBER.findall(line))
+    return numbers > 0 and (numbers * 2 >= len(line.split()) or (numbers >= 2 and "   " in line.strip()))
+
+
+def _is_table_label(line: str) -> bool:
+    # Row labels stand on their own line when a table is extracted cell by cell
+    words = line.split()
+    return 0 < len(words) <= 6 and not line.rstrip().endswith((".", "!", "?"))
+
+
+def _page_units(text: str, page_number: int) -> List[Dict]:
+    """Split one page into sentences (marking paragraph ends) and whole table blocks."""
+    units = []
+    paragraph = []
+    table = []
+    lines = text.split("\n")
+    wrap_width = max((len(line.rstrip()) for line in lines), default=0)
+
+    def end_paragraph():
+        sentences = split_sentences(_clean(" ".join(paragraph)))
+        for i, sentence in enumerate(sentences):
+            units.append({"text": sentence, "kind": "sentence", "page": page_number,
+                          "boundary": i == len(sentences) - 1})
+        paragraph.clear()
+
+    def end_table():
+        if not table:
+            return
+        # Trailing label lines were not followed by numbers, so they belong to the prose
+        tail = []
+        while table and not _is_table_row(table[-1]):
+            tail.insert(0, table.pop())
+        if sum(1 for line in table if _is_table_row(line)) >= TABLE_MIN_ROWS:
+            end_paragraph()
+            rows = [_clean(line) for line in table]
+            units.append({"text": "\n".join(row for row in rows if row), "kind": "table",
+                          "page": page_number, "boundary": True})
+        else:
+            paragraph.extend(table)
+        paragraph.extend(tail)
+        table.clear()
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            end_table()
+            end_paragraph()
+        elif _is_table_row(stripped) or (table and _is_table_label(stripped)):
+            if not table and paragraph and _is_table_label(paragraph[-1]):
+                table.append(paragraph.pop())  # column headings
+            table.append(line.rstrip())
+        else:
+            end_table()
+            paragraph.append(stripped)
+            if stripped.endswith((".", "!", "?", ":")) and len(stripped) < 0.7 * wrap_width:
+                end_paragraph()
+    end_table()
+    end_paragraph()
+    return [unit for unit in units if unit["text"]]
+
+
+def _split_words(text: str, max_tokens: int) -> List[str]:
+    pieces, words, size = [], [], 0
+    for word, tokens in zip(text.split(), count_tokens_batch([" " + word for word in text.split()])):
+        if words and size + tokens > max_tokens:
+            pieces.append(" ".join(words))
+            words, size = [], 0
+        words.append(word)
+        size += tokens
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def _split_oversized(unit: Dict, max_tokens: int) -> List[Dict]:
+    """Break a unit bigger than a chunk: tables by rows (repeating the header row), prose by words."""
+    if unit["kind"] == "table":
+        header, *rows = unit["text"].split("\n")
+        budget = max_tokens - count_tokens(header)
+        if rows and budget > 0 and max(count_tokens_batch(rows)) <= budget:
+            pieces, current, size = [], [], 0
+            for row, tokens in zip(rows, count_tokens_batch(rows)):
+                if current and size + tokens > budget:
+                    pieces.append("\n".join([header] + current))
+                    current, size = [], 0
+                current.append(row)
+                size += tokens
+            pieces.append("\n".join([header] + current))
+        else:
+            pieces = _split_words(unit["text"], max_tokens)
+    else:
+        pieces = _split_words(unit["text"], max_tokens)
+    return [dict(unit, text=piece, tokens=count_tokens(piece), boundary=True) for piece in pieces]
+
+
+def _join(units: List[Dict]) -> str:
+    parts = []
+    for i, unit in enumerate(units):
+        if i:
+            parts.append("\n" if unit["kind"] == "table" or units[i - 1]["kind"] == "table" else " ")
+        parts.append(unit["text"])
+    return "".join(parts)
+
+
+def iter_token_chunks(pages: Iterable[Dict], max_tokens: int = CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict]:
+    """Pack whole sentences and tables into chunks of at most `max_tokens` model tokens.
+
+    Chunks close early at a paragraph or table boundary once they are three quarters full, and a
+    chunk cut mid-paragraph repeats its last sentences (up to `overlap_tokens`) at the start of the
+    next one. Each chunk carries its token_count and the pages it spans.
+    """
+    current: List[Dict] = []
+    size = 0
+    chunk_number = 0
+
+    def emit() -> Dict:
+        nonlocal chunk_number
+        chunk_number += 1
+        text = _join(current)
+        return {
+            "text": text,
+            "chunk_number": chunk_number,
+            "page_start": current[0]["page"],
+            "page_end": current[-1]["page"],
+            "token_count": count_tokens(text),
+        }
+
+    def carry_over(next_unit: Dict) -> List[Dict]:
+        if current[-1]["boundary"] or next_unit["kind"] != "sentence":
+            return []
+        carried, carried_size = [], 0
+        for unit in reversed(current):
+            if unit["kind"] != "sentence" or carried_size + unit["tokens"] > overlap_tokens:
+                break
+            carried.insert(0, unit)
+            carried_size += unit["tokens"]
+        if carried_size + next_unit["tokens"] > max_tokens:
+            return []
+        return carried
+
+    for page in pages:
+        units = _page_units(page["text"], page["page_number"])
+        for unit, tokens in zip(units, count_tokens_batch([unit["text"] for unit in units])):
+            unit["tokens"] = tokens
+            pieces = _split_oversized(unit, max_tokens) if tokens > max_tokens else [unit]
+            for piece in pieces:
+                if current and size + piece["tokens"] > max_tokens:
+                    yield emit()
+                    current = carry_over(piece)
+                    size = sum(u["tokens"] for u in current)
+                current.append(piece)
+                size += piece["tokens"]
+                if piece["boundary"] and size >= 0.75 * max_tokens:
+                    yield emit()
+                    current, size = [], 0
+
+    if current:
+        yield emit()
+
@@ -0,0 +1,181 @@
+import os
+import re
+from functools import lru_cache
+from typing import List, Dict, Set
+
+from chunker import count_tokens, count_tokens_batch, split_sentences
+
+# --- Config ---
+# Tokens allowed for the context section of a prompt (labels included), counted with the
+# same tokenizer as the chunker so the limit holds for the text actually sent
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_JACCARD = 0.8  # a chunk this similar to a more relevant one is dropped
+NEAR_DUPLICATE_CONTAINMENT = 0.9  # as is one this much covered by a more relevant one
+MIN_PARTIAL_TOKENS = 64  # leftover budget worth filling with the head of the next chunk
+REPEATED_SENTENCE_MIN_WORDS = 8  # shorter repeats (table labels, headings) are kept
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str) -> Set[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def is_near_duplicate(candidate: Set[int], kept: Set[int]) -> bool:
+    if not candidate or not kept:
+        return False
+    shared = len(candidate & kept)
+    return (shared / len(candidate | kept) >= NEAR_DUPLICATE_JACCARD
+            or shared / len(candidate) >= NEAR_DUPLICATE_CONTAINMENT)
+
+
+def _strip_overlap(previous: str, following: str, max_words: int = 200) -> str:
+    # The chunker repeats the last sentences of a chunk at the start of the next one
+    prev_words, next_words = previous.split(), following.split()
+    for size in range(min(len(prev_words), len(next_words), max_words), 0, -1):
+        if prev_words[-size:] == next_words[:size]:
+            return " ".join(next_words[size:])
+    return following
+
+
+def _label(block: Dict) -> str:
+    pages = f"p.{block['page_start']}"
+    if block["page_end"] != block["page_start"]:
+        pages += f"-{block['page_end']}"
+    first, last = block["chunk_numbers"][0], block["chunk_numbers"][-1]
+    chunks = f"chunk {first}" if first == last else f"chunks {first}-{last}"
+    return f"[{block['source']}, {pages}, {chunks}]"
+
+
+def _blocks(selected: List[Dict]) -> List[Dict]:
+    # Consecutive chunks of a document become one block; blocks keep the rank of their best chunk
+    blocks = []
+    for rank, chunk in sorted(enumerate(selected), key=lambda rc: (rc[1]["document_sha256"], rc[1]["chunk_number"])):
+        last = blocks[-1] if blocks else None
+        if (last and not last["partial"] and not chunk.get("partial")
+                and last["document_sha256"] == chunk["document_sha256"]
+                and last["chunk_numbers"][-1] + 1 == chunk["chunk_number"]):
+            separator = "\n" if "\n" in last["text"][-200:] or "\n" in chunk["text"][:200] else " "
+            last["text"] += separator + _strip_overlap(last["text"], chunk["text"])
+            last["chunk_numbers"].append(chunk["chunk_number"])
+            last["page_end"] = max(last["page_end"], chunk["page_end"])
+            last["rank"] = min(last["rank"], rank)
+            continue
+        blocks.append({
+            "source": chunk["source"],
+            "document_sha256": chunk["document_sha256"],
+            "chunk_numbers": [chunk["chunk_number"]],
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"],
+            "text": chunk["text"],
+            "rank": rank,
+            "partial": bool(chunk.get("partial")),
+        })
+    return sorted(blocks, key=lambda block: block["rank"])
+
+
+@lru_cache(maxsize=8192)
+def _sentence_keys(line: str):
+    # (sentence, key) pairs; key is None for sentences too short to count as boilerplate.
+    # Cached because packing renders the same lines many times
+    pairs = []
+    for sentence in split_sentences(line):
+        words = _WORD.findall(sentence.lower())
+        key = " ".join(words) if len(words) >= REPEATED_SENTENCE_MIN_WORDS and sentence.rstrip()[-1:] in ".!?" else None
+        pairs.append((sentence, key))
+    return tuple(pairs)
+
+
+def _drop_repeated_sentences(blocks: List[Dict]):
+    # Boilerplate repeated across documents (or years of the same filing) is kept only where it
+    # first appears in relevance order
+    seen = set()
+    for block in blocks:
+        lines = []
+        for line in block["text"].split("\n"):
+            sentences = []
+            for sentence, key in _sentence_keys(line):
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                sentences.append(sentence)
+            if sentences:
+                lines.append(" ".join(sentences))
+        block["text"] = "\n".join(lines)
+
+
+def render_context(selected: List[Dict]) -> str:
+    blocks = _blocks(selected)
+    _drop_repeated_sentences(blocks)
+    return "\n\n".join(f"{_label(block)}\n{block['text']}" for block in blocks if block["text"].strip())
+
+
+def _truncated(chunk: Dict, selected: List[Dict], budget: int) -> Dict:
+    # Longest run of leading sentences that still fits, or None
+    sentences = split_sentences(chunk["text"])
+    low, high, best = 1, len(sentences) - 1, None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = {**chunk, "text": " ".join(sentences[:middle]), "partial": True}
+        if count_tokens(render_context(selected + [candidate])) <= budget:
+            best, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    return best
+
+
+def pack_context(chunks: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> Dict:
+    """Build the prompt context from retrieved chunks (most relevant first): near-duplicates are
+    dropped, chunks are added in relevance order while the rendered text fits the token budget,
+    neighbouring chunks are merged and every block is labelled with its document and pages."""
+    kept, kept_shingles, duplicates = [], [], 0
+    for chunk in chunks:
+        chunk_shingles = shingles(chunk["text"])
+        if any(is_near_duplicate(chunk_shingles, other) for other in kept_shingles):
+            duplicates += 1
+            continue
+        kept.append(chunk)
+        kept_shingles.append(chunk_shingles)
+
+    # Merging and sentence removal only shrink the rendered text, so a chunk whose own labelled
+    # size fits the remaining budget is taken without rendering; the total is checked at the end
+    selected, tokens = [], 0
+    sizes = count_tokens_batch([f"[{c['source']}, p.{c['page_start']}, chunk {c['chunk_number']}]\n{c['text']}\n\n"
+                                for c in kept])
+    for chunk, size in zip(kept, sizes):
+        if tokens + size <= budget:
+            selected.append(chunk)
+            tokens += size
+            continue
+        candidate_tokens = count_tokens(render_context(selected + [chunk]))
+        if candidate_tokens <= budget:
+            selected.append(chunk)
+            tokens = candidate_tokens
+        elif budget - tokens >= MIN_PARTIAL_TOKENS:
+            tokens = count_tokens(render_context(selected))
+            partial = _truncated(chunk, selected, budget) if budget - tokens >= MIN_PARTIAL_TOKENS else None
+            if partial is not None:
+                selected.append(partial)
+                tokens = count_tokens(render_context(selected))
+
+    text = render_context(selected)
+    tokens = count_tokens(text)
+    while tokens > budget and selected:
+        selected.pop()
+        text = render_context(selected)
+        tokens = count_tokens(text)
+
+    return {
+        "text": text,
+        "tokens": tokens,
+        "chunks": selected,
+        "chunk_ids": [f"{c['document_sha256']}:{c['chunk_number']}" + (f":{len(c['text'])}" if c.get("partial") else "")
+                      for c in selected],
+        "candidates": len(chunks),
+        "duplicates_removed": duplicates,
+    }
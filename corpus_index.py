@@ -0,0 +1,427 @@
+import fcntl
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from retrieval import normalize_rows, top_k_indices
+
+# --- Config ---
+# Every worker memory-maps the same directory; state.json names the live segments and is
+# replaced atomically, so readers reload when it changes and never see a half-written index
+CORPUS_INDEX_DIR = os.getenv("CORPUS_INDEX_DIR", ".corpus_index")
+CORPUS_NPROBE = int(os.getenv("CORPUS_NPROBE", "64"))
+CORPUS_VECTOR_DTYPE = os.getenv("CORPUS_VECTOR_DTYPE", "float32")  # float16 halves disk and page cache
+CORPUS_MAX_SEGMENTS = int(os.getenv("CORPUS_MAX_SEGMENTS", "16"))  # more than this and inserts are merged
+SMALL_MERGE_FRACTION = 0.25  # inserts are merged among themselves until they reach this share of the base
+MIN_TRAIN_ROWS = 20_000  # below this there are no clusters and every query is exact
+# Filters matching less vector data than this are searched exactly (about 11k rows at 1536
+# float32 dims, 65k at 256); larger ones go through the probed lists and are masked there
+EXACT_FILTER_BYTES = int(os.getenv("CORPUS_EXACT_FILTER_BYTES", str(64 * 1024 ** 2)))
+GATHER_ROWS = 4096  # rows copied out of the memory map at a time when scoring a filter exactly
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 32
+BLOCK_ROWS = 65_536
+
+
+def _kmeans(sample: np.ndarray, n_lists: int, seed: int = 0) -> np.ndarray:
+    # Spherical k-means: vectors are unit length, so the nearest centroid is the largest dot product
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = _assign(sample, centroids)
+        counts = np.bincount(assign, minlength=n_lists)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts[~empty], axis=0)
+        # Empty lists restart from random points instead of dying
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def _assign(vectors: np.ndarray, centroids: Optional[np.ndarray]) -> np.ndarray:
+    if centroids is None:
+        return np.zeros(len(vectors), dtype=np.int32)
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+class _Segment:
+    """Vectors sorted by IVF list (rows of list l are offsets[l]:offsets[l + 1]) plus per-row
+    chunk id, ticker code and year. Vectors stay memory-mapped; the metadata is small and in RAM."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"))
+        self.tickers = np.load(os.path.join(path, "tickers.npy"))
+        self.years = np.load(os.path.join(path, "years.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def lists(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+
+
+def _write_segment(root: str, vectors, ids: np.ndarray, tickers: np.ndarray, years: np.ndarray,
+                   assign: np.ndarray, n_lists: int) -> str:
+    """Write rows sorted by list into a new segment directory. `vectors` only needs .shape and
+    row fancy-indexing, so compaction can stream from the old segments block by block."""
+    name = f"seg-{uuid.uuid4().hex[:12]}"
+    staging = tempfile.mkdtemp(prefix=f".{name}-", dir=root)
+    try:
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+        dim = vectors.shape[1]
+        out = np.lib.format.open_memmap(os.path.join(staging, "vectors.npy"), mode="w+",
+                                        dtype=CORPUS_VECTOR_DTYPE, shape=(len(order), dim))
+        for start in range(0, len(order), BLOCK_ROWS):
+            rows = order[start:start + BLOCK_ROWS]
+            # Sorted reads keep memory-mapped sources sequential; put back in list order afterwards
+            sorted_rows = np.sort(rows)
+            block = np.asarray(vectors[sorted_rows])
+            out[start:start + len(rows)] = block[np.searchsorted(sorted_rows, rows)]
+        out.flush()
+        del out
+        np.save(os.path.join(staging, "ids.npy"), ids[order])
+        np.save(os.path.join(staging, "tickers.npy"), tickers[order])
+        np.save(os.path.join(staging, "years.npy"), years[order])
+        np.save(os.path.join(staging, "offsets.npy"), offsets)
+        os.replace(staging, os.path.join(root, name))
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return name
+
+
+def _gather_scores(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # Scattered rows in blocks, so memory stays at GATHER_ROWS vectors however many rows match
+    scores = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), GATHER_ROWS):
+        block = rows[start:start + GATHER_ROWS]
+        scores[start:start + len(block)] = vectors[block] @ query
+    return scores
+
+
+class _ConcatRows:
+    # Row access across several segments' vectors as if they were one array, for compaction
+    def __init__(self, segments: List[_Segment]):
+        self.segments = segments
+        self.starts = np.cumsum([0] + [len(segment) for segment in segments])
+        self.shape = (int(self.starts[-1]), segments[0].vectors.shape[1])
+
+    def __getitem__(self, rows: np.ndarray) -> np.ndarray:
+        out = np.empty((len(rows), self.shape[1]), dtype=self.segments[0].vectors.dtype)
+        which = np.searchsorted(self.starts, rows, side="right") - 1
+        for i, segment in enumerate(self.segments):
+            mask = which == i
+            if mask.any():
+                out[mask] = segment.vectors[rows[mask] - self.starts[i]]
+        return out
+
+
+class CorpusIndex:
+    """IVF-flat nearest-neighbour index over the chunks of every indexed filing.
+
+    Inserts append a small segment sorted by the current clusters. Once there are more than
+    CORPUS_MAX_SEGMENTS, the small ones are merged together, or into the base segment once
+    they add up to a quarter of it, so the base is rewritten a logarithmic number of times.
+    The clusters are retrained whenever the corpus has grown fourfold since the last training. A query scores only the
+    CORPUS_NPROBE closest clusters, except when a ticker/year filter is selective enough to
+    score its matching rows exactly.
+    """
+
+    def __init__(self, root: str = CORPUS_INDEX_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._state_version = None
+        self._snapshot = ([], None, {})  # (segments, centroids, ticker codes)
+        with self._manifest() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tickers (
+                    code INTEGER PRIMARY KEY,
+                    ticker TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS documents (
+                    sha256 TEXT PRIMARY KEY,
+                    ticker TEXT NOT NULL,
+                    year INTEGER,
+                    chunk_count INTEGER NOT NULL,
+                    added_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    chunk_number INTEGER NOT NULL,
+                    page_start INTEGER,
+                    page_end INTEGER,
+                    text TEXT NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def _manifest(self):
+        conn = sqlite3.connect(os.path.join(self.root, "manifest.sqlite3"), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _writer(self):
+        # One writer at a time across threads and worker processes
+        with self._lock, open(os.path.join(self.root, "write.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.root, "state.json")
+
+    def _read_state(self) -> Dict:
+        try:
+            with open(self._state_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"segments": [], "centroids": None, "trained_rows": 0}
+
+    def _write_state(self, state: Dict):
+        fd, staging = tempfile.mkstemp(suffix=".part", dir=self.root)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(staging, self._state_path())
+        except Exception:
+            try:
+                os.unlink(staging)
+            except OSError:
+                pass
+            raise
+
+    def _current(self):
+        """Segments, centroids and ticker codes as of the latest state.json, reloaded if it changed."""
+        try:
+            stat = os.stat(self._state_path())
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            version = None
+        if version != self._state_version:
+            with self._lock:
+                state = self._read_state()
+                segments = [_Segment(os.path.join(self.root, name)) for name in state["segments"]]
+                centroids = np.load(os.path.join(self.root, state["centroids"])) if state["centroids"] else None
+                with self._manifest() as conn:
+                    codes = {row["ticker"]: row["code"] for row in conn.execute("SELECT code, ticker FROM tickers")}
+                self._snapshot = (segments, centroids, codes)
+                self._state_version = version
+        return self._snapshot
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self._current()[0])
+
+    def has_document(self, sha: str) -> bool:
+        with self._manifest() as conn:
+            return conn.execute("SELECT 1 FROM documents WHERE sha256 = ?", (sha,)).fetchone() is not None
+
+    def add_document(self, sha: str, ticker: str, year: Optional[int], chunks: List[Dict], embeddings: np.ndarray) -> int:
+        """Insert one filing's chunks (embeddings as stored by doc_index); returns rows added, 0 if already present."""
+        ticker = ticker.strip().upper()
+        with self._writer():
+            with self._manifest() as conn:
+                if conn.execute("SELECT 1 FROM documents WHERE sha256 = ?", (sha,)).fetchone():
+                    return 0
+            if not chunks:
+                return 0
+            state = self._read_state()
+            centroids = np.load(os.path.join(self.root, state["centroids"])) if state["centroids"] else None
+
+            with self._manifest() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT OR IGNORE INTO tickers (ticker) VALUES (?)", (ticker,))
+                code = conn.execute("SELECT code FROM tickers WHERE ticker = ?", (ticker,)).fetchone()["code"]
+                first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()[0]
+                ids = np.arange(first_id, first_id + len(chunks), dtype=np.int64)
+                conn.executemany(
+                    "INSERT INTO chunks (id, sha256, chunk_number, page_start, page_end, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(int(chunk_id), sha, chunk["chunk_number"], chunk.get("page_start"), chunk.get("page_end"), chunk["text"])
+                     for chunk_id, chunk in zip(ids, chunks)],
+                )
+                conn.execute("INSERT INTO documents (sha256, ticker, year, chunk_count, added_at) VALUES (?, ?, ?, ?, ?)",
+                             (sha, ticker, year, len(chunks), time.time()))
+                vectors = normalize_rows(embeddings)
+                n_lists = 1 if centroids is None else len(centroids)
+                name = _write_segment(self.root, vectors, ids, np.full(len(ids), code, dtype=np.int32),
+                                      np.full(len(ids), year or 0, dtype=np.int16), _assign(vectors, centroids), n_lists)
+                try:
+                    conn.execute("COMMIT")
+                except Exception:
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                    raise
+
+            # Readers see the segment only once state.json lists it, by which time its rows are committed
+            state["segments"].append(name)
+            try:
+                self._write_state(state)
+            except Exception:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                with self._manifest() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM chunks WHERE sha256 = ?", (sha,))
+                    conn.execute("DELETE FROM documents WHERE sha256 = ?", (sha,))
+                    conn.execute("COMMIT")
+                raise
+
+            sizes = [len(np.load(os.path.join(self.root, seg, "ids.npy"), mmap_mode="r")) for seg in state["segments"]]
+            retrain = sum(sizes) >= MIN_TRAIN_ROWS and sum(sizes) >= 4 * state["trained_rows"]
+            if retrain or len(state["segments"]) > CORPUS_MAX_SEGMENTS:
+                base = max(range(len(sizes)), key=sizes.__getitem__)
+                small_only = not retrain and sum(sizes) - sizes[base] < SMALL_MERGE_FRACTION * sizes[base]
+                self._compact(state, retrain, keep=[state["segments"][base]] if small_only else [])
+        return len(chunks)
+
+    def compact(self, retrain: bool = False):
+        with self._writer():
+            self._compact(self._read_state(), retrain)
+
+    def _compact(self, state: Dict, retrain: bool, keep: List[str] = ()):
+        # Merge every segment not in `keep` into one, re-clustering first if asked to
+        merging = [name for name in state["segments"] if name not in keep]
+        segments = [_Segment(os.path.join(self.root, name)) for name in merging]
+        if not segments:
+            return
+        rows = _ConcatRows(segments)
+        centroids_name = state["centroids"]
+        if retrain:
+            n_lists = int(np.clip(4 * np.sqrt(rows.shape[0]), 1, 65_536))
+            sample_size = min(rows.shape[0], n_lists * KMEANS_SAMPLE_PER_LIST)
+            sample_rows = np.sort(np.random.default_rng(0).choice(rows.shape[0], sample_size, replace=False))
+            centroids = _kmeans(np.asarray(rows[sample_rows], dtype=np.float32), n_lists)
+            centroids_name = f"centroids-{uuid.uuid4().hex[:12]}.npy"
+            np.save(os.path.join(self.root, centroids_name), centroids)
+            assign = np.concatenate([_assign(segment.vectors, centroids) for segment in segments])
+            state["trained_rows"] = rows.shape[0]
+        else:
+            n_lists = len(segments[0].offsets) - 1
+            assign = np.concatenate([segment.lists() for segment in segments])
+
+        name = _write_segment(
+            self.root, rows,
+            np.concatenate([segment.ids for segment in segments]),
+            np.concatenate([segment.tickers for segment in segments]),
+            np.concatenate([segment.years for segment in segments]),
+            assign, n_lists,
+        )
+        old_centroids = state["centroids"]
+        state.update(segments=list(keep) + [name], centroids=centroids_name)
+        self._write_state(state)
+        # Readers holding the old files keep their mappings; the names just disappear
+        for old in merging:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+        if old_centroids and old_centroids != centroids_name:
+            try:
+                os.unlink(os.path.join(self.root, old_centroids))
+            except OSError:
+                pass
+
+    def search(self, query: np.ndarray, k: int = 10, tickers: Optional[List[str]] = None,
+               years: Optional[List[int]] = None, nprobe: int = CORPUS_NPROBE) -> List[Dict]:
+        segments, centroids, codes = self._current()
+        query = normalize_rows(query)[0]
+        ticker_codes = [codes[t.upper()] for t in tickers if t.upper() in codes] if tickers else None
+        if tickers and not ticker_codes:
+            return []
+
+        masks = None
+        if tickers or years:
+            masks = []
+            for segment in segments:
+                mask = np.ones(len(segment), dtype=bool)
+                if ticker_codes:
+                    mask &= np.isin(segment.tickers, ticker_codes)
+                if years:
+                    mask &= np.isin(segment.years, years)
+                masks.append(mask)
+        matched = sum(int(m.sum()) for m in masks) if masks is not None else 0
+        row_bytes = segments[0].vectors.shape[1] * segments[0].vectors.itemsize if segments else 0
+        exact = centroids is None or (masks is not None and matched * row_bytes <= EXACT_FILTER_BYTES)
+        probe = None
+        if not exact:
+            if masks is not None:
+                # A filter keeping a fraction f of the rows probes 1/f times more lists but only reads
+                # its own rows in them, so it costs about what an unfiltered query does at the same recall
+                total = sum(len(segment) for segment in segments)
+                nprobe = int(np.ceil(nprobe * total / max(matched, 1)))
+            probe = top_k_indices(centroids @ query, min(nprobe, len(centroids)))
+
+        all_scores, all_ids = [], []
+        for i, segment in enumerate(segments):
+            if exact:
+                rows = np.flatnonzero(masks[i]) if masks is not None else np.arange(len(segment))
+                scores = _gather_scores(segment.vectors, rows, query) if masks is not None else segment.vectors @ query
+            elif masks is not None:
+                rows = np.flatnonzero(masks[i])
+                lists = np.searchsorted(segment.offsets, rows, side="right") - 1
+                rows = rows[np.isin(lists, probe)]
+                scores = _gather_scores(segment.vectors, rows, query)
+            else:
+                # Each probed list is scored straight off the memory map, without gathering a copy
+                bounds = [(segment.offsets[l], segment.offsets[l + 1]) for l in probe]
+                bounds = [(start, stop) for start, stop in bounds if stop > start]
+                if not bounds:
+                    continue
+                rows = np.concatenate([np.arange(start, stop) for start, stop in bounds])
+                scores = np.concatenate([segment.vectors[start:stop] @ query for start, stop in bounds])
+            if len(rows) == 0:
+                continue
+            all_scores.append(scores.astype(np.float32, copy=False))
+            all_ids.append(segment.ids[rows])
+        if not all_scores:
+            return []
+
+        scores = np.concatenate(all_scores)
+        ids = np.concatenate(all_ids)
+        best = top_k_indices(scores, k)
+        return self._fetch(ids[best].tolist(), scores[best].tolist())
+
+    def _fetch(self, ids: List[int], scores: List[float]) -> List[Dict]:
+        with self._manifest() as conn:
+            rows = conn.execute(
+                f"SELECT c.id, c.sha256, c.chunk_number, c.page_start, c.page_end, c.text, d.ticker, d.year "
+                f"FROM chunks c JOIN documents d ON d.sha256 = c.sha256 WHERE c.id IN ({','.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+        by_id = {row["id"]: dict(row) for row in rows}
+        return [{**by_id[chunk_id], "score": score} for chunk_id, score in zip(ids, scores) if chunk_id in by_id]
+
+
+_corpus_index: Optional[CorpusIndex] = None
+_corpus_index_lock = threading.Lock()
+
+
+def get_corpus_index() -> CorpusIndex:
+    global _corpus_index
+    with _corpus_index_lock:
+        if _corpus_index is None:
+            _corpus_index = CorpusIndex()
+        return _corpus_index
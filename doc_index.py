@@ -0,0 +1,364 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional
+
+import numpy as np
+from openai import OpenAI, AsyncOpenAI
+
+from embeddings import embed_texts, embed_texts_async, EMBEDDING_MODEL
+from pdf_text import iter_pdf_pages, iter_pdf_pages_in_process, reset_extract_pool
+from chunker import iter_token_chunks
+from retrieval import normalize_rows, BM25Index
+from fact_store import FactTable
+from metrics import stage, inc, cache_result
+from ocr import ocr_available
+
+# --- Config ---
+INDEX_DIR = os.getenv("DOC_INDEX_DIR", ".doc_index")
+MAX_INDEX_BYTES = int(os.getenv("DOC_INDEX_MAX_BYTES", str(2 * 1024 ** 3)))
+INDEX_VERSION = 4  # bump whenever extraction/chunking changes so stale indexes are rebuilt
+
+_hash_cache: Dict[tuple, str] = {}
+# One lock per document being built, shared by the sync and async paths and dropped once the
+# last builder waiting on it is done
+_build_locks: Dict[str, threading.Lock] = {}
+_build_lock_users: Dict[str, int] = {}
+_build_locks_guard = threading.Lock()
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def document_sha256(pdf_path: str) -> str:
+    # Hashing a large filing is not free, so remember it for as long as the file is unchanged
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_size, stat.st_mtime_ns)
+    if key not in _hash_cache:
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+
+def _entry_dir(sha: str) -> str:
+    return os.path.join(INDEX_DIR, sha)
+
+
+def _read_meta(sha: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(_entry_dir(sha), "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != INDEX_VERSION or meta.get("embedding_model") != EMBEDDING_MODEL:
+        return None
+    if not meta.get("page_count"):
+        return None
+    # Scanned filings indexed without OCR came out empty; with an OCR engine they are redone,
+    # once: if OCR was available for the build, a blank result is the document's real content
+    if not meta.get("chunk_count") and not meta.get("ocr_attempted") and ocr_available():
+        return None
+    return meta
+
+
+def has_index(sha: str) -> bool:
+    return _read_meta(sha) is not None
+
+
+def _touch(sha: str):
+    try:
+        os.utime(_entry_dir(sha))
+    except OSError:
+        pass
+
+
+def load_document_index(sha: str, pdf_path: Optional[str] = None) -> Optional[Dict]:
+    meta = _read_meta(sha)
+    if meta is None:
+        return None
+    entry = _entry_dir(sha)
+    with open(os.path.join(entry, "pages.json"), "r", encoding="utf-8") as f:
+        pages = json.load(f)
+    with open(os.path.join(entry, "chunks.json"), "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    embeddings = np.load(os.path.join(entry, "embeddings.npy"), mmap_mode="r")
+    lexical = _load_lexical(entry, chunks)
+    facts = _load_facts(entry, sha, pdf_path)
+    _touch(sha)
+    return {"sha256": sha, "meta": meta, "pages": pages, "chunks": chunks, "embeddings": embeddings, "lexical": lexical,
+            "facts": facts}
+
+
+def _load_lexical(entry: str, chunks: List[Dict]) -> BM25Index:
+    path = os.path.join(entry, "lexical.npz")
+    try:
+        return BM25Index.load(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    # Entries written before the lexical index existed get one now instead of being re-embedded
+    lexical = BM25Index.from_texts([chunk["text"] for chunk in chunks])
+    try:
+        fd, staging = tempfile.mkstemp(suffix=".part", dir=entry)
+        os.close(fd)
+        lexical.save(staging)
+        os.replace(staging, path)
+    except OSError as e:
+        print(f"Could not save lexical index in {entry}: {e}")
+    return lexical
+
+
+def _load_facts(entry: str, sha: str, pdf_path: Optional[str]) -> FactTable:
+    path = os.path.join(entry, "facts.npz")
+    try:
+        return FactTable.load(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    if pdf_path is None:
+        return FactTable.empty()
+    # Entries written before the fact store existed get their tables read now, without re-embedding
+    try:
+        with stage("extract_tables"):
+            facts = FactTable.from_pages(sha, list(iter_pdf_pages(pdf_path)))
+    except Exception as e:
+        print(f"Could not extract tables from {pdf_path}: {e}")
+        return FactTable.empty()
+    try:
+        fd, staging = tempfile.mkstemp(suffix=".part", dir=entry)
+        os.close(fd)
+        facts.save(staging)
+        os.replace(staging, path)
+    except OSError as e:
+        print(f"Could not save fact store in {entry}: {e}")
+    return facts
+
+
+def _write_index(sha: str, meta: Dict, pages: List[Dict], chunks: List[Dict], embeddings: np.ndarray,
+                 lexical: BM25Index, facts: FactTable):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{sha}-", dir=INDEX_DIR)
+    try:
+        with open(os.path.join(staging, "pages.json"), "w", encoding="utf-8") as f:
+            json.dump(pages, f)
+        with open(os.path.join(staging, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        np.save(os.path.join(staging, "embeddings.npy"), embeddings)
+        lexical.save(os.path.join(staging, "lexical.npz"))
+        facts.save(os.path.join(staging, "facts.npz"))
+        # meta.json goes last: an entry without it is treated as missing
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        target = _entry_dir(sha)
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def _chunk_pages(pages_iter) -> tuple:
+    # Pages stream from the extraction pool straight into the chunker; only the page list kept
+    # for the index grows with the document.
+    pages = []
+    chunks = []
+
+    def record(page_iter):
+        for page in page_iter:
+            pages.append(page)
+            yield page
+
+    for chunk in iter_token_chunks(record(pages_iter)):
+        if chunk["text"]:
+            chunk["chunk_number"] = len(chunks) + 1
+            chunks.append(chunk)
+    return pages, chunks
+
+
+def _prepare_chunks(pdf_path: str):
+    # CPU-bound half of indexing; the async path runs it off the event loop.
+    # Returns (pages, chunks, extracted); a failed extraction must not be stored as an empty index.
+    try:
+        inc("bytes_total", os.path.getsize(pdf_path), kind="pdf_extracted")
+    except OSError:
+        pass
+    try:
+        with stage("extract"):
+            try:
+                pages, chunks = _chunk_pages(iter_pdf_pages(pdf_path))
+            except BrokenProcessPool as e:
+                print(f"PDF extraction pool failed ({e}), retrying {pdf_path} in-process")
+                reset_extract_pool()
+                pages, chunks = _chunk_pages(iter_pdf_pages_in_process(pdf_path))
+    except Exception as e:
+        print(f"Error extracting PDF text from {pdf_path}: {e}")
+        return [], [], False
+    inc("items_total", len(pages), kind="pages_extracted")
+    inc("items_total", len(chunks), kind="chunks_indexed")
+    return pages, chunks, True
+
+
+def _finish_index(sha: str, pages: List[Dict], chunks: List[Dict], embedded: Dict, extracted: bool = True) -> Dict:
+    errors = embedded["errors"]
+    for idx, error in sorted(errors.items()):
+        print(f"Embedding error for {sha[:12]} chunk {idx + 1}: {error}")
+    ok = embedded["ok"]
+    chunks = [chunk for idx, chunk in enumerate(chunks) if ok[idx]]
+    # Stored pre-normalized so retrieval is a single matmul straight off the memory map
+    embeddings = normalize_rows(embedded["embeddings"][ok])
+    # BM25 postings are built now, at upload, so lexical and hybrid queries only read them
+    lexical = BM25Index.from_texts([chunk["text"] for chunk in chunks])
+    # Tables were read by the extraction workers; as line items they are stored once, not per page
+    facts = FactTable.from_pages(sha, pages)
+    for page in pages:
+        page.pop("tables", None)
+    inc("items_total", len(facts), kind="facts_extracted")
+
+    meta = {
+        "version": INDEX_VERSION,
+        "sha256": sha,
+        "embedding_model": EMBEDDING_MODEL,
+        "page_count": len(pages),
+        "chunk_count": len(chunks),
+        "fact_count": len(facts),
+        "rejected_chunks": len(embedded["rejected"]),
+        # A page whose OCR errored may have text after all, so only a clean OCR pass counts
+        "ocr_attempted": ocr_available() and not any(page.get("ocr_failed") for page in pages),
+        "created_at": time.time(),
+    }
+    index = {"sha256": sha, "meta": meta, "pages": pages, "chunks": chunks, "embeddings": embeddings, "lexical": lexical,
+             "facts": facts}
+
+    # Transient failures (timeouts, rate limits, a dead extraction pool) must not be persisted
+    # or they would stick forever
+    if not extracted:
+        print(f"Not persisting index {sha[:12]}: text extraction failed")
+        return index
+    if len(errors) > len(embedded["rejected"]):
+        print(f"Not persisting index {sha[:12]}: {len(errors)} chunks failed to embed")
+        return index
+
+    _write_index(sha, meta, pages, chunks, embeddings, lexical, facts)
+    evict_index_cache(keep=[sha])
+    return load_document_index(sha) or index
+
+
+def _take_build_lock(sha: str) -> threading.Lock:
+    with _build_locks_guard:
+        _build_lock_users[sha] = _build_lock_users.get(sha, 0) + 1
+        return _build_locks.setdefault(sha, threading.Lock())
+
+
+def _drop_build_lock(sha: str) -> None:
+    with _build_locks_guard:
+        _build_lock_users[sha] -= 1
+        if not _build_lock_users[sha]:
+            del _build_lock_users[sha]
+            del _build_locks[sha]
+
+
+def _release_build_lock(sha: str, lock: threading.Lock) -> None:
+    lock.release()
+    _drop_build_lock(sha)
+
+
+async def _acquire_build_lock_async(sha: str, lock: threading.Lock) -> None:
+    # The blocking acquire runs in a worker thread; if the caller is cancelled while waiting,
+    # the lock is released as soon as that thread gets it
+    acquiring = asyncio.ensure_future(asyncio.to_thread(lock.acquire))
+
+    def give_back(future):
+        if future.cancelled():
+            _drop_build_lock(sha)
+        else:
+            _release_build_lock(sha, lock)
+
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(give_back)
+        raise
+
+
+def build_document_index(pdf_path: str, client: OpenAI, sha: Optional[str] = None) -> Dict:
+    """Return the index for `pdf_path`, extracting and embedding it only if no index is stored yet."""
+    sha = sha or document_sha256(pdf_path)
+    lock = _take_build_lock(sha)
+    lock.acquire()
+    try:
+        index = load_document_index(sha, pdf_path)
+        cache_result("document_index", index is not None)
+        if index is not None:
+            return index
+        pages, chunks, extracted = _prepare_chunks(pdf_path)
+        with stage("embed_chunks"):
+            embedded = embed_texts([chunk["text"] for chunk in chunks], client, model=EMBEDDING_MODEL)
+        with stage("index_write"):
+            return _finish_index(sha, pages, chunks, embedded, extracted)
+    finally:
+        _release_build_lock(sha, lock)
+
+
+async def build_document_index_async(pdf_path: str, client: AsyncOpenAI, sha: Optional[str] = None) -> Dict:
+    """Async build_document_index: file and CPU work runs in worker threads, embedding on the async client."""
+    sha = sha or await asyncio.to_thread(document_sha256, pdf_path)
+    lock = _take_build_lock(sha)
+    await _acquire_build_lock_async(sha, lock)
+    try:
+        with stage("index_load"):
+            index = await asyncio.to_thread(load_document_index, sha, pdf_path)
+        cache_result("document_index", index is not None)
+        if index is not None:
+            return index
+        pages, chunks, extracted = await asyncio.to_thread(_prepare_chunks, pdf_path)
+        with stage("embed_chunks"):
+            embedded = await embed_texts_async([chunk["text"] for chunk in chunks], client, model=EMBEDDING_MODEL)
+        with stage("index_write"):
+            return await asyncio.to_thread(_finish_index, sha, pages, chunks, embedded, extracted)
+    finally:
+        _release_build_lock(sha, lock)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict_index_cache(max_bytes: int = MAX_INDEX_BYTES, keep: Optional[List[str]] = None) -> List[str]:
+    """Delete least recently used indexes until the cache fits in `max_bytes`."""
+    if not os.path.isdir(INDEX_DIR):
+        return []
+    keep = set(keep or [])
+    entries = []
+    for name in os.listdir(INDEX_DIR):
+        path = os.path.join(INDEX_DIR, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        entries.append((os.path.getmtime(path), name, _dir_size(path)))
+
+    total = sum(size for _, _, size in entries)
+    evicted = []
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(INDEX_DIR, name), ignore_errors=True)
+        total -= size
+        evicted.append(name)
+    return evicted
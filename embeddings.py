@@ -0,0 +1,165 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+import numpy as np
+from openai import OpenAI, AsyncOpenAI, BadRequestError
+
+from metrics import inc
+
+# --- Config ---
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+MAX_BATCH_ITEMS = int(os.getenv("EMBEDDING_MAX_BATCH_ITEMS", "512"))  # API hard limit is 2048 inputs
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "250000"))  # API hard limit is 300k tokens
+MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+
+def estimate_tokens(text: str) -> int:
+    # OpenAI's rule of thumb is ~4 characters per token; dividing by 3 stays on the safe side
+    # for the dense numeric tables in filings
+    return len(text) // 3 + 1
+
+
+def make_batches(texts: List[str], max_items: int = MAX_BATCH_ITEMS, max_tokens: int = MAX_BATCH_TOKENS) -> List[List[int]]:
+    batches = []
+    current, current_tokens = [], 0
+    for idx, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _record_usage(response, model: str):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        inc("openai_tokens_total", usage.prompt_tokens, model=model, kind="embedding")
+
+
+def _embed_batch(client: OpenAI, texts: List[str], indices: List[int], model: str, out: np.ndarray,
+                 errors: Dict[int, str], rejected: set):
+    try:
+        response = client.embeddings.create(input=[texts[i] for i in indices], model=model)
+    except BadRequestError as e:
+        # A single bad input rejects the whole batch, so bisect until the offending chunks are isolated
+        if len(indices) == 1:
+            errors[indices[0]] = f"Rejected by embeddings API: {e}"
+            rejected.add(indices[0])
+            return
+        mid = len(indices) // 2
+        _embed_batch(client, texts, indices[:mid], model, out, errors, rejected)
+        _embed_batch(client, texts, indices[mid:], model, out, errors, rejected)
+        return
+    except Exception as e:
+        for i in indices:
+            errors[i] = f"Embedding batch failed: {e}"
+        return
+
+    _record_usage(response, model)
+    for item in response.data:
+        out[indices[item.index]] = item.embedding
+
+
+async def _embed_batch_async(client: AsyncOpenAI, texts: List[str], indices: List[int], model: str, out: np.ndarray,
+                             errors: Dict[int, str], rejected: set, semaphore: asyncio.Semaphore):
+    try:
+        async with semaphore:
+            response = await client.embeddings.create(input=[texts[i] for i in indices], model=model)
+    except BadRequestError as e:
+        if len(indices) == 1:
+            errors[indices[0]] = f"Rejected by embeddings API: {e}"
+            rejected.add(indices[0])
+            return
+        mid = len(indices) // 2
+        await asyncio.gather(
+            _embed_batch_async(client, texts, indices[:mid], model, out, errors, rejected, semaphore),
+            _embed_batch_async(client, texts, indices[mid:], model, out, errors, rejected, semaphore),
+        )
+        return
+    except Exception as e:
+        for i in indices:
+            errors[i] = f"Embedding batch failed: {e}"
+        return
+
+    _record_usage(response, model)
+    for item in response.data:
+        out[indices[item.index]] = item.embedding
+
+
+def _plan(texts: List[str], max_items: int, max_tokens: int) -> Dict:
+    plan = {
+        "embeddings": np.full((len(texts), EMBEDDING_DIM), np.nan, dtype=np.float32),
+        "errors": {},
+        "rejected": set(),
+        "pending": [],
+    }
+    for idx, text in enumerate(texts):
+        if text and text.strip():
+            plan["pending"].append(idx)
+        else:
+            plan["errors"][idx] = "Empty text cannot be embedded"
+            plan["rejected"].add(idx)
+
+    pending = plan["pending"]
+    pending_texts = [texts[i] for i in pending]
+    plan["batches"] = [[pending[i] for i in batch] for batch in make_batches(pending_texts, max_items, max_tokens)]
+    return plan
+
+
+def _result(texts: List[str], plan: Dict) -> Dict:
+    errors = plan["errors"]
+    ok = np.zeros(len(texts), dtype=bool)
+    ok[plan["pending"]] = True
+    if errors:
+        ok[list(errors)] = False
+
+    return {
+        "embeddings": plan["embeddings"],
+        "ok": ok,
+        "errors": errors,
+        "rejected": sorted(plan["rejected"]),
+        "batches": len(plan["batches"]),
+    }
+
+
+def embed_texts(texts: List[str], client: OpenAI, model: str = EMBEDDING_MODEL,
+                max_items: int = MAX_BATCH_ITEMS, max_tokens: int = MAX_BATCH_TOKENS,
+                max_concurrency: int = MAX_CONCURRENT_BATCHES) -> Dict:
+    """Embed texts in size-bounded batches with at most `max_concurrency` requests in flight.
+
+    Returns the (n, dim) float32 matrix, a boolean mask of rows that were embedded and the
+    error message for every row that was not. Failed rows are left as NaN so they can never
+    be mistaken for a real vector. `rejected` lists the rows that will fail again on retry
+    (empty or invalid input), as opposed to transient network or rate-limit failures.
+    """
+    plan = _plan(texts, max_items, max_tokens)
+    batches = plan["batches"]
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+            futures = [
+                pool.submit(_embed_batch, client, texts, batch, model, plan["embeddings"], plan["errors"], plan["rejected"])
+                for batch in batches
+            ]
+            for future in futures:
+                future.result()
+    return _result(texts, plan)
+
+
+async def embed_texts_async(texts: List[str], client: AsyncOpenAI, model: str = EMBEDDING_MODEL,
+                            max_items: int = MAX_BATCH_ITEMS, max_tokens: int = MAX_BATCH_TOKENS,
+                            max_concurrency: int = MAX_CONCURRENT_BATCHES) -> Dict:
+    """Same contract as embed_texts, without blocking the event loop."""
+    plan = _plan(texts, max_items, max_tokens)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    await asyncio.gather(*[
+        _embed_batch_async(client, texts, batch, model, plan["embeddings"], plan["errors"], plan["rejected"], semaphore)
+        for batch in plan["batches"]
+    ])
+    return _result(texts, plan)
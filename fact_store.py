@@ -0,0 +1,361 @@
+import os
+import re
+from typing import List, Dict, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from chunker import TABLE_MIN_ROWS, _is_table_row
+
+# --- Config ---
+# Line items of the financial tables in a filing, one row per (document, period, metric),
+# extracted at index time so numeric questions are looked up instead of re-read by the LLM
+FACT_PROMPT_MAX_ROWS = int(os.getenv("FACT_PROMPT_MAX_ROWS", "24"))  # line items in a prompt's figures table
+FACT_PROMPT_MAX_PERIODS = 4
+DIRECT_ANSWER_MAX_WORDS = 16  # longer questions want an explanation, not a figure
+MAX_LABEL_CHARS = 60  # a longer lone cell is a line of prose, which ends the table above it
+
+# Checked in order, so the more specific names come first ("total income" before "income")
+METRICS: List[Tuple[str, re.Pattern]] = [(name, re.compile(pattern, re.IGNORECASE)) for name, pattern in [
+    ("total_income", r"\btotal (income|revenue)\b"),
+    ("other_income", r"\bother income\b"),
+    ("revenue", r"\brevenue\b|\bnet sales\b|\bturnover\b|\bsales\b"),
+    ("materials_cost", r"\bcost of (raw )?materials?\b|\bmaterials? consumed\b"),
+    ("employee_expense", r"\bemployee benefits? expenses?\b|\bemployee costs?\b|\bstaff costs?\b"),
+    ("finance_costs", r"\bfinance costs?\b|\binterest expenses?\b"),
+    ("depreciation", r"\bdepreciation\b"),
+    ("ebitda", r"\bebitda\b"),
+    ("pbt", r"\bprofit before tax\b|\bpbt\b"),
+    ("net_profit", r"\bnet (profit|income)\b|\bprofit after tax\b|\bprofit for the (year|period)\b|\bpat\b"),
+    ("tax", r"\btax expenses?\b|\bincome tax\b|\btotal tax\b"),
+    ("eps", r"\bearnings per share\b|\beps\b"),
+]]
+
+_MONTHS = {m: i for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+_FY = re.compile(r"^(?:FY\s*'?|F\.Y\.\s*|fiscal\s+)(\d{4}|\d{2})(?:\s*-\s*(\d{2,4}))?$", re.IGNORECASE)
+_YEAR_RANGE = re.compile(r"^(?:FY\s*)?(\d{4})\s*[-/]\s*(\d{2}|\d{4})$", re.IGNORECASE)
+_QUARTER = re.compile(r"^Q([1-4])\s*(?:FY\s*'?)?(\d{4}|\d{2})(?:\s*-\s*\d{2,4})?$", re.IGNORECASE)
+_DATE_DMY = re.compile(r"^(\d{1,2})[\s./-]+([A-Za-z]{3,9}|\d{1,2})[\s.,/-]+(\d{4}|\d{2})$")
+_DATE_MDY = re.compile(r"^([A-Za-z]{3,9})\s+(\d{1,2}),?\s+(\d{4})$")
+_PERIOD_PREFIX = re.compile(r"^(?:(?:year|quarter|half[- ]year|period|nine months|six months)\s+ended\s+(?:on\s+)?|as (?:at|on)\s+)",
+                            re.IGNORECASE)
+_NUMBER = re.compile(r"^\(?-?[\d,]*\.?\d+\)?$")
+_CELL_SPLIT = re.compile(r"\s{2,}|\t")
+_PAGE_UNIT = re.compile(r"(?:₹|Rs\.?|INR)\s*(?:in\s+)?(crores?|lakhs?|lacs?|millions?|billions?|thousands?)\b",
+                        re.IGNORECASE)
+_LABEL_UNIT = re.compile(r"\((?:in\s+)?(₹|Rs\.?|INR|%)\)", re.IGNORECASE)
+_QUESTION_PERIOD = re.compile(r"\bQ[1-4]\s*(?:FY\s*'?)?\d{2,4}\b|\bFY\s*'?\d{2,4}(?:\s*-\s*\d{2,4})?\b|\b(?:19|20)\d{2}\s*-\s*\d{2}\b",
+                              re.IGNORECASE)
+_EXPLANATION = re.compile(r"\b(why|explain|trend|compare|comparison|driver|drivers|outlook|discuss|analy[sz]e)\b",
+                          re.IGNORECASE)
+_LOOKUP = re.compile(r"^\s*(what (was|were|is|are)|how much|give|state|report)\b", re.IGNORECASE)
+
+
+def _fiscal_year(year: str) -> int:
+    return int(year) if len(year) == 4 else 2000 + int(year)
+
+
+def normalize_period(cell: str) -> Optional[str]:
+    """A column heading as a period key: FY2025 (also 2024-25, FY25), Q1 FY2025, or an ISO
+    date for "31-Mar-2025" style headings; None for anything else (Particulars, Change, Note)."""
+    text = _PERIOD_PREFIX.sub("", " ".join((cell or "").split())).strip(" .:")
+    if not text:
+        return None
+    match = _QUARTER.match(text)
+    if match:
+        return f"Q{match.group(1)} FY{_fiscal_year(match.group(2))}"
+    match = _FY.match(text)
+    if match:
+        start, end = match.group(1), match.group(2)
+        if end is None:
+            return f"FY{_fiscal_year(start)}"
+        century = start[:2] if len(start) == 4 else "20"
+        return f"FY{end if len(end) == 4 else century + end}"
+    match = _YEAR_RANGE.match(text)
+    if match:
+        return f"FY{match.group(1)[:2]}{match.group(2)[-2:]}"
+    if re.fullmatch(r"(?:19|20)\d{2}", text):
+        return f"FY{text}"
+    for pattern, order in ((_DATE_DMY, (0, 1, 2)), (_DATE_MDY, (1, 0, 2))):
+        match = pattern.match(text)
+        if not match:
+            continue
+        day, month, year = (match.group(i + 1) for i in order)
+        month = int(month) if month.isdigit() else _MONTHS.get(month[:3].lower())
+        if month and 1 <= month <= 12 and 1 <= int(day) <= 31:
+            return f"{_fiscal_year(year):04d}-{month:02d}-{int(day):02d}"
+    return None
+
+
+def parse_value(cell: str) -> Optional[float]:
+    """12,345.67 -> 12345.67 and (1,234) -> -1234; dashes, blanks and percentages give None."""
+    text = (cell or "").strip().replace("₹", "").replace(" ", "")
+    if not text or text.endswith("%") or not _NUMBER.match(text):
+        return None
+    negative = text.startswith("(") and text.endswith(")")
+    value = float(text.strip("()").replace(",", ""))
+    return -value if negative else value
+
+
+def metric_for(label: str) -> str:
+    for name, pattern in METRICS:
+        if pattern.search(label):
+            return name
+    return re.sub(r"[^a-z0-9]+", "_", label.lower()).strip("_")
+
+
+def _is_value_cell(cell: str) -> bool:
+    cell = cell.strip()
+    return parse_value(cell.rstrip("%").strip()) is not None or cell in ("-", "–", "—", "Nil", "NA")
+
+
+def _is_table_candidate(text: str) -> bool:
+    return sum(1 for line in text.split("\n") if _is_table_row(line)) >= TABLE_MIN_ROWS
+
+
+def _text_rows(text: str) -> List[List[str]]:
+    # Whitespace-aligned tables come out of get_text one row per line, cells two or more spaces
+    # apart; tables extracted cell by cell put the numbers on the lines after their label
+    rows = []
+    for line in text.split("\n"):
+        cells = [cell for cell in _CELL_SPLIT.split(line.strip()) if cell]
+        if not cells:
+            continue
+        previous = rows[-1] if rows else None
+        if previous and all(_is_value_cell(cell) for cell in cells) and not _is_value_cell(previous[0]):
+            rows[-1].extend(cells)
+        elif (previous and all(normalize_period(cell) for cell in cells)
+              and all(normalize_period(cell) for cell in previous[1:])
+              and len(previous[0]) <= MAX_LABEL_CHARS and not _is_value_cell(previous[0])):
+            rows[-1].extend(cells)  # column headings, one per line
+        else:
+            rows.append(cells)
+    # Prose lines only matter as table ends, so runs of them shrink to one empty row
+    kept = []
+    for cells in rows:
+        if len(cells) == 1 and len(cells[0]) > MAX_LABEL_CHARS:
+            cells = []
+        if cells or (kept and kept[-1]):
+            kept.append(cells)
+    return kept
+
+
+def extract_page_tables(page: fitz.Page, text: str) -> List[List[List[str]]]:
+    """Tables of one page as rows of cells, for pages whose text looks tabular. Runs in the
+    extraction workers. PyMuPDF's find_tables is used where the page draws ruling lines;
+    whitespace-aligned tables (no lines to find) are read from the text."""
+    if not _is_table_candidate(text):
+        return []
+    tables = []
+    if page.get_drawings():
+        try:
+            for table in page.find_tables(strategy="lines").tables:
+                rows = [[" ".join((cell or "").split()) for cell in row] for row in table.extract()]
+                if len(rows) > 1:
+                    tables.append(rows)
+        except Exception as e:
+            print(f"Table detection failed on page {page.number + 1}: {e}")
+    return tables or [_text_rows(text)]
+
+
+def facts_from_tables(tables: List[List[List[str]]], page_number: int, page_text: str = "") -> List[Dict]:
+    """Line items of a page's tables: each row under a heading row of periods gives one fact
+    per period column (matched from the right, so a missing label heading does not shift them)."""
+    page_unit = _PAGE_UNIT.search(page_text)
+    page_unit = f"Rs {page_unit.group(1).lower().rstrip('s')}" if page_unit else ""
+    facts = []
+    for rows in tables:
+        periods = None
+        for cells in rows:
+            if not cells:
+                periods = None
+                continue
+            cells = [cell for cell in cells if cell]
+            if not cells:
+                continue
+            heading = [normalize_period(cell) for cell in cells]
+            if sum(1 for period in heading if period) >= 1 and all(parse_value(cell) is None for cell in cells):
+                periods = heading[1:] if heading[0] is None else heading
+                continue
+            label = cells[0]
+            if periods is None or parse_value(label) is not None or len(cells) < 2:
+                continue
+            label_unit = _LABEL_UNIT.search(label)
+            unit = label_unit.group(1).replace(".", "") if label_unit else page_unit
+            for period, cell in zip(reversed(periods), reversed(cells[1:])):
+                value = parse_value(cell)
+                if period and value is not None:
+                    facts.append({"page": page_number, "period": period, "metric": metric_for(label),
+                                  "label": label.strip(" :"), "value": value, "unit": unit})
+    return facts
+
+
+class FactTable:
+    """Columnar fact store: one row per (document, period, metric) with the page it came from.
+    Kept as numpy columns so a lookup over every document of a workspace is a few masks."""
+
+    COLUMNS = ("document", "page", "period", "metric", "label", "value", "unit")
+
+    def __init__(self, document: np.ndarray, page: np.ndarray, period: np.ndarray, metric: np.ndarray,
+                 label: np.ndarray, value: np.ndarray, unit: np.ndarray):
+        self.document = document
+        self.page = page
+        self.period = period
+        self.metric = metric
+        self.label = label
+        self.value = value
+        self.unit = unit
+
+    @classmethod
+    def from_facts(cls, sha: str, facts: List[Dict]) -> "FactTable":
+        # A figure repeated on later pages (highlights, summaries) is kept once, at its first page;
+        # different values for the same line item (standalone and consolidated) are all kept
+        seen, rows = set(), []
+        for fact in facts:
+            key = (fact["period"], fact["metric"], fact["value"])
+            if key not in seen:
+                seen.add(key)
+                rows.append(fact)
+        return cls(
+            np.array([sha] * len(rows), dtype=str),
+            np.array([fact["page"] for fact in rows], dtype=np.int32),
+            np.array([fact["period"] for fact in rows], dtype=str),
+            np.array([fact["metric"] for fact in rows], dtype=str),
+            np.array([fact["label"] for fact in rows], dtype=str),
+            np.array([fact["value"] for fact in rows], dtype=np.float64),
+            np.array([fact["unit"] for fact in rows], dtype=str),
+        )
+
+    @classmethod
+    def from_pages(cls, sha: str, pages: List[Dict]) -> "FactTable":
+        facts = []
+        for page in pages:
+            if page.get("tables"):
+                facts.extend(facts_from_tables(page["tables"], page["page_number"], page["text"]))
+        return cls.from_facts(sha, facts)
+
+    @classmethod
+    def empty(cls) -> "FactTable":
+        return cls.from_facts("", [])
+
+    @classmethod
+    def concat(cls, tables: List["FactTable"]) -> "FactTable":
+        if len(tables) == 1:
+            return tables[0]
+        if not tables:
+            return cls.empty()
+        return cls(*[np.concatenate([getattr(table, column) for table in tables]) for column in cls.COLUMNS])
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, **{column: getattr(self, column) for column in self.COLUMNS})
+
+    @classmethod
+    def load(cls, path: str) -> "FactTable":
+        with np.load(path) as data:
+            return cls(*[data[column] for column in cls.COLUMNS])
+
+    def lookup(self, metrics: Optional[List[str]] = None, periods: Optional[List[str]] = None,
+               documents: Optional[List[str]] = None) -> np.ndarray:
+        """Row indices matching every given filter, ordered by document, metric and page, newest
+        period first within a table row."""
+        mask = np.ones(len(self), dtype=bool)
+        if metrics:
+            mask &= np.isin(self.metric, metrics)
+        if periods:
+            mask &= np.isin(self.period, periods)
+        if documents:
+            mask &= np.isin(self.document, documents)
+        rows = np.flatnonzero(mask).tolist()
+        # Documents keep their workspace order
+        first_row = {}
+        for i in rows:
+            first_row.setdefault(self.document[i], i)
+        rows.sort(key=lambda i: _period_sort_key(str(self.period[i])), reverse=True)
+        rows.sort(key=lambda i: (first_row[self.document[i]], self.metric[i], self.page[i]))
+        return np.array(rows, dtype=np.int64)
+
+    def to_markdown(self, rows: np.ndarray, sources: Dict[str, str], max_rows: int = FACT_PROMPT_MAX_ROWS,
+                    max_periods: int = FACT_PROMPT_MAX_PERIODS) -> str:
+        """A compact line item x period table of the given rows (one line per table row), labelled
+        like the context blocks."""
+        if not len(rows):
+            return ""
+        periods = sorted(set(self.period[rows].tolist()), key=_period_sort_key, reverse=True)[:max_periods]
+        items: Dict[tuple, Dict] = {}
+        for i in rows:
+            if self.period[i] not in periods:
+                continue
+            key = (str(self.document[i]), int(self.page[i]), str(self.metric[i]), str(self.label[i]))
+            item = items.setdefault(key, {"unit": str(self.unit[i]), "values": {}})
+            item["values"].setdefault(str(self.period[i]), float(self.value[i]))
+        lines = ["| Source | Line item | " + " | ".join(periods) + " |", "|" + "---|" * (len(periods) + 2)]
+        for (document, page, _, label), item in list(items.items())[:max_rows]:
+            if item["unit"] and item["unit"] not in label:
+                label = f"{label} ({item['unit']})"
+            cells = [format_value(item["values"][period]) if period in item["values"] else "" for period in periods]
+            lines.append(f"| {sources.get(document, document[:12])}, p.{page} | {label} | " + " | ".join(cells) + " |")
+        return "\n".join(lines)
+
+
+def _period_sort_key(period: str) -> str:
+    # FY2025 -> 2025-99, Q1 FY2025 -> 2025-1 (a fiscal year's quarters come before its total), dates as is
+    match = re.match(r"^(?:Q([1-4]) )?FY(\d{4})$", period)
+    if match:
+        return f"{match.group(2)}-{match.group(1) or '99'}"
+    return period
+
+
+def format_value(value: float) -> str:
+    return f"{value:,.2f}".rstrip("0").rstrip(".") if value % 1 else f"{value:,.0f}"
+
+
+def question_metrics(question: str) -> List[str]:
+    return [name for name, pattern in METRICS if pattern.search(question)]
+
+
+def question_periods(question: str) -> List[str]:
+    periods = []
+    for match in _QUESTION_PERIOD.finditer(question):
+        period = normalize_period(match.group(0))
+        if period and period not in periods:
+            periods.append(period)
+    return periods
+
+
+def facts_for_question(facts: FactTable, question: str, sources: Dict[str, str]) -> str:
+    """The figures table for a prompt: the line items the question names (all periods unless it
+    names some), or nothing when it names none."""
+    metrics = question_metrics(question)
+    if not metrics or not len(facts):
+        return ""
+    rows = facts.lookup(metrics, question_periods(question) or None)
+    return facts.to_markdown(rows, sources)
+
+
+def answer_from_facts(facts: FactTable, question: str, sources: Dict[str, str]) -> Optional[str]:
+    """A local answer for a plain lookup ("What was net profit in FY2025?"): one line item and
+    the period(s) it names, with a single value per document. Anything that asks for an
+    explanation, or that the fact store cannot answer unambiguously, goes to the LLM."""
+    if (len(question.split()) > DIRECT_ANSWER_MAX_WORDS or not _LOOKUP.search(question)
+            or _EXPLANATION.search(question)):
+        return None
+    metrics, periods = question_metrics(question), question_periods(question)
+    if len(metrics) != 1 or not periods or not len(facts):
+        return None
+    rows = facts.lookup(metrics, periods)
+    if len({str(period) for period in facts.period[rows]}) < len(periods):
+        return None
+    found = [(str(facts.document[i]), str(facts.period[i])) for i in rows]
+    if len(set(found)) < len(found):
+        return None  # several tables disagree, e.g. standalone and consolidated
+    lines = []
+    for i in rows:
+        unit = f" {facts.unit[i]}" if facts.unit[i] else ""
+        source = sources.get(str(facts.document[i]), str(facts.document[i])[:12])
+        lines.append(f"{facts.label[i]} for {facts.period[i]}: {format_value(float(facts.value[i]))}{unit} "
+                     f"({source}, p.{facts.page[i]})")
+    return "\n".join(lines)
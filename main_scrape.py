@@ -1,22 +1,24 @@
+import asyncio
 import os
-import subprocess
-import tempfile
 import numpy as np
-import fitz  # PyMuPDF
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from openai import OpenAI
 from prompts import prompts
+from embeddings import embed_texts
+from retrieval import VectorIndex, BM25Index, hybrid_scores, top_k_indices
+from pdf_text import iter_pdf_pages
+from chunker import iter_token_chunks
+from workspaces import create_workspace, workspace_exists, set_documents, get_documents, store_pdf_stream
 import uvicorn
 from fastapi import Query
 from typing import List
-
-from fastapi import FastAPI, Query
-import subprocess
-import json
+from contextlib import asynccontextmanager
+from scraper_client import scrape_tickers, close_scraper_http
+from metrics import stage, inc, render as render_metrics, http_middleware
 
 
 
@@ -25,7 +27,13 @@ load_dotenv()
 openai_key = os.getenv("OPENAI_KEY")
 
 # --- Initialize FastAPI app ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_scraper_http()
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(http_middleware)
 
 # --- Set up directories ---
 os.makedirs("static", exist_ok=True)
@@ -41,49 +49,49 @@ client = OpenAI(api_key=openai_key)
 # --- Config ---
 EMBEDDING_MODEL = "text-embedding-3-small"
 COMPLETION_MODEL = "gpt-4o-mini"
-CHUNK_SIZE = 250
-CHUNK_OVERLAP = 50
+CHUNK_SIZE = 320  # tokens, about the 250 words chunks used to be
+CHUNK_OVERLAP = 64
 
-# --- Global PDF path tracker ---
-current_pdf_path = None
-
-# --- PDF Text Extraction ---
-def extract_pdf_text(pdf_path: str) -> str:
+# --- PDF Extraction + Chunking ---
+def chunk_pdf(pdf_path: str, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    # Pages stream into the token chunker, so the whole text is never held at once.
+    # Each chunk is prefixed with its pages so answers can cite them.
+    chunks = []
     try:
-        doc = fitz.open(pdf_path)
-        full_text = "\n\n".join([page.get_text() for page in doc])
-        doc.close()
-        if full_text.strip():
-            return full_text
-        raise ValueError("No text found in PDF.")
+        with stage("extract"):
+            for chunk in iter_token_chunks(iter_pdf_pages(pdf_path), chunk_size, overlap):
+                pages = f"p.{chunk['page_start']}"
+                if chunk["page_end"] != chunk["page_start"]:
+                    pages += f"-{chunk['page_end']}"
+                chunks.append(f"[{pages}] {chunk['text']}")
+        inc("bytes_total", os.path.getsize(pdf_path), kind="pdf_extracted")
+        if not chunks:
+            raise ValueError("No text found in PDF.")
     except Exception as e:
         print(f"Error extracting PDF text: {e}")
-        return ""
-
-# --- Chunking Text ---
-def chunk_text(text: str, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
     return chunks
 
 # --- Generate Embeddings ---
-def get_embeddings(texts):
-    response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
-    return [np.array(e.embedding) for e in response.data]
+def get_embeddings(texts) -> np.ndarray:
+    with stage("embed"):
+        result = embed_texts(texts, client, model=EMBEDDING_MODEL)
+    for idx, error in sorted(result["errors"].items()):
+        print(f"Embedding error for chunk {idx + 1}: {error}")
+    return result["embeddings"]
 
 # --- Rank Chunks ---
 def rank_chunks_by_question(chunks, question, top_n=5):
+    # BM25 catches exact terms the embeddings miss; both scores are mixed
+    if not chunks:
+        return []
+    with stage("lexical"):
+        lexical_scores = BM25Index.from_texts(chunks).scores(question)
     question_embedding = get_embeddings([question])[0]
     chunk_embeddings = get_embeddings(chunks)
-    similarities = [
-        np.dot(chunk_emb, question_embedding) / 
-        (np.linalg.norm(chunk_emb) * np.linalg.norm(question_embedding))
-        for chunk_emb in chunk_embeddings
-    ]
-    top_indices = np.argsort(similarities)[::-1][:top_n]
+    with stage("similarity"):
+        # Chunks that failed to embed come back as NaN rows and score 0
+        vector_scores = VectorIndex(chunk_embeddings).scores(question_embedding[None, :])[0]
+        top_indices = top_k_indices(hybrid_scores(vector_scores, lexical_scores), top_n)
     return [chunks[i] for i in top_indices]
 
 # --- Clean LaTeX (optional post-processing) ---
@@ -108,20 +116,21 @@ Context:
 
 Question: {question}
 Answer:"""
-    response = client.chat.completions.create(
-        model=COMPLETION_MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2
-    )
+    with stage("completion"):
+        response = client.chat.completions.create(
+            model=COMPLETION_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2
+        )
+    if response.usage is not None:
+        inc("openai_tokens_total", response.usage.prompt_tokens, model=COMPLETION_MODEL, kind="prompt")
+        inc("openai_tokens_total", response.usage.completion_tokens, model=COMPLETION_MODEL, kind="completion")
     return clean_latex(response.choices[0].message.content.strip())
 
 # --- Analyze Document Pipeline ---
 def analyze_document(pdf_path: str, question: str):
-    steps = ["📄 Extracting text from PDF..."]
-    text = extract_pdf_text(pdf_path)
-    
-    steps.append("✂️ Chunking text...")
-    chunks = chunk_text(text)
+    steps = ["📄 Extracting and chunking text from PDF..."]
+    chunks = chunk_pdf(pdf_path)
 
     steps.append("🧠 Retrieving relevant chunks with embeddings...")
     top_chunks = rank_chunks_by_question(chunks, question, top_n=4)
@@ -140,41 +149,47 @@ def analyze_document(pdf_path: str, question: str):
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "prompts": prompts})
 
+# --- Workspace lookup ---
+def workspace_pdf_path(workspace_id):
+    documents = get_documents(workspace_id) if workspace_id else None
+    return documents[0]["path"] if documents else None
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    global current_pdf_path
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    with open(temp_file.name, "wb") as f:
-        f.write(await file.read())
-    current_pdf_path = temp_file.name
-    return {"filename": file.filename, "status": "File uploaded successfully"}
+async def upload_file(file: UploadFile = File(...), workspace_id: str = Form(None)):
+    if workspace_id and not workspace_exists(workspace_id):
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired workspace"})
+    # Copied to the store a block at a time rather than read into memory whole
+    sha, path = await asyncio.to_thread(store_pdf_stream, file.file)
+    await file.close()
+    inc("bytes_total", os.path.getsize(path), kind="upload")
+    workspace_id = workspace_id or create_workspace()
+    set_documents(workspace_id, [{"filename": file.filename, "sha256": sha}])
+    return {"filename": file.filename, "status": "File uploaded successfully", "workspace_id": workspace_id}
 
 @app.post("/analyze")
-async def analyze(prompt_key: str = Form(...), custom_query: str = Form(None)):
-    global current_pdf_path
-    if not current_pdf_path:
+async def analyze(prompt_key: str = Form(...), custom_query: str = Form(None), workspace_id: str = Form(None)):
+    pdf_path = workspace_pdf_path(workspace_id)
+    if not pdf_path:
         return {"error": "No document uploaded yet"}
 
     question = custom_query.strip() if custom_query else prompts.get(prompt_key)
     if not question:
         return {"error": "Invalid or missing query"}
 
-    text = extract_pdf_text(current_pdf_path)
-    chunks = chunk_text(text)
+    chunks = chunk_pdf(pdf_path)
     top_chunks = rank_chunks_by_question(chunks, question, top_n=4)
     answer = ask_openai(question, "\n\n".join(top_chunks))
     return {"answer": answer}
 
 @app.post("/analyze_custom")
-async def analyze_custom(custom_query: str = Form(...)):
-    global current_pdf_path
-    if not current_pdf_path:
+async def analyze_custom(custom_query: str = Form(...), workspace_id: str = Form(None)):
+    pdf_path = workspace_pdf_path(workspace_id)
+    if not pdf_path:
         return {"error": "No document uploaded yet"}
     if not custom_query.strip():
         return {"error": "Custom query cannot be empty"}
 
-    text = extract_pdf_text(current_pdf_path)
-    chunks = chunk_text(text)
+    chunks = chunk_pdf(pdf_path)
     top_chunks = rank_chunks_by_question(chunks, custom_query, top_n=4)
     answer = ask_openai(custom_query, "\n\n".join(top_chunks))
     return {"answer": answer}
@@ -187,21 +202,22 @@ async def scrape_nse(tickers: str = Query(..., description="Comma separated tick
     if not ticker_list:
         return JSONResponse(status_code=400, content={"error": "No valid tickers provided"})
 
-    # Run Node.js scraper script with tickers as args
+    # The long-lived scraper service keeps the browser and NSE session warm between requests
     try:
-        result = subprocess.run(
-            ["node", "scrape_nse.js", *ticker_list],
-            capture_output=True,
-            text=True,
-            check=True,
-            # cwd="path/to/your/js/script"  # Adjust this to your JS script folder
-        )
-        data = json.loads(result.stdout)
-        return data
-    except subprocess.CalledProcessError as e:
-        return JSONResponse(status_code=500, content={"error": f"Scraper failed: {e.stderr}"})
-    except json.JSONDecodeError:
-        return JSONResponse(status_code=500, content={"error": "Failed to parse scraper output"})
+        with stage("scrape"):
+            data = await scrape_tickers(ticker_list)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Scraper failed: {e}"})
+    inc("items_total", len(data["results"]), kind="tickers_scraped")
+    inc("items_total", len(data["failed"]), kind="tickers_failed")
+    for failure in data["failed"]:
+        print(f"Scrape failed for {failure['ticker']} after {failure['attempts']} attempts: {failure['error']}")
+    return data["results"]
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 # # --- Run App ---
@@ -1,19 +1,35 @@
+import asyncio
+import json
 import os
 import tempfile
-from typing import List, Dict
-import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
 import numpy as np
-import fitz  # PyMuPDF
 import markdown
-import requests
+import httpx
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, UploadFile, Request, Form, Query
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from openai import OpenAI
+from openai import AsyncOpenAI
 from prompts import prompts
 from docx import Document
+from embeddings import embed_texts_async, EMBEDDING_MODEL
+from doc_index import build_document_index_async, has_index
+from workspaces import create_workspace, workspace_exists, set_documents, get_documents, store_pdf_stream, cleanup_expired
+from retrieval import VectorIndex, BM25Index, hybrid_scores, top_k_indices
+from corpus_index import get_corpus_index
+from context_packer import pack_context, CONTEXT_TOKEN_BUDGET
+from chunker import count_tokens
+from fact_store import FactTable, facts_for_question, answer_from_facts
+from peer_analytics import FinancialsSnapshot, METRICS as PEER_METRICS
+from metrics import stage, inc, cache_result, request_timings, render as render_metrics, http_middleware
+from answer_cache import (answer_key, get_answer, put_answer, get_query_embedding, put_query_embedding,
+                          cache_stats, cleanup_expired as cleanup_expired_answers)
 
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -27,229 +43,802 @@ headers = {
 }
 
 openai_key = os.getenv("OPENAI_KEY")
-app = FastAPI()
+supabase_http: Optional[httpx.AsyncClient] = None
+
+# Per-ticker financials rows, shared by all requests in this worker
+LOAD_VERSION_TABLE = "load_versions"
+FINANCIALS_CACHE_MAX_TICKERS = int(os.getenv("FINANCIALS_CACHE_MAX_TICKERS", "5000"))
+FINANCIALS_VERSION_CHECK_SECONDS = float(os.getenv("FINANCIALS_VERSION_CHECK_SECONDS", "30"))
+financials_cache: "OrderedDict[str, List[Dict]]" = OrderedDict()
+financials_version = None
+financials_version_checked = float("-inf")
+financials_generation = 0
+
+# The whole table as a columnar snapshot for peer analytics, rebuilt when the load stamp changes
+PEER_SNAPSHOT_PAGE_SIZE = int(os.getenv("PEER_SNAPSHOT_PAGE_SIZE", "1000"))
+financials_snapshot: Optional[FinancialsSnapshot] = None
+financials_snapshot_generation = -1
+financials_snapshot_lock: Optional[asyncio.Lock] = None
+financials_snapshot_task: Optional[asyncio.Task] = None
+
+# Uploaded PDFs are indexed by background tasks of the worker that received them; readiness
+# itself is read from the shared index directory, so any worker can answer for it
+INDEX_MAX_CONCURRENCY = int(os.getenv("INDEX_MAX_CONCURRENCY", "2"))
+INDEX_RETRY_SECONDS = float(os.getenv("INDEX_RETRY_SECONDS", "30"))
+index_jobs: Dict[str, Dict] = {}
+index_tasks: set = set()
+index_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_supabase_http() -> httpx.AsyncClient:
+    # One pooled client per process so Supabase lookups reuse keep-alive connections
+    global supabase_http
+    if supabase_http is None:
+        supabase_http = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(15.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return supabase_http
+
+async def cleanup_periodically():
+    # Each worker runs this; cleanup is idempotent so overlapping runs are harmless
+    while True:
+        try:
+            removed = await asyncio.to_thread(cleanup_expired)
+            if removed["workspaces"] or removed["files"]:
+                print(f"Cleaned up {removed['workspaces']} idle workspaces and {removed['files']} PDFs")
+        except Exception as e:
+            print(f"Workspace cleanup error: {e}")
+        try:
+            await asyncio.to_thread(cleanup_expired_answers)
+        except Exception as e:
+            print(f"Answer cache cleanup error: {e}")
+        await asyncio.sleep(WORKSPACE_CLEANUP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cleanup_task = asyncio.create_task(cleanup_periodically())
+    yield
+    cleanup_task.cancel()
+    for task in list(index_tasks):
+        task.cancel()
+    if financials_snapshot_task is not None:
+        financials_snapshot_task.cancel()
+    if supabase_http is not None:
+        await supabase_http.aclose()
+    await client.close()
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(http_middleware)
 os.makedirs("static", exist_ok=True)
 os.makedirs("templates", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
-client = OpenAI(api_key=openai_key)
+client = AsyncOpenAI(api_key=openai_key, base_url=os.getenv("OPENAI_BASE_URL"))
 
 COMPLETION_MODEL = "gpt-4o-mini"
-TOP_K_CHUNKS = 10  # Number of top chunks to use
-uploaded_pdf_paths: List[str] = []
+ANSWER_TEMPERATURE = 0.1
+ANSWER_MAX_TOKENS = 300
+PROMPT_VERSION = 3  # bump when build_prompt changes so cached answers are not reused
+# With a figures table from the fact store the chunks only need to carry the narrative, so the
+# whole context (table included) gets this smaller budget
+FIGURES_CONTEXT_TOKEN_BUDGET = int(os.getenv("FIGURES_CONTEXT_TOKEN_BUDGET", "1200"))
+TOP_K_CHUNKS = 20  # candidates per question; pack_context keeps what fits CONTEXT_TOKEN_BUDGET
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # hybrid, vector, or lexical (BM25 only, no embedding call)
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "0.5"))
+REPORT_SECTIONS = ["Business", "Financials"]  # default /generate_report sections; any key in prompts is allowed
+REPORT_MAX_CONCURRENCY = int(os.getenv("REPORT_MAX_CONCURRENCY", "4"))
+WORKSPACE_CLEANUP_INTERVAL = int(os.getenv("WORKSPACE_CLEANUP_INTERVAL", "600"))
+
+async def workspace_pdf_paths(workspace_id: Optional[str]):
+    # Returns (paths, None) for a live workspace with documents, else (None, error response)
+    if not workspace_id:
+        return None, JSONResponse(status_code=400, content={"error": "No documents uploaded yet"})
+    documents = await asyncio.to_thread(get_documents, workspace_id)
+    if documents is None:
+        return None, JSONResponse(status_code=404, content={"error": "Unknown or expired workspace, please upload again"})
+    if not documents:
+        return None, JSONResponse(status_code=400, content={"error": "No documents uploaded yet"})
+    return [doc["path"] for doc in documents], None
 
 def markdown_to_html(md_text: str) -> str:
     return markdown.markdown(md_text, extensions=["tables"])
 
-def extract_pdf_text(pdf_path: str) -> List[Dict]:
-    try:
-        doc = fitz.open(pdf_path)
-        pages_text = []
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text = page.get_text()
-            pages_text.append({"page_number": page_num + 1, "text": text.strip()})
-        doc.close()
-        return pages_text
-    except Exception as e:
-        print(f"Error extracting PDF text from {pdf_path}: {e}")
-        return []
-
-def clean_text(text: str) -> str:
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'[^\w\s\.,;:!?()-]', ' ', text)
-    return text.strip()
-
-def chunk_text(text: str, max_chunk_size: int = 1000, overlap: int = 100) -> List[str]:
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + max_chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk.strip())
-        start += max_chunk_size - overlap
-    return chunks
-
-def get_embedding(text: str) -> np.ndarray:
-    try:
-        response = client.embeddings.create(input=[text], model="text-embedding-3-small")
-        return np.array(response.data[0].embedding, dtype=np.float32)
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return np.zeros(1536)
-
-def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-    return dot_product / (norm1 * norm2)
+async def get_embedding(text: str) -> np.ndarray:
+    result = await embed_texts_async([text], client, model=EMBEDDING_MODEL)
+    if not result["ok"][0]:
+        raise ValueError(result["errors"][0])
+    return result["embeddings"][0]
 
 def clean_latex(text: str) -> str:
     return text.replace("\\[", "").replace("\\]", "").replace("\\(", "").replace("\\)", "").replace("$$", "").replace("\\text{", "").replace("}", "").strip()
 
-def analyze_documents_enhanced(pdf_paths: List[str], question: str, file_names: List[str] = None):
-    steps = ["📄 Extracting and chunking text from all PDFs..."]
+async def load_retrieval_context(pdf_paths: List[str]) -> Dict:
+    # One shared index over every uploaded document; built once and reused by all questions
     all_chunks = []
-    
-    for i, path in enumerate(pdf_paths):
-        pages = extract_pdf_text(path)
-        full_text = " ".join([page["text"] for page in pages])
-        cleaned_text = clean_text(full_text)
-        text_chunks = chunk_text(cleaned_text)
-
-        for idx, chunk in enumerate(text_chunks):
-            embedding = get_embedding(chunk)
+    matrices = []
+    indexes = await asyncio.gather(*[build_document_index_async(path, client) for path in pdf_paths])
+    for i, index in enumerate(indexes):
+        matrices.append(index["embeddings"])
+        for chunk in index["chunks"]:
             all_chunks.append({
-                "text": chunk,
-                "chunk_number": idx + 1,
+                "text": chunk["text"],
+                "document_sha256": index["sha256"],
+                "chunk_number": chunk["chunk_number"],
+                "page_start": chunk["page_start"],
+                "page_end": chunk["page_end"],
+                "token_count": chunk["token_count"],
                 "source": f"Document_{i+1}",
-                "embedding": embedding
             })
+    with stage("index_merge"):
+        vector_index = await asyncio.to_thread(VectorIndex.concat, matrices, True)
+        lexical_index = await asyncio.to_thread(BM25Index.concat, [index["lexical"] for index in indexes])
+        facts = FactTable.concat([index["facts"] for index in indexes])
+    return {
+        "chunks": all_chunks,
+        "vector_index": vector_index,
+        "lexical_index": lexical_index,
+        "facts": facts,
+        "sources": {index["sha256"]: f"Document_{i+1}" for i, index in enumerate(indexes)},
+        "documents": [index["sha256"] for index in indexes],
+    }
 
-    steps.append("🧠 Calculating similarity scores...")
+def figures_for_question(context: Dict, question: str) -> str:
+    # Line items from the documents' tables that the question names, as one compact table
+    with stage("facts"):
+        return facts_for_question(context["facts"], question, context["sources"])
+
+def answer_from_figures(context: Dict, question: str) -> Optional[str]:
+    # Plain "what was X in FY2025" questions are answered from the fact store, with no LLM call
+    with stage("facts"):
+        answer = answer_from_facts(context["facts"], question, context["sources"])
+    if answer is not None:
+        inc("items_total", kind="answers_from_facts")
+        answer = answer.replace("\n", "<br>")
+    return answer
+
+def _cached_query_embeddings(questions: List[str]) -> List[Optional[np.ndarray]]:
     try:
-        query_embedding = get_embedding(question)
-        for chunk in all_chunks:
-            chunk["similarity_score"] = float(cosine_similarity(query_embedding, chunk["embedding"]))
-        relevant_chunks = sorted(all_chunks, key=lambda x: x["similarity_score"], reverse=True)[:TOP_K_CHUNKS]
+        return [get_query_embedding(EMBEDDING_MODEL, question) for question in questions]
     except Exception as e:
-        print(f"Similarity error: {e}")
-        relevant_chunks = all_chunks[:TOP_K_CHUNKS]
+        print(f"Query embedding cache error: {e}")
+        return [None] * len(questions)
 
-    merged_text = "\n\n".join([chunk["text"] for chunk in relevant_chunks])
+def _store_query_embeddings(questions: List[str], embeddings: np.ndarray):
+    try:
+        for question, embedding in zip(questions, embeddings):
+            put_query_embedding(EMBEDDING_MODEL, question, embedding)
+    except Exception as e:
+        print(f"Query embedding cache error: {e}")
 
-    prompt = f"""You are an expert assistant helping answer questions from financial documents. Use only the information provided below to answer the question.
+async def embed_questions(questions: List[str]) -> np.ndarray:
+    # Only questions never seen before go to the embeddings API
+    cached = await asyncio.to_thread(_cached_query_embeddings, questions)
+    missing = [question for question, embedding in zip(questions, cached) if embedding is None]
+    for embedding in cached:
+        cache_result("query_embedding", embedding is not None)
+    if missing:
+        with stage("embed_query"):
+            embedded = await embed_texts_async(missing, client, model=EMBEDDING_MODEL)
+        if embedded["errors"]:
+            raise ValueError(next(iter(embedded["errors"].values())))
+        await asyncio.to_thread(_store_query_embeddings, missing, embedded["embeddings"])
+        fresh = iter(embedded["embeddings"])
+        cached = [embedding if embedding is not None else next(fresh) for embedding in cached]
+    return np.stack(cached)
+
+async def retrieve_chunks(context: Dict, questions: List[str], top_k: int = TOP_K_CHUNKS,
+                          mode: str = RETRIEVAL_MODE) -> List[List[Dict]]:
+    # Cosine ranking finds paraphrases, BM25 finds exact terms (EBITDA, segment names); hybrid fuses both
+    all_chunks = context["chunks"]
+    if not all_chunks:
+        return [[] for _ in questions]  # e.g. only scanned pages and no OCR engine
+    vector_scores = lexical_scores = None
+    if mode in ("vector", "hybrid"):
+        try:
+            query_embeddings = await embed_questions(questions)
+            with stage("similarity"):
+                vector_scores = context["vector_index"].scores(query_embeddings)
+        except Exception as e:
+            print(f"Similarity error: {e}, falling back to lexical retrieval")
+    if mode in ("lexical", "hybrid") or vector_scores is None:
+        lexical_index = context["lexical_index"]
+        with stage("lexical"):
+            lexical_scores = await asyncio.to_thread(lambda: np.stack([lexical_index.scores(q) for q in questions]))
 
+    with stage("similarity"):
+        if vector_scores is not None and lexical_scores is not None:
+            scores = hybrid_scores(vector_scores, lexical_scores, HYBRID_VECTOR_WEIGHT)
+        else:
+            scores = vector_scores if vector_scores is not None else lexical_scores
+        top_indices = top_k_indices(scores, top_k)
+
+    results = []
+    for row_scores, row_indices in zip(scores, top_indices):
+        if vector_scores is None and not row_scores.any():
+            results.append(all_chunks[:top_k])  # no embedding and no shared term: nothing to rank by
+            continue
+        results.append([{**all_chunks[idx], "similarity_score": float(row_scores[idx])} for idx in row_indices])
+    return results
+
+def build_prompt(question: str, context_text: str, figures: str = "") -> str:
+    # context_text comes from pack_context: deduplicated blocks labelled with document and pages;
+    # figures is the fact store's table of the line items the question names
+    if figures:
+        figures = f"""
+Figures from the documents' financial tables:
+{figures}
+"""
+    return f"""You are an expert assistant helping answer questions from financial documents. Use only the information provided below to answer the question.
+{figures}
 Context:
-{merged_text}
+{context_text}
 
 Question:
 {question}
 
-Answer concisely, citing key facts, figures, and chunk numbers if possible."""
+Answer concisely, citing key facts, figures, and page numbers (e.g. p.12) if possible."""
 
-    response = client.chat.completions.create(
-        model=COMPLETION_MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.1,
-        max_tokens=300,
-    )
-
-    final_answer = clean_latex(response.choices[0].message.content.strip())
+def finalize_answer(raw_answer: str) -> str:
+    final_answer = clean_latex(raw_answer.strip())
 
     if "|" in final_answer and "-" in final_answer:
         final_answer = markdown_to_html(final_answer)
+    return final_answer
+
+def answer_cache_key(question: str, packed: Dict, document_shas: List[str], figures: str = "") -> str:
+    return answer_key(COMPLETION_MODEL, question, document_shas, packed["chunk_ids"], temperature=ANSWER_TEMPERATURE,
+                      max_tokens=ANSWER_MAX_TOKENS, prompt_version=PROMPT_VERSION, context_budget=CONTEXT_TOKEN_BUDGET,
+                      figures=figures, figures_budget=FIGURES_CONTEXT_TOKEN_BUDGET if figures else None)
+
+async def lookup_answer(key: str) -> Optional[str]:
+    try:
+        answer = await asyncio.to_thread(get_answer, key)
+    except Exception as e:
+        print(f"Answer cache error: {e}")
+        answer = None
+    cache_result("answer", answer is not None)
+    return answer
+
+async def store_answer(key: str, answer: str):
+    try:
+        await asyncio.to_thread(put_answer, key, answer)
+    except Exception as e:
+        print(f"Answer cache error: {e}")
+
+def record_usage(usage):
+    if usage is not None:
+        inc("openai_tokens_total", usage.prompt_tokens, model=COMPLETION_MODEL, kind="prompt")
+        inc("openai_tokens_total", usage.completion_tokens, model=COMPLETION_MODEL, kind="completion")
+
+def pack_for_prompt(relevant_chunks: List[Dict], figures: str = "") -> Dict:
+    # The figures table stands in for chunks that would only repeat its numbers
+    with stage("pack"):
+        figures_tokens = count_tokens(figures) if figures else 0
+        budget = min(CONTEXT_TOKEN_BUDGET, FIGURES_CONTEXT_TOKEN_BUDGET) if figures else CONTEXT_TOKEN_BUDGET
+        packed = pack_context(relevant_chunks, budget=max(0, budget - figures_tokens))
+    packed["figures_tokens"] = figures_tokens
+    inc("context_tokens_total", packed["tokens"] + figures_tokens)
+    return packed
+
+async def answer_question(question: str, relevant_chunks: List[Dict], document_shas: List[str],
+                          figures: str = "") -> Dict:
+    # Same documents, question and packed chunks give the same prompt, so the completion is reused
+    packed = pack_for_prompt(relevant_chunks, figures)
+    usage = {"chunks_used": len(packed["chunks"]), "context_tokens": packed["tokens"] + packed["figures_tokens"]}
+    key = answer_cache_key(question, packed, document_shas, figures)
+    cached = await lookup_answer(key)
+    if cached is not None:
+        return {"answer": cached, "cached": True, **usage}
+
+    with stage("completion"):
+        response = await client.chat.completions.create(
+            model=COMPLETION_MODEL,
+            messages=[{"role": "user", "content": build_prompt(question, packed["text"], figures)}],
+            temperature=ANSWER_TEMPERATURE,
+            max_tokens=ANSWER_MAX_TOKENS,
+        )
+    record_usage(response.usage)
+    answer = finalize_answer(response.choices[0].message.content)
+    await store_answer(key, answer)
+    return {"answer": answer, "cached": False, **usage}
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_analysis(pdf_paths: List[str], question: str, include_timings: bool = False):
+    # Same pipeline as analyze_documents_enhanced, emitted as server-sent events as each stage happens
+    try:
+        yield sse_event("step", {"step": "📄 Loading document indexes (extracting and embedding any new PDFs)..."})
+        context = await load_retrieval_context(pdf_paths)
+
+        answer = answer_from_figures(context, question)
+        if answer is not None:
+            done = {"answer": answer, "cached": False, "chunks_used": 0, "context_tokens": 0,
+                    "total_chunks": len(context["chunks"])}
+            if include_timings:
+                done["timings"] = request_timings()
+            yield sse_event("done", done)
+            return
+
+        yield sse_event("step", {"step": "🧠 Calculating similarity scores..."})
+        relevant_chunks = (await retrieve_chunks(context, [question]))[0]
+        figures = figures_for_question(context, question)
+        packed = pack_for_prompt(relevant_chunks, figures)
+
+        key = answer_cache_key(question, packed, context["documents"], figures)
+        answer = await lookup_answer(key)
+        cached = answer is not None
+        if not cached:
+            yield sse_event("step", {"step": "🤖 Writing the answer..."})
+            with stage("completion"):
+                stream = await client.chat.completions.create(
+                    model=COMPLETION_MODEL,
+                    messages=[{"role": "user", "content": build_prompt(question, packed["text"], figures)}],
+                    temperature=ANSWER_TEMPERATURE,
+                    max_tokens=ANSWER_MAX_TOKENS,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                parts = []
+                async for chunk in stream:
+                    record_usage(getattr(chunk, "usage", None))
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        parts.append(token)
+                        yield sse_event("token", {"token": token})
+            answer = finalize_answer("".join(parts))
+            await store_answer(key, answer)
+
+        done = {
+            "answer": answer,
+            "cached": cached,
+            "chunks_used": len(packed["chunks"]),
+            "context_tokens": packed["tokens"] + packed["figures_tokens"],
+            "total_chunks": len(context["chunks"]),
+        }
+        if include_timings:
+            done["timings"] = request_timings()
+        yield sse_event("done", done)
+    except Exception as e:
+        print(f"Streaming analysis error: {e}")
+        yield sse_event("error", {"error": str(e)})
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # keep nginx from holding events back
+    })
+
+async def analyze_documents_enhanced(pdf_paths: List[str], question: str, file_names: List[str] = None):
+    steps = ["📄 Loading document indexes (extracting and embedding any new PDFs)..."]
+    context = await load_retrieval_context(pdf_paths)
+
+    answer = answer_from_figures(context, question)
+    if answer is not None:
+        steps.append("📊 Answered from the extracted financial tables")
+        return {"steps": steps, "answer": answer, "cached": False, "chunks_used": 0,
+                "context_tokens": 0, "total_chunks": len(context["chunks"])}
+
+    steps.append("🧠 Calculating similarity scores...")
+    relevant_chunks = (await retrieve_chunks(context, [question]))[0]
+
+    result = await answer_question(question, relevant_chunks, context["documents"],
+                                   figures_for_question(context, question))
 
     return {
         "steps": steps,
-        "answer": final_answer,
-        "chunks_used": len(relevant_chunks),
-        "total_chunks": len(all_chunks)
+        "answer": result["answer"],
+        "cached": result["cached"],
+        "chunks_used": result["chunks_used"],
+        "context_tokens": result["context_tokens"],
+        "total_chunks": len(context["chunks"])
     }
 
+async def generate_report_sections(pdf_paths: List[str], section_keys: List[str],
+                                   max_concurrency: int = REPORT_MAX_CONCURRENCY) -> List[Dict]:
+    context = await load_retrieval_context(pdf_paths)
+    questions = [prompts[key] for key in section_keys]
+    # All section prompts are embedded in one request and scored in one matmul
+    retrieved = await retrieve_chunks(context, questions)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_section(key: str, question: str, chunks: List[Dict]) -> Dict:
+        async with semaphore:
+            try:
+                result = await answer_question(question, chunks, context["documents"],
+                                               figures_for_question(context, question))
+            except Exception as e:
+                print(f"Report section {key} failed: {e}")
+                result = {"answer": f"This section could not be generated: {e}", "cached": False}
+        return {"key": key, **result}
+
+    # gather keeps the requested order regardless of which section finishes first
+    return await asyncio.gather(*[
+        run_section(key, question, chunks) for key, question, chunks in zip(section_keys, questions, retrieved)
+    ])
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "prompts": prompts})
 
-@app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
-    for old_path in uploaded_pdf_paths:
+async def index_in_background(sha: str, path: str, filename: str, ticker: Optional[str], year: Optional[int]):
+    global index_semaphore
+    if index_semaphore is None:
+        index_semaphore = asyncio.Semaphore(max(1, INDEX_MAX_CONCURRENCY))
+    job = index_jobs[sha]
+    async with index_semaphore:
+        job["state"] = "indexing"
         try:
-            os.unlink(old_path)
-        except Exception:
-            pass
-    uploaded_pdf_paths.clear()
-    file_names = []
+            with stage("background_index"):
+                index = await build_document_index_async(path, client, sha=sha)
+            if not index["chunks"]:
+                raise ValueError("No text could be extracted from the PDF")
+            if ticker:
+                # Filings uploaded with a ticker also join the cross-filing corpus index
+                try:
+                    await asyncio.to_thread(get_corpus_index().add_document, sha, ticker, year,
+                                            index["chunks"], index["embeddings"])
+                except Exception as e:
+                    print(f"Corpus index insert failed for {filename}: {e}")
+            # An index with chunks that failed to embed is not stored; it is rebuilt on next use
+            if not await asyncio.to_thread(has_index, sha):
+                raise ValueError("Some chunks could not be embedded")
+            index_jobs.pop(sha, None)
+        except Exception as e:
+            print(f"Background indexing failed for {filename}: {e}")
+            job.update(state="failed", error=str(e), failed_at=time.monotonic())
+
+def schedule_indexing(sha: str, path: str, filename: str, ticker: Optional[str] = None, year: Optional[int] = None):
+    job = index_jobs.get(sha)
+    if job and (job["state"] != "failed" or time.monotonic() - job["failed_at"] < INDEX_RETRY_SECONDS):
+        return
+    index_jobs[sha] = {"state": "queued", "error": None, "failed_at": None}
+    task = asyncio.create_task(index_in_background(sha, path, filename, ticker, year))
+    index_tasks.add(task)
+    task.add_done_callback(index_tasks.discard)
+
+async def document_status(document: Dict) -> Dict:
+    if await asyncio.to_thread(has_index, document["sha256"]):
+        return {"filename": document["filename"], "sha256": document["sha256"], "status": "ready"}
+    job = index_jobs.get(document["sha256"])
+    if job is None or job["state"] == "failed":
+        # Uploaded to another worker, or to this one before a restart or a failed attempt
+        schedule_indexing(document["sha256"], document["path"], document["filename"])
+        job = index_jobs[document["sha256"]]
+    status = {"filename": document["filename"], "sha256": document["sha256"], "status": job["state"]}
+    if job["error"]:
+        status["error"] = job["error"]
+    return status
+
+@app.post("/upload")
+async def upload_files(files: List[UploadFile] = File(...), workspace_id: str = Form(None),
+                       ticker: str = Form(None), year: int = Form(None)):
     for file in files:
         if not file.filename.lower().endswith(".pdf"):
             return JSONResponse(status_code=400, content={"error": f"Invalid file type: {file.filename}"})
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        content = await file.read()
-        with open(temp_file.name, "wb") as f:
-            f.write(content)
-        uploaded_pdf_paths.append(temp_file.name)
-        file_names.append(file.filename)
-    return {"filenames": file_names, "status": "Files uploaded successfully", "file_count": len(files)}
+    # Uploading into an existing workspace replaces its documents; otherwise a new workspace is created
+    if workspace_id and not await asyncio.to_thread(workspace_exists, workspace_id):
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired workspace"})
+
+    documents = []
+    for file in files:
+        # The multipart parser has already spooled the file; it is copied to the store a block at
+        # a time and hashed on the way instead of being read into memory whole
+        with stage("store_upload"):
+            sha, path = await asyncio.to_thread(store_pdf_stream, file.file)
+        await file.close()
+        inc("bytes_total", os.path.getsize(path), kind="upload")
+        # Indexing starts now in the background; /analyze on a document still being indexed
+        # waits for that build instead of starting another
+        schedule_indexing(sha, path, file.filename, ticker, year)
+        documents.append({"filename": file.filename, "sha256": sha, "path": path})
+
+    if not workspace_id:
+        workspace_id = await asyncio.to_thread(create_workspace)
+    await asyncio.to_thread(set_documents, workspace_id, documents)
+    statuses = [await document_status(doc) for doc in documents]
+    return {
+        "filenames": [doc["filename"] for doc in documents],
+        "status": "Files uploaded successfully",
+        "file_count": len(files),
+        "workspace_id": workspace_id,
+        "ready": all(doc["status"] == "ready" for doc in statuses),
+        "documents": statuses,
+    }
+
+@app.get("/upload/status")
+async def upload_status(workspace_id: str = Query(...)):
+    documents = await asyncio.to_thread(get_documents, workspace_id)
+    if documents is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired workspace, please upload again"})
+    statuses = [await document_status(doc) for doc in documents]
+    return {
+        "workspace_id": workspace_id,
+        "ready": all(doc["status"] == "ready" for doc in statuses),
+        "documents": statuses,
+    }
 
 @app.post("/analyze")
-async def analyze(prompt_key: str = Form(...), custom_query: str = Form(None)):
-    if not uploaded_pdf_paths:
-        return JSONResponse(status_code=400, content={"error": "No documents uploaded yet"})
+async def analyze(prompt_key: str = Form(...), custom_query: str = Form(None), workspace_id: str = Form(None),
+                  include_timings: bool = Form(False)):
+    pdf_paths, error = await workspace_pdf_paths(workspace_id)
+    if error:
+        return error
     question = custom_query.strip() if custom_query else prompts.get(prompt_key)
     if not question:
         return JSONResponse(status_code=400, content={"error": "Invalid or missing query"})
-    file_names = [f"Document_{i+1}" for i in range(len(uploaded_pdf_paths))]
-    result = analyze_documents_enhanced(uploaded_pdf_paths, question, file_names)
-    return {
+    file_names = [f"Document_{i+1}" for i in range(len(pdf_paths))]
+    result = await analyze_documents_enhanced(pdf_paths, question, file_names)
+    response = {
         "answer": result["answer"],
         "steps": result["steps"],
+        "cached": result["cached"],
         "chunks_used": result["chunks_used"],
+        "context_tokens": result["context_tokens"],
         "total_chunks": result["total_chunks"]
     }
+    if include_timings:
+        response["timings"] = request_timings()
+    return response
 
 @app.post("/analyze_custom")
-async def analyze_custom(custom_query: str = Form(...)):
-    if not uploaded_pdf_paths:
-        return JSONResponse(status_code=400, content={"error": "No documents uploaded yet"})
+async def analyze_custom(custom_query: str = Form(...), workspace_id: str = Form(None), include_timings: bool = Form(False)):
+    pdf_paths, error = await workspace_pdf_paths(workspace_id)
+    if error:
+        return error
     if not custom_query.strip():
         return JSONResponse(status_code=400, content={"error": "Custom query cannot be empty"})
-    file_names = [f"Document_{i+1}" for i in range(len(uploaded_pdf_paths))]
-    result = analyze_documents_enhanced(uploaded_pdf_paths, custom_query.strip(), file_names)
-    return {
+    file_names = [f"Document_{i+1}" for i in range(len(pdf_paths))]
+    result = await analyze_documents_enhanced(pdf_paths, custom_query.strip(), file_names)
+    response = {
         "answer": result["answer"],
         "steps": result["steps"],
+        "cached": result["cached"],
         "chunks_used": result["chunks_used"],
+        "context_tokens": result["context_tokens"],
         "total_chunks": result["total_chunks"]
     }
+    if include_timings:
+        response["timings"] = request_timings()
+    return response
+
+@app.post("/analyze/stream")
+async def analyze_stream(prompt_key: str = Form(...), custom_query: str = Form(None), workspace_id: str = Form(None),
+                         include_timings: bool = Form(False)):
+    pdf_paths, error = await workspace_pdf_paths(workspace_id)
+    if error:
+        return error
+    question = custom_query.strip() if custom_query else prompts.get(prompt_key)
+    if not question:
+        return JSONResponse(status_code=400, content={"error": "Invalid or missing query"})
+    return sse_response(stream_analysis(pdf_paths, question, include_timings))
+
+@app.post("/analyze_custom/stream")
+async def analyze_custom_stream(custom_query: str = Form(...), workspace_id: str = Form(None),
+                                include_timings: bool = Form(False)):
+    pdf_paths, error = await workspace_pdf_paths(workspace_id)
+    if error:
+        return error
+    if not custom_query.strip():
+        return JSONResponse(status_code=400, content={"error": "Custom query cannot be empty"})
+    return sse_response(stream_analysis(pdf_paths, custom_query.strip(), include_timings))
+
+def quarter_date(quarter_ended: str) -> datetime:
+    try:
+        return datetime.strptime(quarter_ended, "%d-%b-%Y")
+    except (TypeError, ValueError):
+        return datetime.min
+
+def latest_quarter_rows(rows: List[Dict]) -> List[Dict]:
+    latest = {}
+    for row in rows:
+        current = latest.get(row["ticker"])
+        if current is None or quarter_date(row.get("quarter_ended")) > quarter_date(current.get("quarter_ended")):
+            latest[row["ticker"]] = row
+    return list(latest.values())
+
+async def check_load_version():
+    # add_to_db.py stamps load_versions after every load that changed rows; a new stamp
+    # empties the cache. Checked at most every FINANCIALS_VERSION_CHECK_SECONDS.
+    global financials_version, financials_version_checked, financials_generation
+    if time.monotonic() - financials_version_checked < FINANCIALS_VERSION_CHECK_SECONDS:
+        return
+    financials_version_checked = time.monotonic()
+    try:
+        response = await get_supabase_http().get(
+            f"{SUPABASE_URL}/rest/v1/{LOAD_VERSION_TABLE}",
+            params={"select": "version", "table_name": f"eq.{TABLE_NAME}"})
+        response.raise_for_status()
+        rows = response.json()
+        version = rows[0]["version"] if rows else None
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        print(f"Load version check failed: {e}")
+        version = None
+    # Without a readable stamp the cache only lives for one check interval
+    if version is None or version != financials_version:
+        financials_cache.clear()
+        financials_generation += 1
+        financials_version = version
+
+async def get_financials(ticker_list: List[str]) -> Dict[str, List[Dict]]:
+    """Every stored quarter for each ticker, from the cache or one in.() query for the misses."""
+    await check_load_version()
+    found = {}
+    missing = []
+    for ticker in ticker_list:
+        cache_result("financials", ticker in financials_cache)
+        if ticker in financials_cache:
+            financials_cache.move_to_end(ticker)
+            found[ticker] = financials_cache[ticker]
+        else:
+            missing.append(ticker)
+    if missing:
+        generation = financials_generation
+        # Quoted so symbols like M&M survive
+        in_clause = ",".join(f'"{t}"' for t in missing)
+        with stage("supabase"):
+            response = await get_supabase_http().get(f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}",
+                                                     params={"ticker": f"in.({in_clause})"})
+        response.raise_for_status()
+        fetched = {ticker: [] for ticker in missing}  # unknown tickers are cached as empty too
+        for row in response.json():
+            fetched.setdefault(row["ticker"], []).append(row)
+        found.update(fetched)
+        if generation == financials_generation:  # not from before a newer load
+            financials_cache.update(fetched)
+            while len(financials_cache) > FINANCIALS_CACHE_MAX_TICKERS:
+                financials_cache.popitem(last=False)
+    return found
 
 @app.get("/scrape_nse")
 async def scrape_nse(tickers: str = Query(..., description="Comma separated tickers")):
-    ticker_list = [t.strip().upper() for t in tickers.split(",") if t.strip()]
+    ticker_list = list(dict.fromkeys(t.strip().upper() for t in tickers.split(",") if t.strip()))
     if not ticker_list:
         return JSONResponse(status_code=400, content={"error": "No valid tickers provided"})
-    in_clause = ",".join(ticker_list)
-    supabase_query_url = f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}?ticker=in.({in_clause})"
-    response = requests.get(supabase_query_url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return JSONResponse(status_code=response.status_code, content={"error": "Failed to fetch from Supabase", "details": response.text})
+    try:
+        financials = await get_financials(ticker_list)
+    except httpx.HTTPStatusError as e:
+        return JSONResponse(status_code=e.response.status_code, content={"error": "Failed to fetch from Supabase", "details": e.response.text})
+    except httpx.HTTPError as e:
+        return JSONResponse(status_code=502, content={"error": "Failed to fetch from Supabase", "details": str(e)})
+    # The table keeps every loaded quarter; the peer table shows the latest one
+    return latest_quarter_rows([row for ticker in ticker_list for row in financials[ticker]])
+
+async def fetch_all_financials() -> List[Dict]:
+    # Paged so no single response is too large for PostgREST's max-rows
+    rows = []
+    select = "ticker,quarter_ended," + ",".join(PEER_METRICS)
+    with stage("supabase"):
+        while True:
+            response = await get_supabase_http().get(
+                f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}",
+                params={"select": select, "order": "id", "limit": PEER_SNAPSHOT_PAGE_SIZE, "offset": len(rows)})
+            response.raise_for_status()
+            page = response.json()
+            rows.extend(page)
+            if len(page) < PEER_SNAPSHOT_PAGE_SIZE:
+                return rows
 
+async def refresh_financials_snapshot():
+    global financials_snapshot, financials_snapshot_generation
+    generation = financials_generation
+    rows = await fetch_all_financials()
+    with stage("peer_snapshot"):
+        snapshot = await asyncio.to_thread(FinancialsSnapshot.from_rows, rows)
+    if generation >= financials_snapshot_generation:
+        financials_snapshot, financials_snapshot_generation = snapshot, generation
+        print(f"Peer snapshot: {len(snapshot)} tickers from {len(rows)} rows")
 
+def _snapshot_refreshed(task: asyncio.Task):
+    global financials_snapshot_task
+    financials_snapshot_task = None
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Peer snapshot refresh failed: {task.exception()}")
+
+async def get_financials_snapshot() -> FinancialsSnapshot:
+    """The current snapshot. The first one is built before answering; after a new load the
+    old one keeps serving while its replacement is built in the background."""
+    global financials_snapshot_lock, financials_snapshot_task
+    await check_load_version()
+    if financials_snapshot is None:
+        if financials_snapshot_lock is None:
+            financials_snapshot_lock = asyncio.Lock()
+        async with financials_snapshot_lock:
+            if financials_snapshot is None:
+                await refresh_financials_snapshot()
+    elif financials_snapshot_generation != financials_generation and financials_snapshot_task is None:
+        financials_snapshot_task = asyncio.create_task(refresh_financials_snapshot())
+        financials_snapshot_task.add_done_callback(_snapshot_refreshed)
+    return financials_snapshot
+
+@app.get("/peers/analytics")
+async def peer_analytics(tickers: str = Query(..., description="Comma separated tickers"),
+                         history: bool = Query(False, description="Include each ticker's quarterly history")):
+    ticker_list = list(dict.fromkeys(t.strip().upper() for t in tickers.split(",") if t.strip()))
+    if not ticker_list:
+        return JSONResponse(status_code=400, content={"error": "No valid tickers provided"})
+    try:
+        snapshot = await get_financials_snapshot()
+    except httpx.HTTPStatusError as e:
+        return JSONResponse(status_code=e.response.status_code, content={"error": "Failed to fetch from Supabase", "details": e.response.text})
+    except httpx.HTTPError as e:
+        return JSONResponse(status_code=502, content={"error": "Failed to fetch from Supabase", "details": str(e)})
+    with stage("peer_analytics"):
+        result = snapshot.analytics(ticker_list, history)
+    result["as_of"] = datetime.fromtimestamp(snapshot.loaded_at).isoformat(timespec="seconds")
+    result["load_version"] = financials_version
+    # Already plain JSON types; skips jsonable_encoder's walk over hundreds of nested dicts
+    return JSONResponse(content=result)
+
+@app.get("/corpus/search")
+async def corpus_search(q: str = Query(..., description="Question or search text"),
+                        tickers: str = Query(None, description="Comma separated tickers"),
+                        years: str = Query(None, description="Comma separated years"),
+                        k: int = Query(10, ge=1, le=100)):
+    ticker_list = [t.strip().upper() for t in tickers.split(",") if t.strip()] if tickers else None
+    try:
+        year_list = [int(y) for y in years.split(",") if y.strip()] if years else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Years must be comma separated numbers"})
+    try:
+        query_embedding = (await embed_questions([q.strip()]))[0]
+    except Exception as e:
+        return JSONResponse(status_code=502, content={"error": f"Could not embed the query: {e}"})
+    with stage("corpus_search"):
+        results = await asyncio.to_thread(get_corpus_index().search, query_embedding, k, ticker_list, year_list)
+    return {
+        "query": q,
+        "results": [{
+            "ticker": r["ticker"],
+            "year": r["year"],
+            "sha256": r["sha256"],
+            "chunk_number": r["chunk_number"],
+            "page_start": r["page_start"],
+            "page_end": r["page_end"],
+            "text": r["text"],
+            "score": r["score"],
+        } for r in results],
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format; counters are per worker process, so scrape each worker
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def answer_cache_stats():
+    stats = await asyncio.to_thread(cache_stats)
+    stats["financials_tickers"] = len(financials_cache)
+    stats["financials_load_version"] = financials_version
+    stats["peer_snapshot_tickers"] = len(financials_snapshot) if financials_snapshot is not None else 0
+    return stats
 
 @app.post("/generate_report")
-async def generate_report():
-    if not uploaded_pdf_paths:
-        return JSONResponse(status_code=400, content={"error": "No documents uploaded yet"})
-    
-    # Get the first two prompts from the prompts dict (ordered by insertion)
-    keys = list(prompts.keys())  # e.g. ["Business", "Competition"]
-    selected_keys = [keys[0], keys[2]]  # select prompt 1 and 3
-    file_names = [f"Document_{i+1}" for i in range(len(uploaded_pdf_paths))]
-    
+async def generate_report(sections: str = Form(None), workspace_id: str = Form(None)):
+    pdf_paths, error = await workspace_pdf_paths(workspace_id)
+    if error:
+        return error
+
+    section_keys = [k.strip() for k in sections.split(",") if k.strip()] if sections else REPORT_SECTIONS
+    unknown = [key for key in section_keys if key not in prompts]
+    if unknown or not section_keys:
+        return JSONResponse(status_code=400, content={"error": f"Invalid report sections: {', '.join(unknown)}"})
+
+    results = await generate_report_sections(pdf_paths, section_keys)
+
     doc = Document()
     doc.add_heading("Full Equity Research Report", level=1)
-    
-    for key in selected_keys:
-        prompt_text = prompts.get(key)
-        if not prompt_text:
-            continue  # skip if prompt not found
-        
-        # Call your analysis function for each prompt
-        result = analyze_documents_enhanced(uploaded_pdf_paths, prompt_text, file_names)
-        
-        # Add a heading for the prompt section
-        doc.add_heading(key, level=2)
-        # Add the text answer for that section
-        doc.add_paragraph(result["answer"])
+    # Sections finish in any order but are written in the order requested
+    for section in results:
+        doc.add_heading(section["key"], level=2)
+        doc.add_paragraph(section["answer"])
     
     temp_doc_path = tempfile.NamedTemporaryFile(delete=False, suffix=".docx").name
-    doc.save(temp_doc_path)
+    await asyncio.to_thread(doc.save, temp_doc_path)
     
     return FileResponse(
         path=temp_doc_path,
         filename="full_equity_report.docx",
         media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,252 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# --- Config ---
+# Per-request sampling profiles are off unless PROFILE_REQUESTS=1; a request then asks for one
+# with ?profile=1 or an X-Profile: 1 header and gets a collapsed-stack file (flamegraph.pl,
+# speedscope) in PROFILE_DIR
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # seconds between samples
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "http_requests_total": ("counter", "HTTP requests by route and status"),
+    "http_request_seconds": ("histogram", "Time to the response headers, by route"),
+    "stage_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result (hit or miss)"),
+    "openai_tokens_total": ("counter", "Tokens reported by the OpenAI API, by model and kind"),
+    "context_tokens_total": ("counter", "Tokens of packed context sent in prompts"),
+    "bytes_total": ("counter", "Bytes processed, by kind"),
+    "items_total": ("counter", "Items processed, by kind"),
+}
+
+_lock = threading.Lock()
+_counters: Dict[tuple, float] = {}
+_histograms: Dict[tuple, list] = {}
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+def _key(name: str, labels: Dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram[0][i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+def cache_result(cache: str, hit: bool):
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into stage_seconds and, inside a request, into its timings.
+    Works in sync and async code; worker threads started with asyncio.to_thread and tasks
+    from asyncio.gather see the request they were started from."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_seconds", elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Stages that run concurrently (one per document) add up, like CPU time
+            with _lock:
+                timings[name] = timings.get(name, 0.0) + elapsed * 1000
+
+
+def start_request():
+    """Start collecting stage timings for the current request; returns the token to reset with."""
+    return _request_timings.set({})
+
+
+def end_request(token):
+    _request_timings.reset(token)
+
+
+def request_timings() -> Dict[str, float]:
+    timings = _request_timings.get() or {}
+    with _lock:
+        return {name: round(ms, 2) for name, ms in timings.items()}
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    # Shown per request in the browser devtools network tab
+    return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', name)};dur={ms}" for name, ms in timings.items())
+
+
+def _labels(pairs: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = pairs + (extra or ())
+    if not pairs:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: [list(h[0]), h[1], h[2]] for key, h in _histograms.items()}
+    lines = []
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, description = DESCRIPTIONS.get(name, ("counter" if any(n == name for n, _ in counters) else "histogram", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, pairs), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_labels(pairs)} {value:g}")
+        for (metric, pairs), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_labels(pairs, (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels(pairs, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(pairs)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(pairs)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread (the event loop and the to_thread workers) at a fixed
+    interval and counts them as collapsed stacks. It sees the whole process, so other requests
+    running at the same time show up too; profile on a quiet worker."""
+
+    _active = threading.Lock()  # one profile at a time per process
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        if not SamplingProfiler._active.acquire(blocking=False):
+            return False
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                # Idle workers and the event loop waiting in select are not interesting
+                if stack and stack[0].startswith(("wait ", "select ", "_worker ", "poll ")):
+                    continue
+                stack.append(re.sub(r"[;\s]", "_", names.get(ident, str(ident))))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, path: Optional[str] = None) -> Optional[str]:
+        """Stop sampling; with a path, write the collapsed stacks there and return it."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            SamplingProfiler._active.release()
+        if path is None:
+            return None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_path(route: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    return os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{slug}.folded")
+
+
+def _profile_requested(request) -> bool:
+    return PROFILE_REQUESTS and "1" in (request.query_params.get("profile"), request.headers.get("x-profile"))
+
+
+async def http_middleware(request, call_next):
+    """Request counts and latency per route, stage timings in a Server-Timing header, and a
+    sampling profile when one is asked for. Install with app.middleware("http")(http_middleware)."""
+    token = start_request()
+    profiler, path = None, None
+    if _profile_requested(request):
+        profiler = SamplingProfiler()
+        if profiler.start():
+            path = profile_path(request.url.path)
+        else:
+            profiler = None
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    except Exception:
+        if profiler is not None:
+            profiler.stop(path)
+        raise
+    finally:
+        route = request.scope.get("route")
+        route = getattr(route, "path", None) or "unmatched"
+        inc("http_requests_total", route=route, status=status)
+        observe("http_request_seconds", time.perf_counter() - start, route=route)
+        timings = request_timings()
+        end_request(token)
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    if profiler is not None:
+        # Streamed bodies (server-sent events) are still being produced, so sampling runs until
+        # the last chunk is sent
+        response.headers["X-Profile-File"] = path
+        response.body_iterator = _profile_body(response.body_iterator, profiler, path)
+    return response
+
+
+async def _profile_body(body, profiler: SamplingProfiler, path: str):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        profiler.stop(path)
+        print(f"Profile written to {path}")
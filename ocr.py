@@ -0,0 +1,219 @@
+import hashlib
+import importlib
+import importlib.util
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Iterator, Optional
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from metrics import inc, observe
+
+# --- Config ---
+# Pages without a text layer (scans) are rendered and OCRed in a separate process pool. The
+# result is cached by a hash of the page's content and image streams, so a filing is OCRed
+# once no matter how often it is uploaded or reindexed.
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1") == "1"
+OCR_ENGINE = os.getenv("OCR_ENGINE", "easyocr")  # or "module:function" taking (gray image, languages)
+OCR_LANGUAGES = [lang.strip() for lang in os.getenv("OCR_LANGUAGES", "en").split(",") if lang.strip()]
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_MIN_TEXT_CHARS = 25  # a page with less text than this and mostly image is treated as scanned
+OCR_MIN_IMAGE_COVERAGE = 0.5
+OCR_VERSION = 1  # bump when rendering or post-processing changes so cached text is redone
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_schema_ready = set()
+_warned = False
+_engine = None  # per worker process
+
+
+def ocr_available() -> bool:
+    global _warned
+    if not OCR_ENABLED:
+        return False
+    module = OCR_ENGINE.split(":", 1)[0]
+    if importlib.util.find_spec(module) is None:
+        if not _warned:
+            _warned = True
+            print(f"OCR engine {module} is not installed, scanned pages will have no text")
+        return False
+    return True
+
+
+def needs_ocr(page: fitz.Page, text: str) -> bool:
+    if len(text) >= OCR_MIN_TEXT_CHARS:
+        return False
+    area = abs(page.rect)
+    if not area:
+        return False
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return covered / area >= OCR_MIN_IMAGE_COVERAGE
+
+
+def page_key(doc: fitz.Document, page: fitz.Page) -> str:
+    # What the page draws (content stream and image data), not where it sits in which file
+    digest = hashlib.sha256(f"{OCR_VERSION}:{OCR_DPI}:{OCR_ENGINE}:{','.join(OCR_LANGUAGES)}".encode())
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+
+# --- Cache ---
+def _cache_path() -> str:
+    return os.path.join(OCR_CACHE_DIR, "ocr.sqlite3")
+
+
+def _connect() -> sqlite3.Connection:
+    path = _cache_path()
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        _schema_ready.add(path)
+    return conn
+
+
+@contextmanager
+def _cache():
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_cached_text(key: str) -> Optional[str]:
+    with _cache() as conn:
+        row = conn.execute("SELECT text FROM pages WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def put_cached_text(key: str, text: str, seconds: float):
+    with _cache() as conn:
+        conn.execute("INSERT OR REPLACE INTO pages (key, text, seconds, created_at) VALUES (?, ?, ?, ?)",
+                     (key, text, seconds, time.time()))
+
+
+# --- Workers ---
+def get_ocr_pool() -> ProcessPoolExecutor:
+    # Separate from the text extraction pool: OCR tasks take seconds and would starve it
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def reset_ocr_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _load_engine(spec: str, languages: List[str]):
+    if spec == "easyocr":
+        import easyocr
+        reader = easyocr.Reader(languages, gpu=False, verbose=False)
+        # paragraph=True joins words into reading-order lines
+        return lambda image: "\n".join(reader.readtext(image, detail=0, paragraph=True))
+    module, _, name = spec.partition(":")
+    function = getattr(importlib.import_module(module), name)
+    return lambda image: function(image, languages)
+
+
+def _ocr_page(pdf_path: str, page_index: int, dpi: int, spec: str, languages: List[str]) -> Dict:
+    # Runs inside a worker; the engine (model weights for easyocr) is loaded once per worker
+    global _engine
+    if _engine is None:
+        _engine = _load_engine(spec, languages)
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pixmap = doc.load_page(page_index).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    text = _engine(image)
+    return {"text": text.strip(), "seconds": time.perf_counter() - start}
+
+
+def with_ocr(pdf_path: str, pages: Iterable[Dict], max_pending: Optional[int] = None) -> Iterator[Dict]:
+    """Fill in the text of pages marked "ocr_key" (scanned), keeping page order.
+
+    Cached pages are filled straight away; the rest are OCRed in the pool while later pages
+    keep arriving, with at most `max_pending` pages held back waiting for their text.
+    """
+    max_pending = max_pending or max(1, OCR_WORKERS) * 4
+    available = None
+    pending = deque()  # (page, future or None)
+    stats = {"pages": 0, "cached": 0, "failed": 0}
+    start = time.perf_counter()
+
+    def finish(page: Dict, future) -> Dict:
+        key = page.pop("ocr_key", None)
+        if future is not None:
+            try:
+                result = future.result()
+                page["text"] = result["text"]
+                page["ocr"] = True
+                put_cached_text(key, result["text"], result["seconds"])
+                observe("stage_seconds", result["seconds"], stage="ocr_page")
+            except Exception as e:
+                print(f"OCR failed for page {page['page_number']} of {pdf_path}: {e}")
+                page["ocr_failed"] = True
+                stats["failed"] += 1
+        return page
+
+    try:
+        for page in pages:
+            key = page.get("ocr_key")
+            future = None
+            if key is not None:
+                if available is None:
+                    available = ocr_available()
+                cached = get_cached_text(key)
+                if cached is not None:
+                    page["text"], page["ocr"] = cached, True
+                    stats["cached"] += 1
+                    page.pop("ocr_key")
+                elif available:
+                    future = get_ocr_pool().submit(_ocr_page, pdf_path, page["page_number"] - 1, OCR_DPI,
+                                                   OCR_ENGINE, OCR_LANGUAGES)
+                    stats["pages"] += 1
+                else:
+                    page.pop("ocr_key")
+            pending.append((page, future))
+            # Pages already done at the front go out now; a full queue waits for the oldest
+            while pending and (len(pending) > max_pending or pending[0][1] is None or pending[0][1].done()):
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+
+    if stats["pages"] or stats["cached"]:
+        elapsed = time.perf_counter() - start
+        inc("items_total", stats["pages"] - stats["failed"], kind="pages_ocr")
+        inc("items_total", stats["cached"], kind="pages_ocr_cached")
+        print(f"OCR {os.path.basename(pdf_path)}: {stats['pages']} pages OCRed ({stats['failed']} failed), "
+              f"{stats['cached']} from cache, {(stats['pages'] + stats['cached']) / elapsed:.2f} pages/s overall")
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import List, Dict, Iterator, Optional
+
+import fitz  # PyMuPDF
+
+from ocr import OCR_ENABLED, needs_ocr, page_key, with_ocr
+from fact_store import extract_page_tables
+
+
+# --- Config ---
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "32"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_extract_pool() -> Optional[ProcessPoolExecutor]:
+    # One pool per process, started lazily; spawn keeps workers clear of the server's threads and sockets
+    global _pool
+    if PDF_EXTRACT_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def reset_extract_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int, detect_scans: bool = OCR_ENABLED,
+                        detect_tables: bool = True) -> List[Dict]:
+    # Runs inside a worker: each worker opens the file itself, so no document objects cross processes.
+    # Pages that look tabular also get their tables ("tables": rows of cells) for the fact store.
+    doc = fitz.open(pdf_path)
+    try:
+        pages_text = []
+        for page_num in range(start, min(stop, doc.page_count)):
+            page = doc.load_page(page_num)
+            text = page.get_text().strip()
+            pages_text.append({"page_number": page_num + 1, "text": text})
+            if detect_scans and needs_ocr(page, text):
+                # Only an image: ocr.with_ocr fills the text in
+                pages_text[-1]["ocr_key"] = page_key(doc, page)
+            elif detect_tables:
+                tables = extract_page_tables(page, text)
+                if tables:
+                    pages_text[-1]["tables"] = tables
+        return pages_text
+    finally:
+        doc.close()
+
+
+def _page_ranges(page_count: int, pages_per_task: int) -> List[tuple]:
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def _pdf_page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages(pdf_path: str, pages_per_task: int = PAGES_PER_TASK) -> Iterator[Dict]:
+    """Yield {"page_number", "text"} in page order while later page ranges are still being extracted.
+
+    Only a few ranges per worker are in flight at once, so a slow consumer never has the
+    whole document's text parked in finished futures. Scanned pages get their text from OCR
+    (marked "ocr": True), done in parallel with the rest of the extraction.
+    """
+    return with_ocr(pdf_path, _iter_text_layer(pdf_path, pages_per_task))
+
+
+def _iter_text_layer(pdf_path: str, pages_per_task: int) -> Iterator[Dict]:
+    page_count = _pdf_page_count(pdf_path)
+    pool = get_extract_pool() if page_count > pages_per_task else None
+    if pool is None:
+        yield from _extract_page_range(pdf_path, 0, page_count)
+        return
+
+    ranges = iter(_page_ranges(page_count, pages_per_task))
+    in_flight = deque()
+    try:
+        for start, stop in islice(ranges, PDF_EXTRACT_WORKERS * 2):
+            in_flight.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+        while in_flight:
+            pages = in_flight.popleft().result()
+            for start, stop in islice(ranges, 1):
+                in_flight.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+            yield from pages
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_pdf_pages_in_process(pdf_path: str) -> Iterator[Dict]:
+    # The fallback when the extraction pool has died: same pages, extracted in this process
+    return with_ocr(pdf_path, _extract_page_range(pdf_path, 0, _pdf_page_count(pdf_path)))
+
+
+def extract_pdf_text(pdf_path: str) -> List[Dict]:
+    try:
+        return list(iter_pdf_pages(pdf_path))
+    except BrokenProcessPool as e:
+        print(f"PDF extraction pool failed ({e}), retrying {pdf_path} in-process")
+        reset_extract_pool()
+        try:
+            return list(iter_pdf_pages_in_process(pdf_path))
+        except Exception as e:
+            print(f"Error extracting PDF text from {pdf_path}: {e}")
+            return []
+    except Exception as e:
+        print(f"Error extracting PDF text from {pdf_path}: {e}")
+        return []
+
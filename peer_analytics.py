@@ -0,0 +1,190 @@
+import os
+import re
+import time
+from datetime import date
+from typing import List, Dict, Optional
+
+import numpy as np
+
+# --- Config ---
+# The financials table as ticker x quarter matrices, rebuilt by main_supa after every load, so a
+# peer screen over hundreds of tickers is a handful of array operations instead of queries
+PEER_HISTORY_QUARTERS = int(os.getenv("PEER_HISTORY_QUARTERS", "12"))
+METRICS = ("total_income", "net_profit_loss", "earnings_per_share")
+COLUMNS = METRICS + ("net_margin", "income_growth_qoq", "income_growth_yoy", "profit_growth_yoy", "eps_growth_yoy",
+                     "ttm_income", "ttm_net_profit", "ttm_eps")
+RANKED = ("total_income", "net_margin", "income_growth_yoy", "profit_growth_yoy", "eps_growth_yoy", "ttm_net_profit")
+
+_MONTHS = {m: i for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+_QUARTER = re.compile(r"^(\d{1,2})-([A-Za-z]{3})-(\d{4})$")
+_QUARTER_ENDS = {3: 31, 6: 30, 9: 30, 12: 31}
+
+
+def parse_number(value) -> Optional[float]:
+    """NSE figures as numbers: "1,23,456.78" -> 123456.78, "(12.5)" -> -12.5; "-", "--", "" -> None."""
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None or value != value else float(value)
+    text = str(value).strip().replace(",", "").replace("₹", "").strip()
+    negative = text.startswith("(") and text.endswith(")")
+    try:
+        number = float(text.strip("()"))
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def parse_quarter(quarter_ended: str) -> Optional[date]:
+    """"31-Mar-2025" -> date(2025, 3, 31), or None."""
+    match = _QUARTER.match(str(quarter_ended or "").strip())
+    month = _MONTHS.get(match.group(2).lower()) if match else None
+    if month is None:
+        return None
+    try:
+        return date(int(match.group(3)), month, int(match.group(1)))
+    except ValueError:
+        return None
+
+
+def quarter_number(day: date) -> int:
+    # Consecutive calendar quarters are consecutive numbers, so lag 1 is QoQ and lag 4 is YoY
+    return day.year * 4 + (day.month - 1) // 3
+
+
+def quarter_label(number: int) -> str:
+    year, month = number // 4, (number % 4) * 3 + 3
+    return date(year, month, _QUARTER_ENDS[month]).strftime("%d-%b-%Y")
+
+
+def _growth(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    # Against the size of the base, so a loss narrowing from -10 to -5 is +50%
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (current - previous) / np.abs(previous)
+    growth[~np.isfinite(growth)] = np.nan
+    return growth
+
+
+def percentile_ranks(values: np.ndarray) -> np.ndarray:
+    """Percent of the non-missing values at or below each value (100 = best); NaN stays NaN."""
+    known = np.sort(values[~np.isnan(values)])
+    ranks = np.full(values.shape, np.nan)
+    if len(known):
+        present = ~np.isnan(values)
+        ranks[present] = np.searchsorted(known, values[present], side="right") / len(known) * 100
+    return ranks
+
+
+class FinancialsSnapshot:
+    """Every ticker's last PEER_HISTORY_QUARTERS quarters as (ticker x quarter) float matrices,
+    NaN where a quarter was not reported, with the per-ticker analytics computed once per load."""
+
+    def __init__(self, tickers: np.ndarray, quarters: np.ndarray, values: Dict[str, np.ndarray]):
+        self.tickers = tickers
+        self.quarters = quarters
+        self.values = values
+        self.rows = {ticker: i for i, ticker in enumerate(tickers.tolist())}
+        self.loaded_at = time.time()
+        self.columns = self._analytics()
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], history: int = PEER_HISTORY_QUARTERS) -> "FinancialsSnapshot":
+        parsed = [(row.get("ticker"), parse_quarter(row.get("quarter_ended")), row) for row in rows]
+        parsed = [(ticker, day, row) for ticker, day, row in parsed if ticker and day]
+        if not parsed:
+            return cls(np.array([], dtype=str), np.array([], dtype=np.int64),
+                       {metric: np.empty((0, 0)) for metric in METRICS})
+        tickers, ticker_index = np.unique(np.array([ticker for ticker, _, _ in parsed], dtype=str), return_inverse=True)
+        numbers = np.array([quarter_number(day) for _, day, _ in parsed], dtype=np.int64)
+        last = int(numbers.max())
+        quarters = np.arange(max(int(numbers.min()), last - history + 1), last + 1)
+        keep = numbers >= quarters[0]
+        values = {}
+        for metric in METRICS:
+            matrix = np.full((len(tickers), len(quarters)), np.nan)
+            column = np.array([parse_number(row.get(metric)) for _, _, row in parsed], dtype=np.float64)
+            matrix[ticker_index[keep], numbers[keep] - quarters[0]] = column[keep]
+            values[metric] = matrix
+        return cls(tickers, quarters, values)
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def _analytics(self) -> Dict[str, np.ndarray]:
+        income, profit, eps = (self.values[metric] for metric in METRICS)
+        n, width = income.shape
+        if not n:
+            names = ("quarter", "quarters_reported") + COLUMNS + tuple(f"{name}_rank" for name in RANKED)
+            return {name: np.empty(0) for name in names}
+        reported = ~np.isnan(income)
+        # Each ticker's own latest reported quarter; -1 when it has none in the window
+        latest = np.where(reported.any(axis=1), width - 1 - np.argmax(reported[:, ::-1], axis=1), -1)
+        rows = np.arange(n)
+
+        def lagged(matrix: np.ndarray, lag: int) -> np.ndarray:
+            column = latest - lag
+            return np.where((column >= 0) & (latest >= 0), matrix[rows, np.clip(column, 0, None)], np.nan)
+
+        columns = {
+            "quarter": np.where(latest >= 0, self.quarters[np.clip(latest, 0, None)], -1),
+            "quarters_reported": reported.sum(axis=1),
+            "total_income": lagged(income, 0),
+            "net_profit_loss": lagged(profit, 0),
+            "earnings_per_share": lagged(eps, 0),
+        }
+        with np.errstate(divide="ignore", invalid="ignore"):
+            margin = columns["net_profit_loss"] / columns["total_income"]
+        columns["net_margin"] = np.where(np.isfinite(margin), margin, np.nan)
+        columns["income_growth_qoq"] = _growth(columns["total_income"], lagged(income, 1))
+        columns["income_growth_yoy"] = _growth(columns["total_income"], lagged(income, 4))
+        columns["profit_growth_yoy"] = _growth(columns["net_profit_loss"], lagged(profit, 4))
+        columns["eps_growth_yoy"] = _growth(columns["earnings_per_share"], lagged(eps, 4))
+        # Trailing four quarters; NaN unless all four were reported
+        columns["ttm_income"] = sum(lagged(income, lag) for lag in range(4))
+        columns["ttm_net_profit"] = sum(lagged(profit, lag) for lag in range(4))
+        columns["ttm_eps"] = sum(lagged(eps, lag) for lag in range(4))
+        for name in RANKED:
+            columns[f"{name}_rank"] = percentile_ranks(columns[name])
+        return columns
+
+    def analytics(self, tickers: List[str], history: bool = False) -> Dict:
+        """Latest-quarter figures, growth, margins and universe percentile ranks for `tickers`,
+        plus their ranks within the requested peer group and the group's medians."""
+        found = [ticker for ticker in tickers if ticker in self.rows]
+        index = np.array([self.rows[ticker] for ticker in found], dtype=np.int64)
+        # Converted a column at a time; only the dicts themselves are built per ticker
+        values = {name: _json_list(self.columns[name][index]) for name in COLUMNS}
+        ranks = {name: _json_list(self.columns[f"{name}_rank"][index]) for name in RANKED}
+        peer_ranks = {name: _json_list(percentile_ranks(self.columns[name][index])) for name in RANKED}
+        labels = [quarter_label(int(q)) if q >= 0 else None for q in self.columns["quarter"][index].tolist()]
+        reported = self.columns["quarters_reported"][index].astype(int).tolist()
+        if history:
+            history_labels = [quarter_label(int(q)) for q in self.quarters]
+            histories = {metric: [_json_list(row) for row in self.values[metric][index]] for metric in METRICS}
+
+        results = []
+        for i, ticker in enumerate(found):
+            result = {"ticker": ticker, "quarter_ended": labels[i], "quarters_reported": reported[i]}
+            for name in COLUMNS:
+                result[name] = values[name][i]
+            result["ranks"] = {name: ranks[name][i] for name in RANKED}
+            result["peer_ranks"] = {name: peer_ranks[name][i] for name in RANKED}
+            if history:
+                result["history"] = {"quarter_ended": history_labels, **{m: histories[m][i] for m in METRICS}}
+            results.append(result)
+
+        summary = {}
+        for name in ("net_margin", "income_growth_qoq", "income_growth_yoy", "profit_growth_yoy", "eps_growth_yoy"):
+            known = self.columns[name][index]
+            known = known[~np.isnan(known)]
+            summary[f"median_{name}"] = round(float(np.median(known)), 6) if len(known) else None
+        return {
+            "tickers": results,
+            "missing": [ticker for ticker in tickers if ticker not in self.rows],
+            "summary": summary,
+            "universe": len(self),
+            "quarters": [quarter_label(int(q)) for q in self.quarters],
+        }
+
+
+def _json_list(values: np.ndarray) -> List[Optional[float]]:
+    rounded = np.round(values.astype(np.float64), 6)
+    return [None if value != value else value for value in rounded.tolist()]
@@ -0,0 +1,192 @@
+import re
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a C-contiguous float32 copy with unit-length rows.
+
+    Zero rows and rows that failed to embed (NaN) become all-zero, so they score 0 against any query.
+    """
+    matrix = np.array(matrix, dtype=np.float32, copy=True, order="C", ndmin=2)
+    matrix[~np.isfinite(matrix).all(axis=1)] = 0.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(scores, n - k, axis=-1)[..., n - k:]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class VectorIndex:
+    """Cosine-similarity search over a pre-normalized, contiguous float32 embedding matrix."""
+
+    def __init__(self, embeddings: np.ndarray, normalized: bool = False):
+        if normalized and embeddings.dtype == np.float32 and embeddings.flags.c_contiguous:
+            self.matrix = embeddings
+        else:
+            self.matrix = normalize_rows(embeddings)
+
+    @classmethod
+    def concat(cls, matrices: List[np.ndarray], normalized: bool = False) -> "VectorIndex":
+        if not matrices:
+            return cls(np.empty((0, 0), dtype=np.float32), normalized=True)
+        if len(matrices) == 1:
+            return cls(matrices[0], normalized=normalized)
+        return cls(np.concatenate(matrices, axis=0).astype(np.float32, copy=False), normalized=normalized)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        indices, scores = self.search_batch(np.asarray(query)[None, :], k)
+        return indices[0], scores[0]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every query against every chunk, shape (q, n)."""
+        queries = normalize_rows(queries)
+        if len(self) == 0:
+            return np.empty((queries.shape[0], 0), dtype=np.float32)
+        return queries @ self.matrix.T
+
+    def search_batch(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score every query against every chunk with one matmul; returns (indices, scores) of shape (q, k)."""
+        scores = self.scores(queries)
+        if scores.shape[1] == 0:
+            return np.empty(scores.shape, dtype=np.intp), scores
+        indices = top_k_indices(scores, k)
+        return indices, np.take_along_axis(scores, indices, axis=-1)
+
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index kept as flat arrays: the postings of term t are
+    doc_ids[indptr[t]:indptr[t + 1]] with their term frequencies, so a query touches only
+    the postings of its own terms and needs no network call."""
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray, term_freqs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self._term_ids = {term: i for i, term in enumerate(terms.tolist())}
+
+        n = len(doc_lengths)
+        doc_freqs = np.diff(indptr)
+        self.idf = np.log1p((n - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        # Everything but the idf is fixed per posting, so it is computed once here
+        avg_length = doc_lengths.mean() if n else 1.0
+        length_norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+        tf = term_freqs.astype(np.float32)
+        self.weights = (tf * (k1 + 1) / (tf + length_norm[doc_ids])).astype(np.float32)
+
+    @classmethod
+    def _from_postings(cls, terms: np.ndarray, posting_terms: np.ndarray, doc_ids: np.ndarray,
+                       term_freqs: np.ndarray, doc_lengths: np.ndarray) -> "BM25Index":
+        order = np.lexsort((doc_ids, posting_terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=indptr[1:])
+        return cls(terms, indptr, doc_ids[order].astype(np.int32), term_freqs[order].astype(np.int32),
+                   doc_lengths.astype(np.float32))
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "BM25Index":
+        term_ids: Dict[str, int] = {}
+        postings = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc] = len(tokens)
+            postings.extend((term_ids.setdefault(token, len(term_ids)), doc) for token in tokens)
+        pairs = np.array(postings, dtype=np.int64).reshape(-1, 2)
+        keys, term_freqs = np.unique(pairs[:, 0] * max(len(texts), 1) + pairs[:, 1], return_counts=True)
+        terms = np.array(list(term_ids), dtype=str) if term_ids else np.array([], dtype=str)
+        return cls._from_postings(terms, keys // max(len(texts), 1), keys % max(len(texts), 1),
+                                  term_freqs, doc_lengths)
+
+    @classmethod
+    def concat(cls, indexes: List["BM25Index"]) -> "BM25Index":
+        """One index over several documents' chunks, in order, with corpus-wide idf and lengths."""
+        if len(indexes) == 1:
+            return indexes[0]
+        if not indexes:
+            return cls.from_texts([])
+        terms, inverse = np.unique(np.concatenate([index.terms for index in indexes]), return_inverse=True)
+        posting_terms, doc_ids = [], []
+        term_offset = doc_offset = 0
+        for index in indexes:
+            local_terms = np.repeat(np.arange(len(index.terms)), np.diff(index.indptr))
+            posting_terms.append(inverse[term_offset + local_terms])
+            doc_ids.append(index.doc_ids.astype(np.int64) + doc_offset)
+            term_offset += len(index.terms)
+            doc_offset += len(index.doc_lengths)
+        return cls._from_postings(terms, np.concatenate(posting_terms), np.concatenate(doc_ids),
+                                  np.concatenate([index.term_freqs for index in indexes]),
+                                  np.concatenate([index.doc_lengths for index in indexes]))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, terms=self.terms, indptr=self.indptr, doc_ids=self.doc_ids,
+                     term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            return cls(data["terms"], data["indptr"], data["doc_ids"], data["term_freqs"], data["doc_lengths"])
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self._term_ids.get(term)
+            if t is None:
+                continue
+            start, stop = self.indptr[t], self.indptr[t + 1]
+            # A term lists each document once, so plain fancy-index addition is safe
+            scores[self.doc_ids[start:stop]] += self.idf[t] * self.weights[start:stop]
+        return scores
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k chunks by BM25, best first; chunks sharing no term with the query are left out."""
+        scores = self.scores(query)
+        indices = top_k_indices(scores, k)
+        indices = indices[scores[indices] > 0]
+        return indices, scores[indices]
+
+    def search_batch(self, queries: List[str], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(query, k) for query in queries]
+
+
+def hybrid_scores(vector_scores: np.ndarray, lexical_scores: np.ndarray, vector_weight: float = 0.5) -> np.ndarray:
+    """Mix cosine and BM25 scores after min-max scaling each to [0, 1] per query, so a chunk that
+    one ranking is very sure about is not outvoted by chunks both rankings find middling."""
+    if vector_scores.shape[-1] == 0:
+        return np.zeros(vector_scores.shape, dtype=np.float32)  # no chunks: min/max have nothing to reduce
+
+    def scaled(scores: np.ndarray) -> np.ndarray:
+        low = scores.min(axis=-1, keepdims=True)
+        spread = scores.max(axis=-1, keepdims=True) - low
+        return np.divide(scores - low, spread, out=np.zeros_like(scores, dtype=np.float32), where=spread > 0)
+    return vector_weight * scaled(vector_scores) + (1 - vector_weight) * scaled(lexical_scores)
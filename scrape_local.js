@@ -1,7 +1,27 @@
 const fs = require('fs');
+const path = require('path');
+const { spawnSync } = require('child_process');
 const xlsx = require('xlsx');
 const { Parser } = require('json2csv');
-const puppeteer = require('puppeteer');
+const { ScraperPool } = require('./scrape_service');
+
+// === Config ===
+// Rows are appended to OUTPUT_NDJSON as each ticker finishes and every outcome is logged to
+// PROGRESS_FILE, so an interrupted run picks up where it stopped. STATE_FILE remembers the
+// latest quarter scraped per ticker, including runs that were never loaded into Supabase.
+// OUTPUT_NDJSON holds only the tickers this run scraped; SNAPSHOT_JSON/SNAPSHOT_CSV are the
+// latest row for every ticker ever scraped, with this run's rows merged over the previous ones.
+const OUTPUT_NDJSON = 'output.ndjson';
+const SNAPSHOT_JSON = 'output.json';
+const SNAPSHOT_CSV = 'output.csv';
+const PROGRESS_FILE = 'scrape_progress.ndjson';
+const STATE_FILE = 'scrape_state.json';
+const SUPABASE_URL = process.env.SUPABASE_URL;
+const SUPABASE_SERVICE_KEY = process.env.SUPABASE_SERVICE_KEY;
+const TABLE_NAME = 'financials';
+const DB_PAGE_SIZE = 1000;
+const CSV_FIELDS = ['ticker', 'quarter_ended', 'total_income', 'net_profit_loss', 'earnings_per_share'];
+const MONTHS = { jan: 0, feb: 1, mar: 2, apr: 3, may: 4, jun: 5, jul: 6, aug: 7, sep: 8, oct: 9, nov: 10, dec: 11 };
 
 // === Read tickers from tickers.xlsx ===
 function readTickersFromExcel(filePath = 'tickers.xlsx') {
@@ -18,131 +38,225 @@ function readTickersFromExcel(filePath = 'tickers.xlsx') {
   }
 }
 
-// === Real scraper using Puppeteer with per-ticker logging and error handling ===
-async function scrapeFinancials(tickers) {
-  const browser = await puppeteer.launch({
-    headless: true,
-    args: [
-      '--no-sandbox',
-      '--disable-setuid-sandbox',
-      '--disable-dev-shm-usage',
-      '--disable-gpu',
-      '--disable-features=site-per-process'
-    ]
-  });
+// "31-Mar-2025" (or "31-MAR-2025", as NSE sometimes prints it) -> epoch ms, or null
+function parseQuarter(quarterEnded) {
+  const match = /^(\d{1,2})-([A-Za-z]{3})-(\d{4})$/.exec(String(quarterEnded || '').trim());
+  const month = match ? MONTHS[match[2].toLowerCase()] : undefined;
+  if (month === undefined) return null;
+  return Date.UTC(Number(match[3]), month, Number(match[1]));
+}
+
+// The most recent quarter end strictly before today; nothing newer can have been reported
+function lastQuarterEnd(today = new Date()) {
+  const year = today.getUTCFullYear();
+  const ends = [Date.UTC(year - 1, 11, 31), Date.UTC(year, 2, 31), Date.UTC(year, 5, 30), Date.UTC(year, 8, 30), Date.UTC(year, 11, 31)];
+  const now = Date.UTC(year, today.getUTCMonth(), today.getUTCDate());
+  return ends.filter(end => end < now).pop();
+}
+
+function readNdjson(filePath) {
+  if (!fs.existsSync(filePath)) return [];
+  const lines = fs.readFileSync(filePath, 'utf8').split('\n');
+  const records = [];
+  let validBytes = 0;
+  for (const line of lines) {
+    if (!line.trim()) { validBytes += Buffer.byteLength(line) + 1; continue; }
+    try {
+      records.push(JSON.parse(line));
+      validBytes += Buffer.byteLength(line) + 1;
+    } catch (err) {
+      // A crash can leave half a line at the end; drop it so appends start on a clean line
+      fs.truncateSync(filePath, validBytes);
+      console.warn(`⚠️ Dropped a partial line at the end of ${filePath}`);
+      break;
+    }
+  }
+  return records;
+}
+
+function appendNdjson(filePath, record) {
+  fs.appendFileSync(filePath, JSON.stringify(record) + '\n');
+}
+
+// Latest known quarter per ticker: the newer of Supabase (when configured) and STATE_FILE,
+// which also has quarters scraped by runs that were not given --load
+async function loadStoredQuarters() {
+  const latest = {};
+  const remember = (ticker, quarterEnded) => {
+    const date = parseQuarter(quarterEnded);
+    if (date !== null && (!(ticker in latest) || date > latest[ticker])) latest[ticker] = date;
+  };
+  if (SUPABASE_URL && SUPABASE_SERVICE_KEY) {
+    const headers = { apikey: SUPABASE_SERVICE_KEY, Authorization: `Bearer ${SUPABASE_SERVICE_KEY}` };
+    for (let offset = 0; ; offset += DB_PAGE_SIZE) {
+      const url = `${SUPABASE_URL}/rest/v1/${TABLE_NAME}?select=ticker,quarter_ended&order=id&limit=${DB_PAGE_SIZE}&offset=${offset}`;
+      const response = await fetch(url, { headers });
+      if (!response.ok) throw new Error(`Supabase returned ${response.status}: ${await response.text()}`);
+      const rows = await response.json();
+      rows.forEach(row => remember(row.ticker, row.quarter_ended));
+      if (rows.length < DB_PAGE_SIZE) break;
+    }
+  }
+  if (fs.existsSync(STATE_FILE)) {
+    const state = JSON.parse(fs.readFileSync(STATE_FILE, 'utf8'));
+    Object.entries(state).forEach(([ticker, quarterEnded]) => remember(ticker, quarterEnded));
+  }
+  return latest;
+}
+
+function saveState(rows) {
+  const state = fs.existsSync(STATE_FILE) ? JSON.parse(fs.readFileSync(STATE_FILE, 'utf8')) : {};
+  for (const row of rows) {
+    const date = parseQuarter(row.quarter_ended);
+    if (date !== null && (!(row.ticker in state) || date > parseQuarter(state[row.ticker]))) {
+      state[row.ticker] = row.quarter_ended;
+    }
+  }
+  fs.writeFileSync(STATE_FILE + '.tmp', JSON.stringify(state, null, 2));
+  fs.renameSync(STATE_FILE + '.tmp', STATE_FILE);
+}
 
+// The previous snapshot with each ticker in `rows` replaced by its new row, in ticker order
+function mergeSnapshot(previous, rows) {
+  const byTicker = new Map(previous.map(row => [row.ticker, row]));
+  rows.forEach(row => byTicker.set(row.ticker, row));
+  return [...byTicker.values()].sort((a, b) => a.ticker.localeCompare(b.ticker));
+}
+
+function readSnapshot() {
+  if (!fs.existsSync(SNAPSHOT_JSON)) return [];
   try {
-    const page = await browser.newPage();
-
-    await page.setUserAgent(
-      "Mozilla/5.0 (Windows NT 10.0; Win64; x64) " +
-      "AppleWebKit/537.36 (KHTML, like Gecko) " +
-      "Chrome/114.0.0.0 Safari/537.36"
-    );
-
-    await page.setExtraHTTPHeaders({
-      'accept-language': 'en-US,en;q=0.9',
-    });
-
-    // Go to NSE homepage once to get cookies/session
-    await page.goto("https://www.nseindia.com", { waitUntil: 'domcontentloaded' });
-    await new Promise(r => setTimeout(r, 3000)); // wait for session cookies
-
-    let results = [];
-    let failedTickers = [];
-
-    for (const ticker of tickers) {
-      console.log(`🔍 Scraping ticker: ${ticker}`);
-      const url = `https://www.nseindia.com/get-quotes/equity?symbol=${ticker}`;
-
-      try {
-        await page.goto(url, { waitUntil: 'domcontentloaded', timeout: 60000 });
-        await page.waitForSelector('#topFinancialResultsTable', { timeout: 10000 });
-
-        // Extract only the first row (latest quarter) as JSON
-        const latestData = await page.evaluate(() => {
-          const table = document.querySelector('#topFinancialResultsTable');
-          if (!table) return null;
-
-          const firstRow = table.querySelector('tbody tr');
-          if (!firstRow) return null;
-
-          const cells = firstRow.querySelectorAll('td');
-          return {
-            quarter_ended: cells[0]?.innerText.trim(),
-            total_income: cells[1]?.innerText.trim(),
-            net_profit_loss: cells[2]?.innerText.trim(),
-            earnings_per_share: cells[3]?.innerText.trim(),
-          };
-        });
-
-        if (!latestData) {
-          console.warn(`⚠️ No financial data found for ticker: ${ticker}`);
-          failedTickers.push(ticker);
-          continue;
-        }
-
-        // const cleanedData = {
-        //   ticker,
-        //   quarter_ended: latestData.quarter_ended,
-        //   total_income: parseFloat(latestData.total_income.replace(/,/g, '')) || null,
-        //   net_profit_loss: parseFloat(latestData.net_profit_loss.replace(/,/g, '')) || null,
-        //   earnings_per_share: parseFloat(latestData.earnings_per_share.replace(/,/g, '')) || null,
-        // };
-        
-        // results.push(cleanedData);
-
-        results.push({ ticker, ...latestData });
-
-        console.log(`✅ Successfully scraped ${ticker}`);
-
-      } catch (err) {
-        console.error(`❌ Failed to scrape ${ticker}: ${err.message}`);
-        failedTickers.push(ticker);
+    return JSON.parse(fs.readFileSync(SNAPSHOT_JSON, 'utf8'));
+  } catch (err) {
+    console.warn(`⚠️ Ignoring unreadable ${SNAPSHOT_JSON}: ${err.message}`);
+    return [];
+  }
+}
+
+const USAGE = 'Usage: node scrape_local.js [--fresh] [--all] [--load] [--tickers TCS,INFY,...]';
+
+function parseArgs(argv) {
+  const args = { fresh: false, all: false, load: false, tickers: null };
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i] === '--fresh') args.fresh = true;
+    else if (argv[i] === '--all') args.all = true;
+    else if (argv[i] === '--load') args.load = true;
+    else if (argv[i] === '--tickers') {
+      const value = argv[++i];
+      if (value === undefined || value.startsWith('--')) {
+        console.error(`❌ --tickers needs a comma separated list\n${USAGE}`);
+        process.exit(1);
       }
+      args.tickers = value.split(',').map(t => t.trim()).filter(Boolean);
     }
+  }
+  return args;
+}
 
-    return { results, failedTickers };
+// === Checkpointed run over the ticker universe ===
+async function runScrape({ tickers, fresh = false, all = false, pool = null }) {
+  const progress = readNdjson(PROGRESS_FILE);
+  const last = progress[progress.length - 1];
+  const resuming = !fresh && progress.length > 0 && !(last && last.event === 'complete');
+  const done = new Set();
+  if (resuming) {
+    readNdjson(OUTPUT_NDJSON).forEach(row => done.add(row.ticker));
+    progress.filter(p => p.status === 'current').forEach(p => done.add(p.ticker));
+    console.log(`⏯️ Resuming: ${done.size} of ${tickers.length} tickers already done`);
+  } else {
+    fs.writeFileSync(OUTPUT_NDJSON, '');
+    fs.writeFileSync(PROGRESS_FILE, '');
+    appendNdjson(PROGRESS_FILE, { event: 'start', total: tickers.length, at: new Date().toISOString() });
+  }
 
-  } catch (err) {
-    console.error("Error scraping:", err.message);
-    throw err;
+  // A ticker that already has the last completed quarter cannot have anything newer yet
+  const expected = lastQuarterEnd();
+  const stored = all ? {} : await loadStoredQuarters();
+  const todo = [];
+  let skipped = 0;
+  for (const ticker of tickers) {
+    if (done.has(ticker)) continue;
+    if (stored[ticker] !== undefined && stored[ticker] >= expected) {
+      appendNdjson(PROGRESS_FILE, { ticker, status: 'current' });
+      skipped++;
+    } else {
+      todo.push(ticker);
+    }
+  }
+  console.log(`🔍 Scraping ${todo.length} tickers, ${skipped} already have the quarter ended ` +
+              `${new Date(expected).toISOString().slice(0, 10)}`);
+
+  const ownPool = !pool;
+  pool = pool || new ScraperPool();
+  const failedTickers = [];
+  let scraped = 0;
+  try {
+    await Promise.all(todo.map(async ticker => {
+      const outcome = await pool.scrape(ticker);
+      if (outcome.ok) {
+        appendNdjson(OUTPUT_NDJSON, outcome.data);
+        appendNdjson(PROGRESS_FILE, { ticker, status: 'ok', quarter_ended: outcome.data.quarter_ended });
+        scraped++;
+        if (scraped % 50 === 0) console.log(`✅ ${scraped}/${todo.length} scraped`);
+      } else {
+        appendNdjson(PROGRESS_FILE, { ticker, status: 'failed', kind: outcome.kind, error: outcome.error });
+        failedTickers.push(ticker);
+      }
+    }));
   } finally {
-    await browser.close();
+    if (ownPool) await pool.close();
   }
+
+  const results = readNdjson(OUTPUT_NDJSON);
+  saveState(results);
+  appendNdjson(PROGRESS_FILE, { event: 'complete', at: new Date().toISOString() });
+  return { results, failedTickers, scraped, skipped };
 }
 
 // === Main ===
-(async () => {
-  const tickers = readTickersFromExcel();
+if (require.main === module) {
+  (async () => {
+    const args = parseArgs(process.argv.slice(2));
+    const tickers = args.tickers || readTickersFromExcel();
 
-  if (tickers.length === 0) {
-    console.log("⚠️ No tickers found in tickers.xlsx");
-    process.exit(1);
-  }
+    if (tickers.length === 0) {
+      console.log("⚠️ No tickers found in tickers.xlsx");
+      process.exit(1);
+    }
 
-  try {
-    const { results, failedTickers } = await scrapeFinancials(tickers);
-
-    // Save JSON
-    fs.writeFileSync('output.json', JSON.stringify(results, null, 2));
-    console.log("✅ Saved output to output.json");
-
-    // Convert JSON to CSV and save
-    const fields = ['ticker', 'quarter_ended', 'total_income', 'net_profit_loss', 'earnings_per_share'];
-    const parser = new Parser({ fields });
-    const csv = parser.parse(results);
-    fs.writeFileSync('output.csv', csv);
-    console.log("✅ Saved output to output.csv");
-
-    // Log failed tickers if any
-    if (failedTickers.length > 0) {
-      fs.writeFileSync('failed_tickers.log', failedTickers.join('\n'));
-      console.warn(`⚠️ Some tickers failed to scrape. See failed_tickers.log`);
+    try {
+      const { results, failedTickers, scraped, skipped } = await runScrape({ tickers, fresh: args.fresh, all: args.all });
+      console.log(`✅ Scraped ${scraped}, skipped ${skipped} up to date, ${failedTickers.length} failed; rows in ${OUTPUT_NDJSON}`);
+
+      // Save JSON: this run's rows merged into the snapshot of every ticker scraped so far
+      const snapshot = mergeSnapshot(readSnapshot(), results);
+      fs.writeFileSync(SNAPSHOT_JSON + '.tmp', JSON.stringify(snapshot, null, 2));
+      fs.renameSync(SNAPSHOT_JSON + '.tmp', SNAPSHOT_JSON);
+      console.log(`✅ Saved ${snapshot.length} tickers to ${SNAPSHOT_JSON}`);
+
+      // Convert JSON to CSV and save
+      const parser = new Parser({ fields: CSV_FIELDS });
+      const csv = parser.parse(snapshot);
+      fs.writeFileSync(SNAPSHOT_CSV, csv);
+      console.log(`✅ Saved output to ${SNAPSHOT_CSV}`);
+
+      // Log failed tickers if any
+      if (failedTickers.length > 0) {
+        fs.writeFileSync('failed_tickers.log', failedTickers.join('\n'));
+        console.warn(`⚠️ Some tickers failed to scrape. See failed_tickers.log`);
+      }
+
+      // Only this run's changed rows go to the database
+      if (args.load && results.length > 0) {
+        const python = process.env.PYTHON || 'python';
+        const load = spawnSync(python, [path.join(__dirname, 'add_to_db.py'), OUTPUT_NDJSON], { stdio: 'inherit' });
+        if (load.status !== 0) process.exit(load.status || 1);
+      }
+    } catch (err) {
+      console.error("Fatal error during scraping process:", err.message);
+      process.exit(1);
     }
+  })();
+}
 
-  } catch (err) {
-    console.error("Fatal error during scraping process:", err.message);
-    process.exit(1);
-  }
-})();
+module.exports = { runScrape, lastQuarterEnd, parseQuarter, loadStoredQuarters, mergeSnapshot, readTickersFromExcel };
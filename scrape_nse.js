@@ -1,79 +1,16 @@
-const puppeteer = require('puppeteer');
+const { ScraperPool } = require('./scrape_service');
 
+// One-off run on a fresh pool; the API talks to the long-lived scrape_service.js instead
 async function scrapeFinancials(tickers) {
-  const browser = await puppeteer.launch({
-    headless: true,
-    // executablePath: "/usr/bin/chromium-browser",
-    args: [
-      '--no-sandbox',
-      '--disable-setuid-sandbox',
-      '--disable-dev-shm-usage',
-      '--disable-gpu',
-      '--disable-features=site-per-process'
-    ]
-  });
-
+  const pool = new ScraperPool();
   try {
-    const page = await browser.newPage();
-
-    await page.setUserAgent(
-      "Mozilla/5.0 (Windows NT 10.0; Win64; x64) " +
-      "AppleWebKit/537.36 (KHTML, like Gecko) " +
-      "Chrome/114.0.0.0 Safari/537.36"
-    );
-
-    await page.setExtraHTTPHeaders({
-      'accept-language': 'en-US,en;q=0.9',
-    });
-
-    // Go to NSE homepage once to get cookies/session
-    await page.goto("https://www.nseindia.com", { waitUntil: 'domcontentloaded' });
-    await new Promise(r => setTimeout(r, 3000)); // wait for session cookies
-
-    let results = [];
-
-    for (const ticker of tickers) {
-      const url = `https://www.nseindia.com/get-quotes/equity?symbol=${ticker}`;
-      await page.goto(url, { waitUntil: 'domcontentloaded', timeout: 60000 });
-
-      try {
-        await page.waitForSelector('#topFinancialResultsTable', { timeout: 10000 });
-
-        // Extract only the first row (latest quarter) as JSON
-        const latestData = await page.evaluate(() => {
-          const table = document.querySelector('#topFinancialResultsTable');
-          if (!table) return null;
-
-          const firstRow = table.querySelector('tbody tr');
-          if (!firstRow) return null;
-
-          const cells = firstRow.querySelectorAll('td');
-          return {
-            quarter_ended: cells[0]?.innerText.trim(),
-            total_income: cells[1]?.innerText.trim(),
-            net_profit_loss: cells[2]?.innerText.trim(),
-            earnings_per_share: cells[3]?.innerText.trim(),
-          };
-        });
-
-        if (!latestData) {
-          console.warn(`No financial data found for ticker: ${ticker}`);
-          continue;
-        }
-
-        results.push({ ticker, ...latestData });
-      } catch (e) {
-        console.warn(`Failed to get data for ticker ${ticker}: ${e.message}`);
-      }
+    const { results, failed } = await pool.scrapeMany(tickers);
+    for (const failure of failed) {
+      console.warn(`Failed to get data for ticker ${failure.ticker}: ${failure.error}`);
     }
-
     return results;
-
-  } catch (err) {
-    console.error("Error scraping:", err.message);
-    throw err;
   } finally {
-    await browser.close();
+    await pool.close();
   }
 }
 
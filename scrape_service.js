@@ -0,0 +1,366 @@
+const fs = require('fs');
+const http = require('http');
+const net = require('net');
+
+// === Config ===
+const SOCKET_PATH = process.env.SCRAPER_SOCKET || '/tmp/nse_scraper.sock';
+const NSE_BASE_URL = process.env.NSE_BASE_URL || 'https://www.nseindia.com';
+const PAGE_POOL_SIZE = parseInt(process.env.SCRAPER_PAGES || '4', 10);
+const REQUESTS_PER_SECOND = parseFloat(process.env.SCRAPER_RATE || '2'); // page loads per second, across all pages
+const MAX_ATTEMPTS = parseInt(process.env.SCRAPER_MAX_ATTEMPTS || '3', 10);
+const BACKOFF_BASE_MS = 1000;
+const BACKOFF_MAX_MS = 15000;
+const BLOCKED_PAUSE_MS = 10000; // every page waits this long after NSE answers 401/403/429
+const SESSION_TTL_MS = 10 * 60 * 1000;
+const SESSION_WARMUP_MS = 3000; // upper bound; warm-up ends as soon as the session cookies are set
+const SESSION_COOKIES = ['nsit', 'nseappid'];
+const NAVIGATION_TIMEOUT_MS = 60000;
+const TABLE_TIMEOUT_MS = 10000;
+const BLOCKED_RESOURCES = new Set(['image', 'font', 'media']);
+
+const BROWSER_ARGS = [
+  '--no-sandbox',
+  '--disable-setuid-sandbox',
+  '--disable-dev-shm-usage',
+  '--disable-gpu',
+  '--disable-features=site-per-process'
+];
+const USER_AGENT =
+  "Mozilla/5.0 (Windows NT 10.0; Win64; x64) " +
+  "AppleWebKit/537.36 (KHTML, like Gecko) " +
+  "Chrome/114.0.0.0 Safari/537.36";
+
+const sleep = ms => new Promise(r => setTimeout(r, ms));
+
+class ScrapeError extends Error {
+  constructor(message, kind, retryable) {
+    super(message);
+    this.kind = kind;
+    this.retryable = retryable;
+  }
+}
+
+// Sorts failures into the cases seen in failed_tickers.log: slow pages and dropped
+// connections are retried, a missing or empty results table is not
+function classifyError(err) {
+  if (err instanceof ScrapeError) return err;
+  const message = err.message || String(err);
+  if (err.name === 'TimeoutError' || /timeout/i.test(message)) {
+    return new ScrapeError(message, 'timeout', true);
+  }
+  if (/net::ERR_|ECONNRESET|socket hang up/i.test(message)) {
+    return new ScrapeError(message, 'network', true);
+  }
+  if (/Target closed|Session closed|detached Frame|Protocol error/i.test(message)) {
+    return new ScrapeError(message, 'page_crashed', true);
+  }
+  return new ScrapeError(message, 'error', false);
+}
+
+function backoffDelay(attempt) {
+  const delay = Math.min(BACKOFF_MAX_MS, BACKOFF_BASE_MS * 2 ** (attempt - 1));
+  return delay / 2 + Math.random() * delay / 2;
+}
+
+// Spaces page loads evenly over time no matter how many pages are loading
+class RateLimiter {
+  constructor(perSecond) {
+    this.interval = 1000 / perSecond;
+    this.next = 0;
+  }
+
+  async wait() {
+    const now = Date.now();
+    const at = Math.max(now, this.next);
+    this.next = at + this.interval;
+    if (at > now) await sleep(at - now);
+  }
+
+  pause(ms) {
+    this.next = Math.max(this.next, Date.now() + ms);
+  }
+}
+
+// === One warm browser with a fixed pool of pages sharing the NSE session cookies ===
+class ScraperPool {
+  constructor({ pages = PAGE_POOL_SIZE, launch = null } = {}) {
+    this.size = Math.max(1, pages);
+    this.launch = launch || (() => require('puppeteer').launch({
+      headless: true,
+      executablePath: process.env.PUPPETEER_EXECUTABLE_PATH,
+      args: BROWSER_ARGS
+    }));
+    this.browser = null;
+    this.browserPromise = null;
+    this.pages = new Array(this.size).fill(null);
+    this.sessionAt = 0;
+    this.sessionPromise = null;
+    this.limiter = new RateLimiter(REQUESTS_PER_SECOND);
+    this.queue = [];
+    this.waiting = [];
+    this.inFlight = new Map();
+    this.stats = { scraped: 0, failed: 0, retries: 0, sessions: 0 };
+    this.closed = false;
+    for (let i = 0; i < this.size; i++) this.worker(i);
+  }
+
+  async getBrowser() {
+    if (this.browser && this.browser.connected !== false) return this.browser;
+    if (!this.browserPromise) {
+      this.browserPromise = (async () => {
+        const browser = await this.launch();
+        browser.on('disconnected', () => {
+          if (this.browser === browser) {
+            console.warn('⚠️ Browser disconnected, relaunching on next request');
+            this.browser = null;
+            this.pages.fill(null);
+            this.sessionAt = 0;
+          }
+        });
+        this.browser = browser;
+        this.pages.fill(null);
+        this.sessionAt = 0;
+        return browser;
+      })().finally(() => { this.browserPromise = null; });
+    }
+    return this.browserPromise;
+  }
+
+  async getPage(slot) {
+    const current = this.pages[slot];
+    if (current && !current.isClosed()) return current;
+    const browser = await this.getBrowser();
+    const page = await browser.newPage();
+    await page.setUserAgent(USER_AGENT);
+    await page.setExtraHTTPHeaders({ 'accept-language': 'en-US,en;q=0.9' });
+    // Quote pages pull in images and web fonts the table never needs
+    await page.setRequestInterception(true);
+    page.on('request', request => {
+      if (request.isInterceptResolutionHandled && request.isInterceptResolutionHandled()) return;
+      if (BLOCKED_RESOURCES.has(request.resourceType())) request.abort();
+      else request.continue();
+    });
+    this.pages[slot] = page;
+    return page;
+  }
+
+  // Visits the homepage once per SESSION_TTL_MS; the cookies it sets are shared by every page
+  async ensureSession(page) {
+    if (this.sessionAt && Date.now() - this.sessionAt < SESSION_TTL_MS) return;
+    if (!this.sessionPromise) {
+      this.sessionPromise = (async () => {
+        await this.limiter.wait();
+        await page.goto(NSE_BASE_URL, { waitUntil: 'domcontentloaded', timeout: NAVIGATION_TIMEOUT_MS });
+        const deadline = Date.now() + SESSION_WARMUP_MS;
+        while (Date.now() < deadline) {
+          const cookies = await page.cookies();
+          if (SESSION_COOKIES.every(name => cookies.some(c => c.name === name))) break;
+          await sleep(200);
+        }
+        this.sessionAt = Date.now();
+        this.stats.sessions++;
+      })().finally(() => { this.sessionPromise = null; });
+    }
+    return this.sessionPromise;
+  }
+
+  async scrapeTicker(page, ticker) {
+    await this.ensureSession(page);
+    await this.limiter.wait();
+    // Symbols like M&M and J&KBANK must be escaped or NSE sees symbol=M
+    const url = `${NSE_BASE_URL}/get-quotes/equity?symbol=${encodeURIComponent(ticker)}`;
+    const response = await page.goto(url, { waitUntil: 'domcontentloaded', timeout: NAVIGATION_TIMEOUT_MS });
+    const status = response ? response.status() : 0;
+    if (status === 401 || status === 403 || status === 429) {
+      this.sessionAt = 0;
+      this.limiter.pause(BLOCKED_PAUSE_MS);
+      throw new ScrapeError(`NSE returned HTTP ${status}`, 'blocked', true);
+    }
+    if (status === 404) throw new ScrapeError('Symbol page not found', 'not_found', false);
+    if (status >= 500) throw new ScrapeError(`NSE returned HTTP ${status}`, 'server', true);
+
+    await page.waitForSelector('#topFinancialResultsTable', { timeout: TABLE_TIMEOUT_MS });
+
+    // Every quarter the table lists, latest first; the latest is also kept at the top level
+    const quarters = await page.evaluate(() => {
+      const table = document.querySelector('#topFinancialResultsTable');
+      if (!table) return [];
+
+      return Array.from(table.querySelectorAll('tbody tr')).map(row => {
+        const cells = row.querySelectorAll('td');
+        return {
+          quarter_ended: cells[0]?.innerText.trim(),
+          total_income: cells[1]?.innerText.trim(),
+          net_profit_loss: cells[2]?.innerText.trim(),
+          earnings_per_share: cells[3]?.innerText.trim(),
+        };
+      }).filter(quarter => quarter.quarter_ended);
+    });
+    if (!quarters.length) throw new ScrapeError('No financial data found', 'no_data', false);
+    return { ticker, ...quarters[0], quarters };
+  }
+
+  async worker(slot) {
+    while (!this.closed) {
+      const job = this.queue.shift() || await new Promise(resolve => this.waiting.push(resolve));
+      if (!job) continue;
+      job.attempts++;
+      try {
+        const page = await this.getPage(slot);
+        const data = await this.scrapeTicker(page, job.ticker);
+        this.stats.scraped++;
+        job.resolve({ ok: true, data });
+      } catch (err) {
+        const error = classifyError(err);
+        if (error.kind === 'page_crashed' && this.pages[slot]) {
+          // Close the crashed page so its target is released before the slot opens a new one
+          this.pages[slot].close().catch(() => {});
+          this.pages[slot] = null;
+        }
+        if (error.retryable && job.attempts < MAX_ATTEMPTS && !this.closed) {
+          // Back off without holding the page; it moves on to the next ticker meanwhile
+          const delay = backoffDelay(job.attempts);
+          console.warn(`🔁 ${job.ticker}: ${error.kind} (${error.message}), retry ${job.attempts}/${MAX_ATTEMPTS - 1} in ${Math.round(delay)} ms`);
+          this.stats.retries++;
+          setTimeout(() => this.enqueue(job), delay);
+        } else {
+          this.stats.failed++;
+          console.error(`❌ Failed to scrape ${job.ticker}: ${error.message}`);
+          job.resolve({ ok: false, ticker: job.ticker, kind: error.kind, error: error.message, attempts: job.attempts });
+        }
+      }
+    }
+  }
+
+  enqueue(job) {
+    const idle = this.waiting.shift();
+    if (idle) idle(job);
+    else this.queue.push(job);
+  }
+
+  // A ticker already being fetched for another caller is shared rather than loaded twice
+  scrape(ticker) {
+    if (!this.inFlight.has(ticker)) {
+      const promise = new Promise(resolve => this.enqueue({ ticker, attempts: 0, resolve }))
+        .finally(() => this.inFlight.delete(ticker));
+      this.inFlight.set(ticker, promise);
+    }
+    return this.inFlight.get(ticker);
+  }
+
+  async scrapeMany(tickers) {
+    const outcomes = await Promise.all([...new Set(tickers)].map(ticker => this.scrape(ticker)));
+    return {
+      results: outcomes.filter(o => o.ok).map(o => o.data),
+      failed: outcomes.filter(o => !o.ok).map(({ ok, ...failure }) => failure),
+    };
+  }
+
+  health() {
+    return {
+      status: 'ok',
+      browser: Boolean(this.browser),
+      pages: this.size,
+      queued: this.queue.length,
+      in_flight: this.inFlight.size,
+      session_age_s: this.sessionAt ? Math.round((Date.now() - this.sessionAt) / 1000) : null,
+      ...this.stats,
+    };
+  }
+
+  async close() {
+    this.closed = true;
+    this.waiting.splice(0).forEach(resolve => resolve(null));
+    if (this.browser) await this.browser.close().catch(() => {});
+    this.browser = null;
+  }
+}
+
+// === Local HTTP service on a Unix socket, shared by every API worker ===
+function readJson(req) {
+  return new Promise((resolve, reject) => {
+    let body = '';
+    req.on('data', chunk => { body += chunk; });
+    req.on('end', () => {
+      try { resolve(body ? JSON.parse(body) : {}); } catch (err) { reject(err); }
+    });
+    req.on('error', reject);
+  });
+}
+
+function sendJson(res, status, payload) {
+  const body = JSON.stringify(payload);
+  res.writeHead(status, { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) });
+  res.end(body);
+}
+
+function createServer(pool) {
+  return http.createServer(async (req, res) => {
+    try {
+      if (req.method === 'GET' && req.url === '/health') return sendJson(res, 200, pool.health());
+      if (req.method === 'POST' && req.url === '/scrape') {
+        const { tickers } = await readJson(req);
+        if (!Array.isArray(tickers) || tickers.length === 0) {
+          return sendJson(res, 400, { error: 'Expected {"tickers": [...]}' });
+        }
+        return sendJson(res, 200, await pool.scrapeMany(tickers.map(t => String(t).trim().toUpperCase()).filter(Boolean)));
+      }
+      sendJson(res, 404, { error: 'Not found' });
+    } catch (err) {
+      sendJson(res, 500, { error: err.message });
+    }
+  });
+}
+
+// Resolves true when another service is already answering on the socket
+function socketInUse(path) {
+  return new Promise(resolve => {
+    const conn = net.connect(path);
+    conn.on('connect', () => { conn.end(); resolve(true); });
+    conn.on('error', () => resolve(false));
+  });
+}
+
+async function serve(socketPath = SOCKET_PATH, pool = new ScraperPool()) {
+  if (fs.existsSync(socketPath)) {
+    if (await socketInUse(socketPath)) {
+      console.log(`Scraper service already running on ${socketPath}`);
+      await pool.close();
+      return null;
+    }
+    fs.unlinkSync(socketPath); // left behind by a service that died
+  }
+  const server = createServer(pool);
+  try {
+    await new Promise((resolve, reject) => {
+      server.once('error', reject);
+      server.listen(socketPath, resolve);
+    });
+  } catch (err) {
+    // Two API workers can start the service at the same moment; the second one bows out
+    if (err.code !== 'EADDRINUSE' || !(await socketInUse(socketPath))) throw err;
+    console.log(`Scraper service already running on ${socketPath}`);
+    await pool.close();
+    return null;
+  }
+  console.log(`✅ Scraper service listening on ${socketPath} (${pool.size} pages, ${REQUESTS_PER_SECOND}/s)`);
+
+  const shutdown = async () => {
+    server.close();
+    await pool.close();
+    if (fs.existsSync(socketPath)) fs.unlinkSync(socketPath);
+    process.exit(0);
+  };
+  process.on('SIGTERM', shutdown);
+  process.on('SIGINT', shutdown);
+  return server;
+}
+
+module.exports = { ScraperPool, ScrapeError, RateLimiter, createServer, serve };
+
+if (require.main === module) {
+  serve().catch(err => {
+    console.error('Scraper service failed to start:', err.message);
+    process.exit(1);
+  });
+}
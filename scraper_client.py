@@ -0,0 +1,93 @@
+import asyncio
+import os
+import subprocess
+import time
+from typing import List, Dict, Optional
+
+import httpx
+
+# --- Config ---
+# scrape_service.js keeps one warm browser for every API worker; it is started on first use
+SCRAPER_SOCKET = os.getenv("SCRAPER_SOCKET", "/tmp/nse_scraper.sock")
+SCRAPER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scrape_service.js")
+SCRAPER_LOG = os.getenv("SCRAPER_LOG", "scraper_service.log")
+SCRAPER_AUTOSTART = os.getenv("SCRAPER_AUTOSTART", "1") == "1"
+SCRAPER_START_TIMEOUT = float(os.getenv("SCRAPER_START_TIMEOUT", "30"))
+SCRAPER_REQUEST_TIMEOUT = float(os.getenv("SCRAPER_REQUEST_TIMEOUT", "600"))
+
+scraper_http: Optional[httpx.AsyncClient] = None
+_start_lock: Optional[asyncio.Lock] = None
+
+
+def get_scraper_http() -> httpx.AsyncClient:
+    # One keep-alive connection pool over the Unix socket per process
+    global scraper_http
+    if scraper_http is None:
+        scraper_http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=SCRAPER_SOCKET),
+            base_url="http://scraper",
+            timeout=httpx.Timeout(SCRAPER_REQUEST_TIMEOUT, connect=5.0),
+        )
+    return scraper_http
+
+
+async def close_scraper_http():
+    global scraper_http
+    if scraper_http is not None:
+        await scraper_http.aclose()
+        scraper_http = None
+
+
+async def scraper_health() -> Optional[Dict]:
+    try:
+        response = await get_scraper_http().get("/health", timeout=5.0)
+        return response.json() if response.status_code == 200 else None
+    except (httpx.TransportError, ValueError):
+        return None
+
+
+def _spawn_service():
+    log = open(SCRAPER_LOG, "a")
+    # Own session so the browser outlives a reloaded or restarted API worker
+    subprocess.Popen(["node", SCRAPER_SCRIPT], cwd=os.path.dirname(SCRAPER_SCRIPT),
+                     stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                     env={**os.environ, "SCRAPER_SOCKET": SCRAPER_SOCKET})
+    log.close()
+
+
+async def ensure_scraper():
+    global _start_lock
+    if await scraper_health() is not None:
+        return
+    if not SCRAPER_AUTOSTART:
+        raise RuntimeError(f"Scraper service is not running on {SCRAPER_SOCKET}")
+    if _start_lock is None:
+        _start_lock = asyncio.Lock()
+    async with _start_lock:
+        if await scraper_health() is not None:
+            return
+        print(f"Starting scraper service on {SCRAPER_SOCKET}")
+        _spawn_service()
+        deadline = time.monotonic() + SCRAPER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+            if await scraper_health() is not None:
+                return
+    raise RuntimeError(f"Scraper service did not start within {SCRAPER_START_TIMEOUT:.0f}s, see {SCRAPER_LOG}")
+
+
+async def scrape_tickers(tickers: List[str]) -> Dict:
+    """Latest quarter for each ticker: {"results": [...], "failed": [{ticker, kind, error, attempts}]}."""
+    await ensure_scraper()
+    for attempt in range(2):
+        try:
+            response = await get_scraper_http().post("/scrape", json={"tickers": tickers})
+            break
+        except (httpx.ConnectError, httpx.RemoteProtocolError):
+            # The service went away between the health check and the request; start it again once
+            if attempt:
+                raise
+            await ensure_scraper()
+    if response.status_code != 200:
+        raise RuntimeError(f"Scraper service returned {response.status_code}: {response.text}")
+    return response.json()
@@ -12,6 +12,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const generateReportButton = document.getElementById('generateReportButton');
     const downloadLink = document.getElementById('downloadLink');
 
+    // Workspace returned by /upload; every analysis request is scoped to it
+    let workspaceId = null;
+
     
     
 
@@ -52,6 +55,9 @@ document.addEventListener('DOMContentLoaded', function() {
         Array.from(fileInput.files).forEach(file => {
             formData.append('files', file);
         });
+        if (workspaceId) {
+            formData.append('workspace_id', workspaceId);
+        }
         
         uploadStatus.textContent = `Uploading ${fileInput.files.length} file(s)...`;
         uploadButton.disabled = true;
@@ -65,12 +71,18 @@ document.addEventListener('DOMContentLoaded', function() {
             const result = await response.json();
             
             if (response.ok) {
-                uploadStatus.textContent = `✅ ${result.status} - Files: ${result.filenames.join(', ')}`;
-                // Enable prompt buttons after successful upload
+                workspaceId = result.workspace_id;
+                showIndexStatus(result);
+                // Questions work straight away; one asked before indexing finishes waits for it
                 enablePromptButtons();
                 // Enable custom query input after successful upload
                 enableCustomQuery();
+                if (!result.ready) pollIndexStatus(workspaceId);
             } else {
+                if (response.status === 404) {
+                    // Workspace expired on the server; the next upload starts a fresh one
+                    workspaceId = null;
+                }
                 uploadStatus.textContent = `❌ Error: ${result.error || 'Upload failed'}`;
             }
         } catch (error) {
@@ -80,6 +92,35 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    function showIndexStatus(result) {
+        const pending = result.documents.filter(doc => doc.status !== 'ready');
+        const failed = pending.filter(doc => doc.status === 'failed');
+        const names = result.documents.map(doc => doc.filename).join(', ');
+        if (failed.length) {
+            uploadStatus.textContent = `⚠️ Indexing failed for ${failed.map(doc => doc.filename).join(', ')}, retrying...`;
+        } else if (pending.length) {
+            uploadStatus.textContent = `⏳ Uploaded, indexing ${pending.length} of ${result.documents.length} file(s): ${names}`;
+        } else {
+            uploadStatus.textContent = `✅ Ready - Files: ${names}`;
+        }
+    }
+
+    // Background indexing progress for the current workspace
+    async function pollIndexStatus(id) {
+        while (id === workspaceId) {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            try {
+                const response = await fetch(`/upload/status?workspace_id=${encodeURIComponent(id)}`);
+                if (!response.ok || id !== workspaceId) return;
+                const result = await response.json();
+                showIndexStatus(result);
+                if (result.ready) return;
+            } catch (error) {
+                return;
+            }
+        }
+    }
+
     // Enable prompt buttons
     function enablePromptButtons() {
         promptButtons.forEach(button => {
@@ -93,6 +134,82 @@ document.addEventListener('DOMContentLoaded', function() {
         customQueryButton.disabled = false;
     }
     
+    // Render an SSE analysis stream: steps as they happen, then answer tokens, then the final answer
+    async function streamAnalysis(url, formData) {
+        let stepsList = null;
+        let answerText = null;
+
+        function showOutput() {
+            if (stepsList) return;
+            loadingIndicator.classList.add('hidden');
+            answerContainer.innerHTML = '';
+            stepsList = document.createElement('ul');
+            stepsList.className = 'analysis-steps';
+            answerText = document.createElement('div');
+            answerText.className = 'analysis-answer';
+            answerContainer.append(stepsList, answerText);
+            answerContainer.classList.remove('hidden');
+        }
+
+        function showError(message) {
+            loadingIndicator.classList.add('hidden');
+            answerContainer.textContent = `Error: ${message}`;
+            answerContainer.classList.remove('hidden');
+        }
+
+        function handleEvent(event, data) {
+            showOutput();
+            if (event === 'step') {
+                const item = document.createElement('li');
+                item.textContent = data.step;
+                stepsList.appendChild(item);
+            } else if (event === 'token') {
+                answerText.textContent += data.token;
+            } else if (event === 'done') {
+                // Final answer may contain HTML tables - use innerHTML
+                answerContainer.innerHTML = data.answer;
+            } else if (event === 'error') {
+                showError(data.error || 'Analysis failed');
+            }
+        }
+
+        try {
+            const response = await fetch(url, {
+                method: 'POST',
+                body: formData
+            });
+
+            if (!response.ok) {
+                const result = await response.json();
+                showError(result.error || 'Analysis failed');
+                return;
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const message = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message';
+                    let data = '';
+                    message.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    });
+                    if (data) handleEvent(event, JSON.parse(data));
+                }
+            }
+        } catch (error) {
+            showError(error.message);
+        }
+    }
+
     // Handle prompt button clicks
     promptButtons.forEach(button => {
         button.addEventListener('click', async function() {
@@ -106,33 +223,9 @@ document.addEventListener('DOMContentLoaded', function() {
             // Create form data for analysis request
             const formData = new FormData();
             formData.append('prompt_key', promptKey);
+            formData.append('workspace_id', workspaceId);
             
-            try {
-                const response = await fetch('/analyze', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const result = await response.json();
-                
-                // Hide loading
-                loadingIndicator.classList.add('hidden');
-                
-                if (response.ok) {
-                    // Display answer - use innerHTML to render HTML tables
-                    if (result.answer) {
-                        answerContainer.innerHTML = result.answer;
-                        answerContainer.classList.remove('hidden');
-                    }
-                } else {
-                    answerContainer.textContent = `Error: ${result.error || 'Analysis failed'}`;
-                    answerContainer.classList.remove('hidden');
-                }
-            } catch (error) {
-                loadingIndicator.classList.add('hidden');
-                answerContainer.classList.remove('hidden');
-                answerContainer.textContent = `Error: ${error.message}`;
-            }
+            await streamAnalysis('/analyze/stream', formData);
         });
     });
     
@@ -155,33 +248,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Create form data for custom query request
         const formData = new FormData();
         formData.append('custom_query', query);
+        formData.append('workspace_id', workspaceId);
         
-        try {
-            const response = await fetch('/analyze_custom', {
-                method: 'POST',
-                body: formData
-            });
-            
-            const result = await response.json();
-            
-            // Hide loading
-            loadingIndicator.classList.add('hidden');
-            
-            if (response.ok) {
-                // Display answer - use innerHTML to render HTML tables
-                if (result.answer) {
-                    answerContainer.innerHTML = result.answer;
-                    answerContainer.classList.remove('hidden');
-                }
-            } else {
-                answerContainer.textContent = `Error: ${result.error || 'Analysis failed'}`;
-                answerContainer.classList.remove('hidden');
-            }
-        } catch (error) {
-            loadingIndicator.classList.add('hidden');
-            answerContainer.classList.remove('hidden');
-            answerContainer.textContent = `Error: ${error.message}`;
-        }
+        await streamAnalysis('/analyze_custom/stream', formData);
     });
     
     // Allow Enter key to submit custom query
@@ -214,7 +283,9 @@ generateReportButton.addEventListener('click', async () => {
     const spinner = loadingIndicatorfullreport.querySelector('.spinner');
 
     try {
-        const response = await fetch('/generate_report', { method: 'POST' });
+        const formData = new FormData();
+        formData.append('workspace_id', workspaceId);
+        const response = await fetch('/generate_report', { method: 'POST', body: formData });
 
         if (!response.ok) {
             const error = await response.json();
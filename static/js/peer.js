@@ -9,33 +9,105 @@ document.addEventListener('DOMContentLoaded', () => {
             alert('Please enter at least one ticker');
             return;
         }
-        peersResult.textContent = "Loading...";
+        // Tickers seen before render straight away from the browser cache, then refresh
+        const requested = [...new Set(tickers.split(',').map(t => t.trim().toUpperCase()).filter(Boolean))];
+        const cached = readCachedRows(requested);
+        if (cached) {
+            renderRows(peersResult, cached);
+        } else {
+            peersResult.textContent = "Loading...";
+        }
         try {
-            const response = await fetch(`/scrape_nse?tickers=${encodeURIComponent(tickers)}`);
+            const response = await fetch(`/peers/analytics?tickers=${encodeURIComponent(tickers)}`);
             if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-
-            if (!data.length) {
-                peersResult.textContent = "No data found.";
-                return;
-            }
-
-            peersResult.innerHTML = generateTableFromJSON(data);
+            const data = (await response.json()).tickers;
+            writeCachedRows(requested, data);
+            renderRows(peersResult, data);
         } catch (err) {
-            peersResult.textContent = `Error: ${err.message}`;
+            if (!cached) peersResult.textContent = `Error: ${err.message}`;
         }
     });
 });
 
-function generateTableFromJSON(data) {
-    const columnsToShow = ['ticker', 'quarter_ended', 'total_income', 'net_profit_loss', 'earnings_per_share'];
+// Each ticker is stored as { at, row } so the oldest entries can be dropped once there are more
+// than PEER_CACHE_MAX_ENTRIES; the old unversioned key held bare rows and is discarded
+const PEER_CACHE_KEY = 'peerAnalytics.v2';
+const PEER_CACHE_MAX_ENTRIES = 500;
+localStorage.removeItem('peerAnalytics');
+
+function loadPeerCache() {
+    try {
+        return JSON.parse(localStorage.getItem(PEER_CACHE_KEY)) || {};
+    } catch (err) {
+        return {};
+    }
+}
 
+// Returns rows in request order, or null unless every ticker has been seen before
+function readCachedRows(tickers) {
+    const cache = loadPeerCache();
+    if (!tickers.every(t => t in cache)) return null;
+    return tickers.map(t => cache[t].row).filter(Boolean);
+}
+
+// Keeps the newest `limit` entries
+function evictOldest(cache, limit) {
+    const newest = Object.entries(cache).sort(([, a], [, b]) => b.at - a.at).slice(0, limit);
+    return Object.fromEntries(newest);
+}
+
+function writeCachedRows(tickers, rows) {
+    let cache = loadPeerCache();
+    const at = Date.now();
+    tickers.forEach(t => { cache[t] = { at, row: null }; });  // remembered as having no data
+    rows.forEach(row => { cache[row.ticker] = { at, row }; });
+    cache = evictOldest(cache, PEER_CACHE_MAX_ENTRIES);
+    // Over quota: halve the cache until it fits, and give up on caching if even that fails
+    while (Object.keys(cache).length) {
+        try {
+            localStorage.setItem(PEER_CACHE_KEY, JSON.stringify(cache));
+            return;
+        } catch (err) {
+            cache = evictOldest(cache, Math.floor(Object.keys(cache).length / 2));
+        }
+    }
+    localStorage.removeItem(PEER_CACHE_KEY);
+}
+
+function renderRows(container, data) {
+    if (!data.length) {
+        container.textContent = "No data found.";
+        return;
+    }
+    container.innerHTML = generateTableFromJSON(data);
+}
+
+const number = value => value.toLocaleString(undefined, { maximumFractionDigits: 2 });
+const percent = value => `${(value * 100).toFixed(1)}%`;
+const rank = value => value.toFixed(0);
+
+// [header, value of a row, formatter for numbers]
+const PEER_COLUMNS = [
+    ['ticker', row => row.ticker],
+    ['quarter_ended', row => row.quarter_ended],
+    ['total_income', row => row.total_income, number],
+    ['net_profit_loss', row => row.net_profit_loss, number],
+    ['earnings_per_share', row => row.earnings_per_share, number],
+    ['net_margin', row => row.net_margin, percent],
+    ['income_yoy', row => row.income_growth_yoy, percent],
+    ['profit_yoy', row => row.profit_growth_yoy, percent],
+    ['ttm_net_profit', row => row.ttm_net_profit, number],
+    ['margin_rank', row => row.peer_ranks?.net_margin, rank],
+    ['growth_rank', row => row.peer_ranks?.income_growth_yoy, rank],
+];
+
+function generateTableFromJSON(data) {
     let table = '<table style="border: 1px solid black; border-collapse: collapse; width: 100%;">';
 
     // Header
     table += '<thead><tr>';
-    columnsToShow.forEach(key => {
-        table += `<th style="border: 1px solid black; padding: 4px;">${key}</th>`;
+    PEER_COLUMNS.forEach(([header]) => {
+        table += `<th style="border: 1px solid black; padding: 4px;">${header}</th>`;
     });
     table += '</tr></thead>';
 
@@ -43,8 +115,11 @@ function generateTableFromJSON(data) {
     table += '<tbody>';
     data.forEach(row => {
         table += '<tr>';
-        columnsToShow.forEach(col => {
-            table += `<td style="border: 1px solid black; padding: 4px;">${row[col] ?? ''}</td>`;
+        PEER_COLUMNS.forEach(([, value, format]) => {
+            const cell = value(row);
+            const text = cell == null ? '' : format ? format(cell) : cell;
+            const align = format ? ' text-align: right;' : '';
+            table += `<td style="border: 1px solid black; padding: 4px;${align}">${text}</td>`;
         });
         table += '</tr>';
     });
@@ -0,0 +1,49 @@
+const fs = require('fs');
+const http = require('http');
+const os = require('os');
+const path = require('path');
+const test = require('node:test');
+const assert = require('node:assert');
+const { parseQuarter, mergeSnapshot } = require('../scrape_local');
+
+test('parseQuarter reads upper-case months as NSE sometimes prints them', () => {
+  assert.strictEqual(parseQuarter('30-SEP-2024'), Date.UTC(2024, 8, 30));
+  assert.strictEqual(parseQuarter('31-mar-2025'), parseQuarter('31-Mar-2025'));
+  assert.strictEqual(parseQuarter('31-Foo-2025'), null);
+});
+
+test('mergeSnapshot keeps tickers this run did not scrape', () => {
+  const previous = [{ ticker: 'TCS', quarter_ended: '31-Dec-2024' }, { ticker: 'INFY', quarter_ended: '31-Dec-2024' }];
+  const rows = [{ ticker: 'INFY', quarter_ended: '31-Mar-2025' }, { ticker: 'WIPRO', quarter_ended: '31-Mar-2025' }];
+  assert.deepStrictEqual(mergeSnapshot(previous, rows), [
+    { ticker: 'INFY', quarter_ended: '31-Mar-2025' },
+    { ticker: 'TCS', quarter_ended: '31-Dec-2024' },
+    { ticker: 'WIPRO', quarter_ended: '31-Mar-2025' },
+  ]);
+});
+
+test('loadStoredQuarters keeps the newer of Supabase and scrape_state.json', async t => {
+  const rows = [{ ticker: 'INFY', quarter_ended: '31-Dec-2024' }, { ticker: 'TCS', quarter_ended: '31-MAR-2025' }];
+  const server = http.createServer((req, res) => {
+    res.setHeader('Content-Type', 'application/json');
+    res.end(JSON.stringify(new URL(req.url, 'http://x').searchParams.get('offset') === '0' ? rows : []));
+  });
+  await new Promise(resolve => server.listen(0, '127.0.0.1', resolve));
+  const cwd = process.cwd();
+  const dir = fs.mkdtempSync(path.join(os.tmpdir(), 'scrape-state-'));
+  t.after(() => { server.close(); process.chdir(cwd); });
+
+  // Scraped by a run without --load: newer than what Supabase has for INFY
+  fs.writeFileSync(path.join(dir, 'scrape_state.json'), JSON.stringify({ INFY: '31-Mar-2025', WIPRO: '30-Sep-2024' }));
+  process.chdir(dir);
+  process.env.SUPABASE_URL = `http://127.0.0.1:${server.address().port}`;
+  process.env.SUPABASE_SERVICE_KEY = 'test';
+  delete require.cache[require.resolve('../scrape_local')];
+  const { loadStoredQuarters } = require('../scrape_local');
+
+  assert.deepStrictEqual(await loadStoredQuarters(), {
+    INFY: Date.UTC(2025, 2, 31),
+    TCS: Date.UTC(2025, 2, 31),
+    WIPRO: Date.UTC(2024, 8, 30),
+  });
+});
@@ -0,0 +1,68 @@
+"""A workspace whose documents have no text (scans with no OCR engine) still gets answers."""
+import asyncio
+import os
+import sys
+import tempfile
+
+import fitz  # PyMuPDF
+import httpx
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fakes import start_fake_openai  # noqa: E402
+
+WORKDIR = tempfile.mkdtemp(prefix="test-empty-")
+OPENAI = start_fake_openai(embedding_latency=0, chat_latency=0)
+os.environ.update(
+    OPENAI_KEY="fake", OPENAI_BASE_URL=OPENAI.url + "/v1", OCR_ENABLED="0", PDF_EXTRACT_WORKERS="1",
+    DOC_INDEX_DIR=os.path.join(WORKDIR, "index"), WORKSPACE_DIR=os.path.join(WORKDIR, "workspaces"),
+    ANSWER_CACHE_DIR=os.path.join(WORKDIR, "answers"), CORPUS_INDEX_DIR=os.path.join(WORKDIR, "corpus"),
+)
+
+from retrieval import hybrid_scores  # noqa: E402
+
+
+def scanned_pdf(path: str) -> str:
+    # One page that is only an image, as a scanner would produce
+    doc = fitz.open()
+    page = doc.new_page()
+    pixmap = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 200, 200), False)
+    pixmap.clear_with(200)
+    page.insert_image(page.rect, pixmap=pixmap)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_hybrid_scores_without_chunks():
+    scores = hybrid_scores(np.zeros((1, 0), dtype=np.float32), np.zeros((1, 0), dtype=np.float32))
+    assert scores.shape == (1, 0)
+
+
+def test_rank_chunks_without_chunks():
+    import main_scrape
+    assert main_scrape.rank_chunks_by_question([], "What was revenue?") == []
+
+
+def test_analyze_empty_workspace():
+    import main_supa
+    path = scanned_pdf(os.path.join(WORKDIR, "scan.pdf"))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_supa.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as http:
+            with open(path, "rb") as f:
+                upload = (await http.post("/upload", files=[("files", ("scan.pdf", f, "application/pdf"))])).json()
+            workspace_id = upload["workspace_id"]
+            analyze = await http.post("/analyze", data={"prompt_key": "custom", "custom_query": "What was revenue?",
+                                                        "workspace_id": workspace_id})
+            report = await http.post("/generate_report", data={"sections": "Financials", "workspace_id": workspace_id})
+            return analyze, report
+
+    analyze, report = asyncio.run(run())
+    assert analyze.status_code == 200
+    assert analyze.json()["total_chunks"] == 0
+    assert report.status_code == 200
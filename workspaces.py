@@ -0,0 +1,175 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple, BinaryIO
+
+from doc_index import sha256_bytes
+
+# --- Config ---
+# Every uvicorn worker points at the same directory; the SQLite manifest (WAL mode) is the shared state
+WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", ".workspaces")
+WORKSPACE_TTL_SECONDS = int(os.getenv("WORKSPACE_TTL_SECONDS", str(24 * 3600)))
+ORPHAN_GRACE_SECONDS = 600  # files younger than this may belong to an upload still in progress
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+_schema_ready = set()
+
+
+def _manifest_path() -> str:
+    return os.path.join(WORKSPACE_DIR, "manifest.sqlite3")
+
+
+def _files_dir() -> str:
+    return os.path.join(WORKSPACE_DIR, "files")
+
+
+def _connect() -> sqlite3.Connection:
+    path = _manifest_path()
+    os.makedirs(_files_dir(), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if path not in _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS workspaces (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                workspace_id TEXT NOT NULL REFERENCES workspaces(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (workspace_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS documents_sha256 ON documents(sha256);
+            CREATE INDEX IF NOT EXISTS workspaces_last_used ON workspaces(last_used_at);
+        """)
+        _schema_ready.add(path)
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+@contextmanager
+def _manifest():
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pdf_path(sha: str) -> str:
+    return os.path.join(_files_dir(), f"{sha}.pdf")
+
+
+def store_pdf(content: bytes) -> Tuple[str, str]:
+    """Write PDF bytes to the shared content-addressed store; identical uploads share one file."""
+    sha = sha256_bytes(content)
+    path = pdf_path(sha)
+    if os.path.exists(path):
+        os.utime(path)
+        return sha, path
+    os.makedirs(_files_dir(), exist_ok=True)
+    fd, staging = tempfile.mkstemp(suffix=".part", dir=_files_dir())
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(staging, path)
+    except Exception:
+        if os.path.exists(staging):
+            os.unlink(staging)
+        raise
+    return sha, path
+
+
+def store_pdf_stream(source: BinaryIO, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Tuple[str, str]:
+    """store_pdf for a file object: copied in `chunk_size` blocks and hashed on the way, so only
+    one block is ever in memory."""
+    os.makedirs(_files_dir(), exist_ok=True)
+    digest = hashlib.sha256()
+    fd, staging = tempfile.mkstemp(suffix=".part", dir=_files_dir())
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in iter(lambda: source.read(chunk_size), b""):
+                digest.update(block)
+                f.write(block)
+        sha = digest.hexdigest()
+        path = pdf_path(sha)
+        if os.path.exists(path):
+            os.unlink(staging)
+            os.utime(path)
+        else:
+            os.replace(staging, path)
+    except Exception:
+        if os.path.exists(staging):
+            os.unlink(staging)
+        raise
+    return sha, path
+
+
+def create_workspace() -> str:
+    workspace_id = uuid.uuid4().hex
+    now = time.time()
+    with _manifest() as conn:
+        conn.execute("INSERT INTO workspaces (id, created_at, last_used_at) VALUES (?, ?, ?)",
+                     (workspace_id, now, now))
+    return workspace_id
+
+
+def workspace_exists(workspace_id: str, ttl: int = WORKSPACE_TTL_SECONDS) -> bool:
+    with _manifest() as conn:
+        row = conn.execute("SELECT last_used_at FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+    return row is not None and row["last_used_at"] >= time.time() - ttl
+
+
+def set_documents(workspace_id: str, documents: List[Dict]):
+    """Replace the workspace's document set with `documents` ({"filename", "sha256"}), in order."""
+    with _manifest() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM documents WHERE workspace_id = ?", (workspace_id,))
+        conn.executemany(
+            "INSERT INTO documents (workspace_id, position, filename, sha256) VALUES (?, ?, ?, ?)",
+            [(workspace_id, i, doc["filename"], doc["sha256"]) for i, doc in enumerate(documents)],
+        )
+        conn.execute("UPDATE workspaces SET last_used_at = ? WHERE id = ?", (time.time(), workspace_id))
+        conn.execute("COMMIT")
+
+
+def get_documents(workspace_id: str, ttl: int = WORKSPACE_TTL_SECONDS) -> Optional[List[Dict]]:
+    """Documents of a live workspace in upload order (refreshing its TTL), or None if unknown/expired."""
+    if not workspace_exists(workspace_id, ttl):
+        return None
+    with _manifest() as conn:
+        conn.execute("UPDATE workspaces SET last_used_at = ? WHERE id = ?", (time.time(), workspace_id))
+        rows = conn.execute(
+            "SELECT filename, sha256 FROM documents WHERE workspace_id = ? ORDER BY position",
+            (workspace_id,),
+        ).fetchall()
+    return [{"filename": row["filename"], "sha256": row["sha256"], "path": pdf_path(row["sha256"])} for row in rows]
+
+
+def cleanup_expired(ttl: int = WORKSPACE_TTL_SECONDS) -> Dict:
+    """Drop workspaces idle for longer than `ttl` and delete PDFs no live workspace references."""
+    cutoff = time.time() - ttl
+    with _manifest() as conn:
+        removed = conn.execute("DELETE FROM workspaces WHERE last_used_at < ?", (cutoff,)).rowcount
+        referenced = {row["sha256"] for row in conn.execute("SELECT DISTINCT sha256 FROM documents")}
+
+    deleted_files = 0
+    grace_cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    for name in os.listdir(_files_dir()):
+        path = os.path.join(_files_dir(), name)
+        sha = name.split(".", 1)[0]
+        try:
+            if sha not in referenced and os.path.getmtime(path) < grace_cutoff:
+                os.unlink(path)
+                deleted_files += 1
+        except OSError:
+            pass
+    return {"workspaces": removed, "files": deleted_files}